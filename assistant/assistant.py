@@ -3,28 +3,76 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import json
 import os
 import sys
 import time
-
-from openai import AzureOpenAI
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 import rpm.rpm
 import spec.spec
 import srpm.srpm
 import assistant_funcs.assistant_funcs
+import ratelimit.ratelimit
+import verdicts.verdicts
+import deepscan.deepscan
+import facts.facts
+import digest.digest
+import replay.replay
+import credentials.credentials
+import ownership.ownership
+import provenance.provenance
+import headers.headers
+import delta.delta
+import report.report
+import ledger.ledger
+import tracing.tracing
+import chat.chat
+import prefetch.prefetch
 
 timeout_override = 120
+# Seconds between polls of a run's status
+poll_interval = 1
+
+# Tool rounds a run gets to wrap up once it is over budget, before it is cancelled
+budget_grace_rounds = 2
+budget_message = ("The time or token budget for this review is used up. Do not call any more functions, give your final answer "
+                  "now from what you have found so far, and say that the review was cut short.")
+
+# Bump whenever the prompts change in a way that should invalidate cached verdicts.
+prompt_version = 2
+
+assistant_instructions = (
+    f"You are a very skilled AI assistant that specializes in working with open source project licenses. "
+    f"You have access to a sandbox environment where you can investigate a .rpm file, the .src.rpm it was generated from, and the .spec file used to generate it. "
+    f"Your goal is to determine if all .rpm files have suitable license files included in them, and if the license files are correct. "
+    f"You may access the contents of the .rpm files, the .src.rpm file, and the .spec file via the provided functions. "
+    "Extra Background: Not every .rpm must have license files:\n"
+    "- a package with executables will likely require a license file, check the source RPM to determine this\n"
+    "- a package with other types of files may not require a license\n"
+    "- a package may use a 'Requires' directive to pull in a license file from another sub-package in the same .spec file\n"
+    "- etc.\n"
+    " (e.g. a '-devel' package may require the license file from the main package, or a main package may use the license files from a '-libs' subpackage) "
+    "Consider the interdependencies between packages when determining if a license file is required. Any such dependencies must be explicitly stated in the .spec file, or "
+    "validated via querying the .rpm files' dependencies. Documentation is insufficient to ensure license compliance. "
+    "The .spec file should be considered unreliable, as it may not accurately reflect the actual licensing requirements of the package. Use rpm_dependency_info() to validate all dependencies "
+    " and rpm_read_file() to check the actual license files if needed."
+    "\n"
+    "Be concise in your output, explanations are not important, just the final verdict and a very brief summary. Include information about dependencies where necessary. "
+)
+
 
 class ProvideAssessmentFunc(assistant_funcs.assistant_funcs.OpenAIAssistantFunc):
-    issue_list = []
     __provide_assessment_name = "provide_assessment"
     __provide_assessment_description = "Provide an assessment of the licensing situation for the provided packages."
     __provide_assessment_parameters = {
+        "package": {
+            "type": "string",
+            "description": "REQUIRED: The .rpm file the assessment is for, exactly as it was given to you."
+        },
         "file": {
             "type": "string",
-            "description": "REQUIRED: The file to declare an issue with."
+            "description": "REQUIRED: The file to declare an issue with, either the .rpm itself or a path inside it."
         },
         "has_issue": {
             "type": "boolean",
@@ -43,8 +91,25 @@ class ProvideAssessmentFunc(assistant_funcs.assistant_funcs.OpenAIAssistantFunc)
 
     def __init__(self) -> None:
         super().__init__(self.__provide_assessment_name, self.__provide_assessment_description, self.__provide_assessment_parameters)
-
-    def call(self, file, has_issue, severity="none", description=None) -> str:
+        # Issues are per instance, so each job's tool set collects its own.
+        self.issue_list = []
+        # Called with each issue as it is recorded, ie to stream it to a report
+        self.on_issue = None
+        self.rpm_files = []
+
+    def set_rpm_files(self, rpm_files:list[str]) -> None:
+        """Sets the packages being reviewed, every assessment must name one of them."""
+        self.rpm_files = list(rpm_files)
+
+    def call(self, file, has_issue, severity="none", description=None, package=None) -> str:
+        if not package:
+            return "Package is required."
+        if self.rpm_files:
+            # The model may give the path or just the file name
+            matches = [f for f in self.rpm_files if f == package or os.path.basename(f) == os.path.basename(package)]
+            if len(matches) != 1:
+                return f"Unknown package '{package}', it must be one of: {', '.join(self.rpm_files)}"
+            package = matches[0]
         if not file:
             return "File is required."
         if has_issue:
@@ -57,19 +122,22 @@ class ProvideAssessmentFunc(assistant_funcs.assistant_funcs.OpenAIAssistantFunc)
                 return "Only severity level 'none' is valid if no issue exists."
             if description:
                 return "Description is only valid if an issue exists."
-        self.issue_list.append({
+        issue = {
+            "package": package,
             "file": file,
             "has_issue": has_issue,
             "severity": severity,
             "description": description
-        })
+        }
+        self.issue_list.append(issue)
+        if self.on_issue:
+            self.on_issue(issue)
         return f"Assessment for '{file}' added."
 
-    def get_issues():
-        return ProvideAssessmentFunc.issue_list
+    def get_issues(self):
+        return self.issue_list
 
 class RequestAnalysis(assistant_funcs.assistant_funcs.OpenAIAssistantFunc):
-    analysis_list = []
     __request_analysis_Name = "request_analysis"
     __request_analysis_Description = "Mark a file for further inspection"
     __request_analysis_Parameters = {
@@ -81,6 +149,8 @@ class RequestAnalysis(assistant_funcs.assistant_funcs.OpenAIAssistantFunc):
 
     def __init__(self) -> None:
         super().__init__(self.__request_analysis_Name, self.__request_analysis_Description, self.__request_analysis_Parameters)
+        # Per instance, so each tool set (ie each batch job) only sees the files requested through it
+        self.analysis_list = []
 
     def call(self, file) -> str:
         if not file:
@@ -88,54 +158,179 @@ class RequestAnalysis(assistant_funcs.assistant_funcs.OpenAIAssistantFunc):
         self.analysis_list.append(file)
         return f"Assessment for '{file}' added."
 
-    def get_files():
-        return RequestAnalysis.analysis_list
+    def get_files(self):
+        return self.analysis_list
+
 
+def get_assistant_fingerprint(tools, deployment):
+    """Returns a hash of everything that defines the assistant, an existing assistant is only reused if it matches.
+    :rtype: str
+    """
+    return verdicts.verdicts.hash_text(assistant_instructions, json.dumps(tools.getFunctions(), sort_keys=True), deployment)
+
+def find_or_create_assistant(client, tools, endpoint, deployment):
+    """Reuses an assistant with the same instructions, tools and deployment if there is one, otherwise creates it.
+    The assistant id is remembered locally, so the usual case is a single retrieve call.
+    :rtype: Assistant
+    """
+    from openai import NotFoundError
+
+    fingerprint = get_assistant_fingerprint(tools, deployment)
+    ids_path = os.path.join(assistant_funcs.assistant_funcs.get_cache_dir("assistants"), "assistants.json")
+    ids = {}
+    if os.path.exists(ids_path):
+        with open(ids_path, 'r') as f:
+            ids = json.load(f)
+    local_key = f"{endpoint}|{fingerprint}"
+
+    license_assistant = None
+    if local_key in ids:
+        try:
+            license_assistant = client.beta.assistants.retrieve(ids[local_key], timeout=timeout_override)
+        except NotFoundError:
+            pass
+        if license_assistant and (license_assistant.metadata or {}).get("fingerprint") != fingerprint:
+            license_assistant = None
+    if license_assistant is None:
+        # The assistant may have been created on another machine
+        for candidate in client.beta.assistants.list(limit=100, timeout=timeout_override):
+            if (candidate.metadata or {}).get("fingerprint") == fingerprint:
+                license_assistant = candidate
+                break
+    if license_assistant is None:
+        # https://platform.openai.com/docs/api-reference/assistants/createAssistant
+        license_assistant = client.beta.assistants.create(
+            name="License Assistant",
+            instructions=assistant_instructions,
+            tools=tools.getFunctions(),
+            model=deployment,
+            metadata={"fingerprint": fingerprint},
+            timeout=timeout_override,
+        )
+        print(f"Created assistant {license_assistant.id}")
+    else:
+        print(f"Reusing assistant {license_assistant.id}")
+
+    if ids.get(local_key) != license_assistant.id:
+        ids[local_key] = license_assistant.id
+        with open(ids_path, 'w') as f:
+            json.dump(ids, f, indent=2)
+    return license_assistant
 
 def create_assistant(tools):
-    """Returns a new client and assistant.
+    """Returns a new client, and an assistant matching the current instructions and tools.
     :rtype: tuple
     :return: A tuple of the client and assistant.
     """
+    # LICENSE_ASSISTANT_BACKEND selects 'live' (default), 'record' (live, logging the session), or 'replay' (serve a
+    # recorded session offline). LICENSE_ASSISTANT_SESSION is the session file for record and replay.
+    # LICENSE_ASSISTANT_API selects the model API for live and record: 'assistants' (default, server side threads and
+    # runs) or 'chat' (Chat Completions, with the threads kept locally, see chat.py).
+    backend = os.environ.get("LICENSE_ASSISTANT_BACKEND", "live")
+    api = os.environ.get("LICENSE_ASSISTANT_API", "assistants")
+    if api not in ["assistants", "chat"]:
+        raise ValueError(f"Unknown LICENSE_ASSISTANT_API '{api}', must be 'assistants' or 'chat'")
+    if backend == "replay":
+        global poll_interval
+        session_path = os.environ["LICENSE_ASSISTANT_SESSION"]
+        latency = float(os.environ.get("LICENSE_ASSISTANT_REPLAY_LATENCY", 0))
+        print(f"Replaying session {session_path} (latency {latency} seconds)")
+        client = replay.replay.ReplayClient(
+            session_path,
+            latency=latency,
+            rate_limit_every=int(os.environ.get("LICENSE_ASSISTANT_REPLAY_RATE_LIMIT_EVERY", 0)),
+        )
+        # Recorded runs are already in their final state, there is nothing to wait for.
+        poll_interval = 0
+        license_assistant = client.recorded_assistant()
+        return client, license_assistant
+
+    # The SDKs are slow to import, and are only needed once we actually talk to a model
+    from openai import AzureOpenAI, DefaultHttpxClient
+    from azure.identity import DefaultAzureCredential
+
     print(f"AZURE_OPENAI_ENDPOINT:{os.environ['AZURE_OPENAI_ENDPOINT']}")
     print(f"CHAT_COMPLETIONS_DEPLOYMENT_NAME:{os.environ['CHAT_COMPLETIONS_DEPLOYMENT_NAME']}")
     endpoint = os.environ["AZURE_OPENAI_ENDPOINT"]
     deployment = os.environ["CHAT_COMPLETIONS_DEPLOYMENT_NAME"]
 
-    token_provider = get_bearer_token_provider(DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default")
+    token_cache = credentials.credentials.TokenCache(DefaultAzureCredential)
+    scope = "https://cognitiveservices.azure.com/.default"
 
     client = AzureOpenAI(
         azure_endpoint=endpoint,
-        azure_ad_token_provider=token_provider,
-        api_version="2024-05-01-preview",
+        azure_ad_token_provider=token_cache.provider(scope),
+        # A rejected token is dropped from the cache, so it isn't reused by later requests or runs
+        http_client=DefaultHttpxClient(event_hooks={"response": [token_cache.response_hook(scope)]}),
+        # Streamed usage needs a newer API version than the assistants API preview
+        api_version="2024-10-21" if api == "chat" else "2024-05-01-preview",
         max_retries=20,
         timeout=timeout_override,
     )
-    # https://platform.openai.com/docs/api-reference/assistants/createAssistant
-    license_assistant = client.beta.assistants.create(
-        name="License Assistant",
-        instructions=f"You are a very skilled AI assistant that specializes in working with open source project licenses. "
-        f"You have access to a sandbox environment where you can investigate a .rpm file, the .src.rpm it was generated from, and the .spec file used to generate it. "
-        f"Your goal is to determine if all .rpm files have suitable license files included in them, and if the license files are correct. "
-        f"You may access the contents of the .rpm files, the .src.rpm file, and the .spec file via the provided functions. "
-        "Extra Background: Not every .rpm must have license files:\n"
-        "- a package with executables will likely require a license file, check the source RPM to determine this\n"
-        "- a package with other types of files may not require a license\n"
-        "- a package may use a 'Requires' directive to pull in a license file from another sub-package in the same .spec file\n"
-        "- etc.\n"
-        " (e.g. a '-devel' package may require the license file from the main package, or a main package may use the license files from a '-libs' subpackage) "
-        "Consider the interdependencies between packages when determining if a license file is required. Any such dependencies must be explicitly stated in the .spec file, or "
-        "validated via querying the .rpm files' dependencies. Documentation is insufficient to ensure license compliance. "
-        "The .spec file should be considered unreliable, as it may not accurately reflect the actual licensing requirements of the package. Use rpm_dependency_info() to validate all dependencies "
-        " and rpm_read_file() to check the actual license files if needed."
-        "\n"
-        "Be concise in your output, explanations are not important, just the final verdict and a very brief summary. Include information about dependencies where necessary. ",
-        tools=tools.getFunctions(),
-        model=deployment,
-        timeout=timeout_override,
-    )
+    if api == "chat":
+        print("Using the Chat Completions API")
+        client = chat.chat.ChatClient(client)
+    if backend == "record":
+        print(f"Recording session to {os.environ['LICENSE_ASSISTANT_SESSION']}")
+        client = replay.replay.RecordingClient(client, os.environ["LICENSE_ASSISTANT_SESSION"])
+    if api == "chat":
+        # Nothing lives on the server, the assistant is just the local definition
+        license_assistant = client.beta.assistants.create(
+            name="License Assistant",
+            instructions=assistant_instructions,
+            tools=tools.getFunctions(),
+            model=deployment,
+        )
+    else:
+        license_assistant = find_or_create_assistant(client, tools, endpoint, deployment)
     return client, license_assistant
 
+def facts_section(facts_text):
+    if not facts_text:
+        return ""
+    return ("\nThe following facts were computed locally from the package contents and are accurate. There is no need to re-derive them "
+            f"with tools, use tools only for what they leave open:\n{facts_text}")
+
+def package_prompt(rpm_file, spec_file, srpm_file, facts_text=None):
+    """Returns the prompt used to review a single .rpm.
+    :rtype: str
+    """
+    return (
+        f"From first principles, please double check that there are no licensing concerns for '{rpm_file}'. Consider the following:\n"
+        "- Does the .rpm need license files based on its contents?\n"
+        "- If it does need license files...\n"
+        "    - Are they present in the .rpm?\n"
+        "    - Are they correct?\n"
+        "    - Are all licenses covered?\n"
+        "    - If they are provided by a sub-package, will they be automatically be included dependencies? (Only dependencies on sub-packages created "
+        "by this .spec count, a dependency on an external package is insufficient).\n"
+        " - Are there any other licensing concerns?\n"
+        "Please provide a brief summary for each point, along with any other relevant information. "
+        "Each accurate assessment which passes muster during legal review will be rewarded with $500. "
+        f"All packages are created from the same .spec and .src.rpm files: {spec_file} and {srpm_file}."
+        f"Avoid using {ProvideAssessmentFunc().name()} until directed to do so."
+        f"{facts_section(facts_text)}"
+    )
+
+def delta_prompt(rpm_file, reviewed_rpm_file, reviewed_verdict, changes, spec_file, srpm_file, facts_text=None, relation="a new release of"):
+    """Returns the prompt used to review an .rpm that is a close relative of one that was already reviewed, limited to
+    how the two differ.
+    :param relation: How rpm_file relates to reviewed_rpm_file, ie a new release of it or a build for another architecture.
+    :rtype: str
+    """
+    return (
+        f"'{rpm_file}' is {relation} '{reviewed_rpm_file}', which was already reviewed. Its verdict was:\n"
+        f"{reviewed_verdict}\n\n"
+        "These are the differences between the two, computed locally from their file lists, license file contents, dependencies and spec "
+        "License tags. They are accurate, and none of those differ otherwise, but the contents of other files were not compared:\n"
+        f"{changes}\n\n"
+        "Only investigate what differs. Decide whether each point of that verdict still holds, then give the complete verdict for "
+        f"'{rpm_file}' in the same form, carrying forward whatever the differences don't affect. "
+        f"All packages are created from the same .spec and .src.rpm files: {spec_file} and {srpm_file}."
+        f"Avoid using {ProvideAssessmentFunc().name()} until directed to do so."
+        f"{facts_section(facts_text)}"
+    )
+
 def get_all_tools():
     tools = assistant_funcs.assistant_funcs.OpenAiAssistantFuncManager()
     tools.addFunction(rpm.rpm.RpmFileList())
@@ -145,23 +340,51 @@ def get_all_tools():
     tools.addFunction(spec.spec.SpecContents())
     tools.addFunction(srpm.srpm.SrpmExploreFiles())
     tools.addFunction(srpm.srpm.SrpmReadFile())
+    tools.addFunction(ownership.ownership.PathOwnership())
+    tools.addFunction(provenance.provenance.SourceProvenance())
+    tools.addFunction(headers.headers.SrpmHeaderClusters())
     tools.addFunction(assistant_funcs.assistant_funcs.APIFeedbackFunc())
     tools.addFunction(ProvideAssessmentFunc())
     tools.addFunction(RequestAnalysis())
+    tools.prefetcher = prefetch.prefetch.Prefetcher.from_env(tools)
 
     # import json
     # print(json.dumps(tools.getFunctions(), indent=2))
 
     return tools
 
+def get_schema_version(tools):
+    """Returns a version string that changes whenever the prompts or tool schemas change.
+    :rtype: str
+    """
+    return verdicts.verdicts.hash_text(prompt_version, assistant_instructions, package_prompt("{rpm}", "{spec}", "{srpm}", "{facts}"),
+                                     delta_prompt("{rpm}", "{previous}", "{verdict}", "{changes}", "{spec}", "{srpm}", "{facts}"), json.dumps(tools.getFunctions(), sort_keys=True))
+
+class RunFailed(Exception):
+    """A run ended without a usable result. Raised rather than exiting, so batch workers can record it and move on."""
+
 class ThreadRunner:
-    def __init__(self, client, assistant, tools, initial_prompt=None):
+    def __init__(self, client, assistant, tools, initial_prompt=None, scheduler=None, ledger=None):
         self.client = client
         self.assistant = assistant
         self.tools = tools
+        self.scheduler = scheduler if scheduler else ratelimit.ratelimit.scheduler
+        # Every run is accounted for in the ledger, which may also cut a run short
+        self.ledger = ledger
+        self.package = None
+        self.run_started = None
+        self.queue_seconds = 0.0
+        # Why the last run was cut short, or None
+        self.stop_reason = None
         self.thread = None
         self.run = None
         self.last_line_printed_idx = None
+        # Rough size of the thread so far, and of the text added since the last run, used to estimate the cost of a run.
+        self.context_tokens = 0
+        self.pending_chars = 0
+        self.reserved_tokens = 0
+        self.tool_rounds = 0
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
         # Initialize a new thread
         self.__start_new_thread(initial_prompt)
 
@@ -172,25 +395,84 @@ class ThreadRunner:
             self.add_prompt(prompt)
 
     def add_prompt(self, prompt):
-        message = client.beta.threads.messages.create(
+        message = self.client.beta.threads.messages.create(
             thread_id=self.thread.id,
             role="user",
             content=str(prompt),
             timeout=timeout_override,
         )
-
-    def run_agent(self, force_tool=None):
+        self.pending_chars += len(str(prompt))
+
+    def __reserve(self, new_chars):
+        estimate = self.scheduler.estimate_tokens(self.context_tokens, new_chars)
+        with tracing.tracing.span("rate_limit_wait", "queue", estimated_tokens=estimate):
+            self.queue_seconds += self.scheduler.acquire(estimate)
+        self.reserved_tokens += estimate
+        # Whatever we send becomes part of the context for the next model call in this run.
+        self.context_tokens += int(new_chars / ratelimit.ratelimit.chars_per_token)
+
+    def run_agent(self, force_tool=None, stage="run", package=None):
+        """Runs the assistant on the thread until it settles.
+        :param stage: What the run is for, as recorded in the ledger.
+        :param package: The package the run is about, if any. Package budgets are charged to it.
+        """
         if not force_tool:
             tool_selection = "auto"
         else:
             tool_selection = force_tool.choice()
-        self.run = self.client.beta.threads.runs.create(
-            thread_id=self.thread.id,
-            assistant_id=self.assistant.id,
-            timeout=timeout_override,
-            tool_choice=tool_selection,
-        )
-        self.__run_thread()
+        self.reserved_tokens = 0
+        self.tool_rounds = 0
+        self.package = package
+        self.run_started = time.monotonic()
+        self.queue_seconds = 0.0
+        self.stop_reason = None
+        self.budget_rounds = 0
+        attempt = 0
+        with tracing.tracing.span("run_agent", "run", stage=stage, package=package) as span:
+            while True:
+                self.__reserve(self.pending_chars)
+                with tracing.tracing.span("runs.create", "api"):
+                    self.run = self.client.beta.threads.runs.create(
+                        thread_id=self.thread.id,
+                        assistant_id=self.assistant.id,
+                        timeout=timeout_override,
+                        tool_choice=tool_selection,
+                    )
+                self.__run_thread()
+                if self.run.status == "failed" and self.run.last_error.code == "rate_limit_exceeded":
+                    if attempt >= self.scheduler.max_requeues:
+                        raise RunFailed(f"Rate limit exceeded {attempt} times, aborting")
+                    # The thread still holds our prompt, so the run can simply be re-queued once the quota allows it.
+                    backoff = self.scheduler.rate_limited(self.run.last_error.message, attempt)
+                    print(f"Rate limit exceeded, re-queueing run in {backoff:.1f} seconds (attempt {attempt + 1})")
+                    attempt += 1
+                    continue
+                break
+            self.pending_chars = 0
+            self.__settle_usage()
+            if self.ledger:
+                self.ledger.record(stage, package, self.run.usage, time.monotonic() - self.run_started, self.tool_rounds,
+                                   self.queue_seconds, self.run.status)
+            span.set(status=self.run.status, tool_rounds=self.tool_rounds, requeues=attempt,
+                     total_tokens=self.run.usage.total_tokens if self.run.usage else None)
+
+    def __over_budget(self):
+        # Only package runs are cut short, the closing stages are how the results get out
+        if not self.ledger or self.package is None:
+            return None
+        return self.ledger.exhausted(self.package, self.reserved_tokens, time.monotonic() - self.run_started)
+
+    def __settle_usage(self):
+        usage = self.run.usage
+        if not usage:
+            return
+        self.scheduler.settle(self.reserved_tokens, usage.total_tokens)
+        self.usage["prompt_tokens"] += usage.prompt_tokens
+        self.usage["completion_tokens"] += usage.completion_tokens
+        self.usage["total_tokens"] += usage.total_tokens
+        # Each model call in the run re-reads the thread, so the average prompt size approximates the thread size.
+        model_calls = self.tool_rounds + 1
+        self.context_tokens = int(usage.prompt_tokens / model_calls) + usage.completion_tokens
 
     def get_new_results(self):
         # Print all the results we haven't seen yet.
@@ -203,7 +485,7 @@ class ThreadRunner:
     def get_last_n_results(self, n=0, include_names=True):
         if self.run.status != "completed":
             print(self.run.model_dump_json(indent=2))
-            exit(1)
+            raise RunFailed(f"Run {self.run.id} ended as '{self.run.status}', not completed")
         if n < 0:
             raise ValueError(f"Invalid value for n: {n}")
         messages = self.client.beta.threads.messages.list(thread_id=self.thread.id)
@@ -230,31 +512,36 @@ class ThreadRunner:
 
     # TODO: YucK https://community.openai.com/t/any-way-to-duplicate-a-thread/660969/2
     def __wait_for_run(self):
-        sleep = 1
+        if self.run.status == "requires_action":
+            # Nothing to wait for, ie the chat engine answers synchronously
+            return
+        sleep = poll_interval
         start_time = time.time()
-        time.sleep(sleep)
+        with tracing.tracing.span("poll", "poll") as span:
+            time.sleep(sleep)
 
-        self.run = self.client.beta.threads.runs.retrieve(thread_id=self.thread.id,run_id=self.run.id)
+            self.run = self.client.beta.threads.runs.retrieve(thread_id=self.thread.id,run_id=self.run.id)
+            span.set(status=self.run.status)
         while self.run.status not in ["completed", "cancelled", "expired", "failed", "requires_action"]:
             time_elapsed = int(time.time() - start_time)
             if time_elapsed % 10 == 0:
                 print(f"Waiting for response... Run status:'{self.run.status}' ({time_elapsed} / {timeout_override} seconds)")
-            time.sleep(sleep)
+            with tracing.tracing.span("poll", "poll") as span:
+                time.sleep(sleep)
 
-            self.run = self.client.beta.threads.runs.retrieve(thread_id=self.thread.id,run_id=self.run.id)
+                self.run = self.client.beta.threads.runs.retrieve(thread_id=self.thread.id,run_id=self.run.id)
+                span.set(status=self.run.status)
             # Cancel the run if we get stuck.
             if time.time() - start_time > timeout_override:
                 print("Cancelling run, time limit exceeded")
                 self.client.beta.threads.runs.cancel(thread_id=self.thread.id, run_id=self.run.id)
 
         if self.run.status == "failed" and self.run.last_error.code == "rate_limit_exceeded":
-            print("Rate limit exceeded, aborting")
-            exit(1)
+            # Handled by run_agent(), which will re-queue the run.
+            return
 
         if self.run.status == "failed":
-            print(f"Run failed: {self.run.last_error.code}")
-            print(f"Message: {self.run.last_error.message}")
-            exit(1)
+            raise RunFailed(f"Run failed: {self.run.last_error.code}, message: {self.run.last_error.message}")
 
     def __run_thread(self):
         while self.run.status not in ["completed", "cancelled", "expired", "failed"]:
@@ -263,34 +550,100 @@ class ThreadRunner:
                 if self.run.required_action.type != "submit_tool_outputs":
                     raise ValueError(f"Unhandled action type: {self.run.required_action.type}")
                 tool_calls = self.run.required_action.submit_tool_outputs.tool_calls
+                reason = self.__over_budget()
+                if reason and self.budget_rounds >= budget_grace_rounds:
+                    print(f"Cancelling run, {reason} and it did not wrap up")
+                    self.stop_reason = reason
+                    self.run = self.client.beta.threads.runs.cancel(thread_id=self.thread.id, run_id=self.run.id)
+                    continue
                 tool_results = []
                 for tool_call in tool_calls:
-                    result = self.tools.callFunction(tool_call.function.name, tool_call.function.arguments)
+                    if reason:
+                        # Rather than stopping dead, ask the model to conclude with what it has
+                        result = budget_message
+                    else:
+                        result = self.tools.callFunction(tool_call.function.name, tool_call.function.arguments)
                     tool_results.append({
                         "tool_call_id": tool_call.id,
                         "output": result
                     })
-                self.run = client.beta.threads.runs.submit_tool_outputs(
-                    thread_id=self.thread.id,
-                    run_id=self.run.id,
-                    tool_outputs=tool_results,
-                    timeout=timeout_override,
-                )
+                if reason:
+                    print(f"Asking the run to wrap up, {reason}")
+                    self.stop_reason = reason
+                    self.budget_rounds += 1
+                # Submitting the outputs resumes the run, which is another model call against our quota.
+                self.tool_rounds += 1
+                self.__reserve(sum(len(r["output"]) for r in tool_results))
+                with tracing.tracing.span("runs.submit_tool_outputs", "api", outputs=len(tool_results)):
+                    self.run = self.client.beta.threads.runs.submit_tool_outputs(
+                        thread_id=self.thread.id,
+                        run_id=self.run.id,
+                        tool_outputs=tool_results,
+                        timeout=timeout_override,
+                    )
+
+def final_text(runner):
+    """Returns the model's last answer, or a note saying why there is none if the run was cut short.
+    :rtype: str
+    """
+    if runner.run.status != "completed" and runner.stop_reason:
+        return f"Not reviewed: {runner.stop_reason}."
+    return runner.get_last_n_results(1,False)[0]
+
+# Deep scan tuning: how many locally pre-filtered files to show the model, how many per prompt, and how many
+# prompts to have in flight at once.
+deepscan_candidate_limit = 120
+deepscan_group_size = 30
+deepscan_workers = 4
+
+def run_groups_until_covered(groups, run_group, target_families, workers=deepscan_workers, should_stop=None):
+    """Runs run_group() over each group concurrently, stopping early once every family in target_families is covered.
+    :param run_group: Called with a group, returns a tuple of (result, set of families the group covered).
+    :param should_stop: Optional, called before starting each group. Returns why no more groups should be started, or None.
+    :rtype: list
+    :return: The results of each group that was run, in completion order.
+    """
+    results = []
+    covered = set()
+    remaining = list(groups)
+    stop_reason = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while remaining or pending:
+            while remaining and len(pending) < workers and not (target_families and target_families <= covered):
+                stop_reason = should_stop() if should_stop else None
+                if stop_reason:
+                    break
+                pending.add(executor.submit(run_group, remaining.pop(0)))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result, families = future.result()
+                results.append(result)
+                covered.update(families)
+    if remaining and stop_reason:
+        print(f"Skipping {len(remaining)} remaining groups, {stop_reason}")
+    elif remaining:
+        print(f"All detected license families {sorted(target_families)} are covered, skipping {len(remaining)} remaining groups")
+    return results
 
 # TODO: Test of a deepscanner, WIP
-def deepscan_testing(client, license_assistant, tools, files):
-    deep_scan_runner = ThreadRunner(
-            client,
-            license_assistant,
-            tools,
-        )
+def deepscan_testing(client, license_assistant, tools, files, job_ledger=None):
+    if job_ledger is None:
+        job_ledger = ledger.ledger.Ledger.from_env()
+    srpm_files = [f for f in files if f.endswith(".src.rpm")]
+    if len(srpm_files) != 1:
+        raise ValueError(f"Deep scan needs exactly one .src.rpm file, got: {srpm_files}")
+    srpm_file = srpm_files[0]
+    request_analysis = tools.getFunction(RequestAnalysis().name())
     analysis_runner = ThreadRunner(
             client,
             license_assistant,
             tools,
+            ledger=job_ledger,
         )
-    srpm_files = [f for f in files if f.endswith(".src.rpm")]
-    deep_scan_runner.add_prompt(
+    scan_prompt = (
         f"Analyse the contents of the following files:'{srpm_files}' and decide if any files need investigation. The end goal is "
         "to decide if the licensing information for the project is correct. A separate agent will be responsible for making the final "
         "assessment. Your job is to identify any files that might affect the licensing situation as quickly as possible. Be selective, "
@@ -300,57 +653,388 @@ def deepscan_testing(client, license_assistant, tools, files):
         " add duplicated information: i.e. if a type of file with license 'A' is already marked for analysis, adding multiple additional files with license 'A' is pointless). "
         "Feel free to investigate files to determine what they are for, if you aren't sure."
     )
-    analysis_runner.add_prompt(
+    analysis_prompt = (
         f"Another agent is generating a list of interesting files to investigate which are from {srpm_files}. Please determine from first principles what the required licensing situation is for this package. "
         " Do not assume that the current licensing files are sufficient, there may be hidden additional licensing requirements. You may investigate the source files as needed, even "
         " those that are not flagged by the other agent."
     )
-    src_files = srpm.srpm.SrpmExploreFiles().srpm_explore_contents(srpm_file="nano.src.rpm", search_dir=".", max_depth=0)
+    analysis_runner.add_prompt(analysis_prompt)
+
+    src_files = srpm.srpm.SrpmExploreFiles().srpm_explore_contents(srpm_file=srpm_file, search_dir=".", max_depth=0)
     # remove anything that doesn't start with 'file:', and remove the 'file:' prefix
     src_files = [f.removeprefix("file:") for f in src_files if f.startswith("file:")]
-    # Split the files into groups
-    group_size = 30
-    grouped_files = [src_files[i:i + group_size] for i in range(0, len(src_files), group_size)]
 
-    for g in grouped_files:
-        print(g)
-        deep_scan_runner.add_prompt(
-            f"Should any of the following files be investigated further? Indicate any positive results via the {RequestAnalysis().name()} function. {g}"
+    # Rank the files locally, only the best deduplicated candidates are worth the model's time. Files whose headers are
+    # near-identical count as duplicates, so each header cluster is looked at through one representative.
+    top_dir = srpm.srpm.srpm_cache.get_from_cache(srpm_file)
+    scores = deepscan.deepscan.score_files(top_dir, src_files)
+    clusters = headers.headers.cluster_tree(top_dir)
+    headers.headers.assign_clusters(scores, clusters)
+    families = deepscan.deepscan.detected_families(scores)
+    candidates = deepscan.deepscan.select_candidates(scores, deepscan_candidate_limit)
+    candidate_families = {c.path: c.families for c in candidates}
+    print(f"Pre-filter selected {len(candidates)} of {len(src_files)} files ({len(clusters)} header clusters), detected license families: {sorted(families)}")
+
+    # Split the files into groups
+    group_size = deepscan_group_size
+    grouped_files = [candidates[i:i + group_size] for i in range(0, len(candidates), group_size)]
+
+    def scan_group(group):
+        print([c.path for c in group])
+        runner = ThreadRunner(client, license_assistant, tools, scan_prompt, ledger=job_ledger)
+        hints = "\n".join(f"{c.path} (kind: {c.kind}, detected: {sorted(c.licenses) if c.licenses else 'nothing'}"
+                          f"{f', header shared by {c.cluster_size} files' if c.cluster_size > 1 else ''})" for c in group)
+        runner.add_prompt(
+            f"Should any of the following files be investigated further? Indicate any positive results via the {RequestAnalysis().name()} function. "
+            f"Each file is annotated with what a quick local scan detected in its header:\n{hints}"
         )
-        deep_scan_runner.run_agent()
-
-    groups_requests = [RequestAnalysis.get_files()[i:i + group_size] for i in range(0, len(RequestAnalysis.get_files()), group_size)]
-    for r in groups_requests:
-        print(r)
-        analysis_runner.add_prompt(
-            f"The other agent thought the following files were interesting: {r}. Determine if they have any licensing concerns. Hold a full review for later, you will be asked "
-            "specifically to provide one when needed. Most importantly, ensure that you have an accurate list of all the licenses used in the package."
+        runner.run_agent(stage="deepscan_triage")
+        requested = set(os.path.normpath(f) for f in request_analysis.get_files())
+        flagged = [c.path for c in group if c.path in requested]
+        return flagged, set().union(*[candidate_families[f] for f in flagged])
+    run_groups_until_covered(grouped_files, scan_group, families, should_stop=job_ledger.exhausted)
+
+    requested_files = list(dict.fromkeys(os.path.normpath(f) for f in request_analysis.get_files()))
+    groups_requests = [requested_files[i:i + group_size] for i in range(0, len(requested_files), group_size)]
+
+    def analyse_group(group):
+        print(group)
+        runner = ThreadRunner(client, license_assistant, tools, analysis_prompt, ledger=job_ledger)
+        runner.add_prompt(
+            f"The other agent thought the following files were interesting: {group}. Determine if they have any licensing concerns. "
+            "Most importantly, ensure that you have an accurate list of all the licenses used in these files."
         )
-        analysis_runner.run_agent()
+        runner.run_agent(stage="deepscan_analysis")
+        findings = final_text(runner)
+        return f"{group}:\n{findings}", set().union(*[candidate_families.get(f, set()) for f in group])
+    findings = run_groups_until_covered(groups_requests, analyse_group, families, should_stop=job_ledger.exhausted)
 
     print("\n\n**** DEEP SCAN RESULTS ****\n")
+    findings_text = "\n\n".join(findings)
     analysis_runner.add_prompt(
+        f"Other agents examined the interesting files in parallel and reported:\n{findings_text}\n"
         f"Complete a full review, then provide a summary of the licensing situation for the files: {srpm_files}. "
     )
-    analysis_runner.run_agent()
+    analysis_runner.run_agent(stage="deepscan_review")
 
     for l in analysis_runner.get_new_results():
         print(l)
 
     analysis_runner.add_prompt(f"Check if the package {files} match the expected licenses you found. Submit any issues via the {ProvideAssessmentFunc().name()} function. "
                                "The package is not trusted, your job is to validate that is correct.")
-    analysis_runner.run_agent()
+    analysis_runner.run_agent(stage="deepscan_issues")
     for l in analysis_runner.get_new_results():
         print(l)
+    print(job_ledger.summary())
+
+def review_package_set(client, license_assistant, tools, files, force_review=False, context_mode="bounded", report=None, job_ledger=None,
+                       previous_files=None):
+    """Reviews every .rpm built from a single .spec and .src.rpm.
+    :rtype: tuple
+    :param context_mode: 'bounded' to review each package on its own thread seeded from a compact digest, or 'shared'
+        to push every package through one conversation.
+    :param report: An optional report.ReportWriter, each assessment and issue is streamed to it as soon as it is known.
+    :param job_ledger: The ledger.Ledger to account runs against and enforce budgets with, by default one configured from
+        the environment.
+    :param previous_files: The .rpm, .spec and .src.rpm files of the previous release, if it was reviewed before. Packages
+        with no license relevant changes since then keep their previous verdict, the rest are only asked about what changed.
+    :return: A tuple of the results and the ThreadRunner holding the closing conversation (None if nothing was asked).
+    """
+    start_time = time.time()
+    print(f"\n\n**** CONSIDERING FILES ****\n")
+    for f in files:
+        print(f"\t{f}")
+
+    # Gather the .src.rpm and .spec files, we should only have one of each
+    srpm_file = [f for f in files if f.endswith(".src.rpm")]
+    spec_file = [f for f in files if f.endswith(".spec")]
+    if len(srpm_file) != 1 or len(spec_file) != 1:
+        raise ValueError(f"You must provide exactly one .src.rpm file and one .spec file, got: {srpm_file} and {spec_file}")
+    srpm_file = srpm_file[0]
+    spec_file = spec_file[0]
+    if previous_files:
+        _, previous_spec, previous_srpm = delta.delta.split_files(previous_files)
+        if not previous_spec or not previous_srpm:
+            raise ValueError(f"The previous release needs a .spec and a .src.rpm file too, got: {previous_files}")
+
+    assessments = tools.getFunction(ProvideAssessmentFunc().name())
+    if job_ledger is None:
+        job_ledger = ledger.ledger.Ledger.from_env()
+    if report:
+        assessments.on_issue = lambda issue: report.issue(issue, srpm=srpm_file)
+
+    # Work out which packages have already been reviewed in exactly this configuration
+    verdict_cache = verdicts.verdicts.VerdictCache()
+    schema_version = get_schema_version(tools)
+    rpm_files = [f for f in files if f.endswith(".rpm") and not f.endswith(".src.rpm")]
+    tools.getFunction(ownership.ownership.PathOwnership().name()).set_rpm_files(rpm_files)
+    assessments.set_rpm_files(rpm_files)
+    package_keys = {f: verdict_cache.key(f, spec_file, srpm_file, license_assistant.model, schema_version) for f in rpm_files}
+    cached_verdicts = {}
+    if not force_review:
+        for f in rpm_files:
+            verdict = verdict_cache.get_verdict(package_keys[f])
+            if verdict:
+                cached_verdicts[f] = verdict
+    job_key = verdict_cache.job_key(package_keys.values())
+    cached_job = None if force_review or len(cached_verdicts) != len(rpm_files) else verdict_cache.get(job_key)
+
+    # Work out everything that doesn't need judgment locally, before any model turn
+    fact_sheet = facts.facts.FactSheet(rpm_files, spec_file, srpm_file)
+
+    # In delta mode, packages whose previous release was reviewed only need a look at what changed since
+    job_delta = None
+    previous_verdicts = {}
+    carried = set()
+    if previous_files:
+        job_delta = delta.delta.compare(previous_files, files, fact_sheet)
+        print(f"\n\n**** CHANGES SINCE THE PREVIOUS RELEASE ****\n\n{job_delta.summary()}")
+        for f in rpm_files:
+            if f in cached_verdicts or f not in job_delta.previous:
+                continue
+            previous_key = verdict_cache.key(job_delta.previous[f], previous_spec, previous_srpm, license_assistant.model, schema_version)
+            verdict = verdict_cache.get_verdict(previous_key)
+            if verdict is None:
+                continue
+            if job_delta.changed(f):
+                previous_verdicts[f] = verdict
+            else:
+                # Nothing license relevant changed, the previous verdict and its issues stand for the new release
+                result_text, issues = verdict
+                cached_verdicts[f] = (result_text, verdicts.verdicts.reassign_issues(issues, job_delta.previous[f], f))
+                carried.add(f)
+
+    # Builds of the same package for other architectures are diffed locally against one representative build, those
+    # that are identical for licensing share its verdict and the rest are only asked about how they differ
+    arch_groups = delta.delta.ArchGroups(fact_sheet)
+    mirrored = set()
+    arch_variants = set()
+    for f in arch_groups.representative:
+        if f in cached_verdicts:
+            continue
+        if not arch_groups.differs(f):
+            mirrored.add(f)
+            previous_verdicts.pop(f, None)
+        elif f not in previous_verdicts:
+            arch_variants.add(f)
+    if arch_groups.packages:
+        print(f"\n\n**** BUILDS FOR OTHER ARCHITECTURES ****\n\n{arch_groups.summary()}")
+
+    opening_prompt = ("A list of rpm packages will be provided for analysis. Please examine each package for licensing concerns. "
+                      f"They are all created as part of a single build from {spec_file} and {srpm_file}.\n{fact_sheet.job_summary()}")
+    if job_delta:
+        opening_prompt += f"\nThis is a new release of a package set that was reviewed before. Compared to the previous release:\n{job_delta.summary()}"
+    if arch_groups.packages:
+        opening_prompt += f"\nSome packages are built for several architectures:\n{arch_groups.summary()}"
+    # In 'bounded' mode each package gets its own short lived thread seeded from a compact digest, in 'shared' mode
+    # every package goes through a single conversation.
+    context_digest = digest.digest.ContextDigest(opening_prompt)
+    shared_runner = None
+    if context_mode == "shared":
+        shared_runner = ThreadRunner(client, license_assistant, tools, opening_prompt, ledger=job_ledger)
+
+    package_results_text = {}
+    # Packages that were skipped or cut short by a budget, their verdicts aren't worth remembering
+    incomplete = set()
+    # Representatives go first, so their verdicts are known by the time the other builds are looked at
+    for f in sorted(rpm_files, key=lambda f: f in arch_groups.representative):
+        if f in mirrored:
+            # Filled in from the representative's verdict below
+            continue
+        if f in cached_verdicts:
+            if f in carried:
+                print(f"\n\n**** {f} HAS NO LICENSE RELEVANT CHANGES SINCE {job_delta.previous[f]}, CARRYING ITS VERDICT FORWARD ****\n")
+            else:
+                print(f"\n\n**** {f} UNCHANGED, USING CACHED VERDICT ****\n")
+            package_results_text[f], cached_issues = cached_verdicts[f]
+            assessments.issue_list.extend(cached_issues)
+            context_digest.add_verdict(f, package_results_text[f])
+            if report:
+                carried_from = {"carried_from": job_delta.previous[f]} if f in carried else {}
+                report.package(f, package_results_text[f], cached=True, srpm=srpm_file, **carried_from)
+                for issue in cached_issues:
+                    report.issue(issue, srpm=srpm_file, cached=True)
+            continue
+        reason = job_ledger.exhausted()
+        if reason:
+            print(f"\n\n**** SKIPPING {f}, {reason.upper()} ****\n")
+            package_results_text[f] = f"Not reviewed: {reason}."
+            incomplete.add(f)
+            if report:
+                report.package(f, package_results_text[f], srpm=srpm_file, skipped=True)
+            continue
+        print(f"\n\n**** EXAMINING {f} ****\n")
+        if shared_runner:
+            runner = shared_runner
+        else:
+            runner = ThreadRunner(client, license_assistant, tools, context_digest.text(digest.digest.ContextDigest.max_verdicts_chars), ledger=job_ledger)
+        representative = arch_groups.representative.get(f)
+        if f in previous_verdicts:
+            changes = job_delta.describe(f)
+            runner.add_prompt(
+                delta_prompt(f, job_delta.previous[f], previous_verdicts[f][0], changes, spec_file, srpm_file, fact_sheet.summary(f))
+                )
+        elif f in arch_variants and representative not in incomplete:
+            changes = arch_groups.describe(f)
+            runner.add_prompt(
+                delta_prompt(f, representative, package_results_text[representative], changes, spec_file, srpm_file, fact_sheet.summary(f),
+                             relation="the same package built for another architecture as")
+                )
+        else:
+            changes = None
+            runner.add_prompt(
+                package_prompt(f, spec_file, srpm_file, fact_sheet.summary(f))
+                )
+        runner.run_agent(stage="package", package=f)
+        package_results_text[f] = final_text(runner)
+        if runner.stop_reason:
+            incomplete.add(f)
+        context_digest.add_verdict(f, package_results_text[f])
+        if report:
+            report.package(f, package_results_text[f], srpm=srpm_file, facts=fact_sheet.summary(f), cut_short=runner.stop_reason, changes=changes)
+
+    for f in sorted(mirrored):
+        representative = arch_groups.representative[f]
+        print(f"\n\n**** {f} IS IDENTICAL TO {representative} FOR LICENSING, USING ITS VERDICT ****\n")
+        package_results_text[f] = package_results_text[representative]
+        if representative in incomplete:
+            incomplete.add(f)
+        context_digest.add_verdict(f, f"Identical for licensing to '{representative}', which has the same verdict.")
+        if report:
+            report.package(f, package_results_text[f], srpm=srpm_file, mirrored_from=representative)
+
+    reviewed_files = [f for f in rpm_files if f not in cached_verdicts and f not in mirrored]
+    runner = shared_runner
+    if not runner and (reviewed_files or not cached_job):
+        # The closing stages work from the digest of every verdict, not the per-package conversations
+        runner = ThreadRunner(client, license_assistant, tools, context_digest.text(), ledger=job_ledger)
+    if cached_job:
+        summary_text = cached_job["summary_text"]
+        suggestions_text = cached_job["suggestions_text"]
+    else:
+        if cached_verdicts and shared_runner:
+            # The model has not seen these packages in this conversation, give it the previous verdicts instead.
+            cached_text = "\n".join(f"'{f}':\n{package_results_text[f]}" for f in cached_verdicts)
+            runner.add_prompt(f"The following packages are unchanged since a previous review, and their verdicts still stand:\n{cached_text}")
+        if mirrored and shared_runner:
+            mirrored_text = "\n".join(f"'{f}' has the same verdict as '{arch_groups.representative[f]}'" for f in sorted(mirrored))
+            runner.add_prompt(f"The following packages are builds for other architectures that are identical for licensing:\n{mirrored_text}")
+
+        print("\n\n**** GENERATING SUMMARY ****\n")
+
+        runner.add_prompt("If any of the above packages have licensing concerns, please summarize them here, otherwise state that all packages are clear.")
+        runner.run_agent(stage="summary")
+        summary_text = final_text(runner)
+
+        # Suggestions are the one stage we can do without, once the job is over budget
+        reason = job_ledger.exhausted()
+        if reason:
+            print(f"\n\n**** SKIPPING SUGGESTIONS, {reason.upper()} ****\n")
+            suggestions_text = f"Not generated: {reason}."
+        else:
+            print("\n\n**** GENERATING SUGGESTIONS ****\n")
+
+            runner.add_prompt("Please provide suggestions on how to improve the licensing situation specifically for the packages discussed above.")
+            runner.run_agent(stage="suggestions")
+            suggestions_text = final_text(runner)
+    if report:
+        report.write({"type": "summary", "srpm": srpm_file, "text": summary_text})
+        report.write({"type": "suggestions", "srpm": srpm_file, "text": suggestions_text})
+
+    if reviewed_files:
+        print("\n\n**** GATHERING ISSUES ****\n")
+
+        runner.add_prompt(
+            f"Now please accurately record each licensing concern using the {ProvideAssessmentFunc().name()} function. Use multiple calls to avoid\n"
+            f"having multiple issues per entry. For complexness add at least one entry for each package ({reviewed_files}) even if there are no issues.\n"
+            "Always set package to the .rpm file the entry is for.\n"
+            "Stop once you have recorded all issues via the API."
+        )
+        runner.run_agent(stage="issues")
+
+    # Identical builds for other architectures share their representative's issues
+    mirrored_issues = []
+    for f in sorted(mirrored):
+        representative_issues = verdicts.verdicts.issues_for_package(assessments.get_issues(), arch_groups.representative[f])
+        mirrored_issues += verdicts.verdicts.reassign_issues(representative_issues, arch_groups.representative[f], f)
+    for issue in mirrored_issues:
+        assessments.issue_list.append(issue)
+        if report:
+            report.issue(issue, srpm=srpm_file, mirrored=True)
+
+    # Remember the verdicts for next time, carried verdicts under the new release's key so it is a plain cache hit
+    for f in carried:
+        verdict_cache.put_verdict(package_keys[f], f, *cached_verdicts[f])
+    # Every package is asked for at least one entry, a package with none may have had its issues recorded against
+    # something else, and caching it would report it clean from then on
+    unattributed = [issue for issue in assessments.get_issues() if not any(verdicts.verdicts.issues_for_package([issue], f) for f in rpm_files)]
+    if unattributed:
+        print(f"{len(unattributed)} issues could not be attributed to a package, not caching the reviewed packages' verdicts")
+    uncached = set()
+    for f in reviewed_files + sorted(mirrored):
+        issues = verdicts.verdicts.issues_for_package(assessments.get_issues(), f)
+        if f in incomplete or unattributed or not issues:
+            uncached.add(f)
+            continue
+        verdict_cache.put_verdict(package_keys[f], f, package_results_text[f], issues)
+    if uncached - incomplete:
+        print(f"Not caching verdicts without recorded assessments: {sorted(uncached - incomplete)}")
+    if not uncached and not job_ledger.exhausted():
+        verdict_cache.put(job_key, {"summary_text": summary_text, "suggestions_text": suggestions_text})
+    print(f"Verdict cache: {len(cached_verdicts) - len(carried)} of {len(rpm_files)} packages unchanged, {len(carried)} carried forward from the "
+          f"previous release, {len(mirrored)} identical to a build for another architecture, {len(reviewed_files)} reviewed "
+          f"({len(previous_verdicts) + len(arch_variants)} of them only for what differs).")
+
+    results = {
+        "files": files,
+        "packages": {f: package_results_text[f] for f in rpm_files},
+        "facts": {f: fact_sheet.summary(f) for f in rpm_files},
+        "summary": summary_text,
+        "suggestions": suggestions_text,
+        "issues": assessments.get_issues(),
+        "cached_packages": list(cached_verdicts),
+        "carried_packages": sorted(carried),
+        "delta_packages": sorted(previous_verdicts),
+        "mirrored_packages": sorted(mirrored),
+        "arch_variant_packages": sorted(arch_variants),
+        "elapsed_seconds": round(time.time() - start_time, 3),
+        "usage": job_ledger.usage(),
+        "incomplete_packages": sorted(incomplete),
+        "ledger": job_ledger.export(),
+    }
+    print(job_ledger.summary())
+    if report:
+        report.write({"type": "done", "srpm": srpm_file, "files": files, "cached_packages": results["cached_packages"],
+                      "incomplete_packages": results["incomplete_packages"], "elapsed_seconds": results["elapsed_seconds"],
+                      "usage": results["usage"], "ledger": results["ledger"]})
+    return results, runner
+
 
 # TODO: STreaming? https://learn.microsoft.com/en-us/azure/ai-services/openai/assistants-reference-runs?tabs=python#stream-a-run-result-preview
 if __name__ == "__main__":
     # Parse user inputs. Usage: `python3 assistant.py <path to .rpm file>`
     # TODO: Do this properly
     do_deepscan = "--deepscan" in sys.argv
-    args = [a for a in sys.argv if not a.startswith("--")]
+    force_review = "--force-review" in sys.argv
+    context_mode = "shared" if "--context=shared" in sys.argv else "bounded"
+    report_path = "summary.jsonl"
+    sarif_path = None
+    for a in sys.argv:
+        if a.startswith("--report="):
+            report_path = a.split("=", 1)[1]
+        elif a.startswith("--sarif="):
+            sarif_path = a.split("=", 1)[1]
+        elif a.startswith("--trace="):
+            tracing.tracing.start(a.split("=", 1)[1])
+    # Files after --previous are the previous release's, only what changed since it is reviewed
+    previous_files = None
+    argv = sys.argv
+    if "--previous" in argv:
+        split = argv.index("--previous")
+        argv, previous_files = argv[:split], [a for a in argv[split + 1:] if not a.startswith("--")]
+    args = [a for a in argv if not a.startswith("--")]
     if len(args) < 2:
-        raise ValueError("Usage: python3 assistant.py <path to file1> ...")
+        raise ValueError("Usage: python3 assistant.py <path to file1> ... [--previous <path to previous release file1> ...]")
     files = args[1:]
     print(files)
     # TODO: Track files better, we don't want to expose our file system to the assistant
@@ -364,11 +1048,6 @@ if __name__ == "__main__":
 
     #thread = start_new_thread(client, "Analyse the contents of the following files:{files} and determine if they contain suitable license files. Validate the actual contents of any license files you find and ensure that all references are correct.")
     #p1 = f"Analyse the contents of the following files:{files} and determine if they contain suitable license files. Validate the actual contents of any license files you find and ensure that all references are correct.",
-    runner = ThreadRunner(
-            client,
-            license_assistant,
-            tools,
-        )
 
     # runner.add_prompt(
     #     f"Analyse the contents of the following files:{files} and determine if the .spec file contains the correct licensing information. "
@@ -394,89 +1073,34 @@ if __name__ == "__main__":
 
     # summary = runner.get_last_n_results(1)
 
-    print(f"\n\n**** CONSIDERING FILES ****\n")
-    for f in files:
-        print(f"\t{f}")
-
-    # Gather the .src.rpm and .spec files, we should only have one of each
-    srpm_file = [f for f in files if f.endswith(".src.rpm")]
-    spec_file = [f for f in files if f.endswith(".spec")]
-    if len(srpm_file) != 1 or len(spec_file) != 1:
-        raise ValueError(f"You must provide exactly one .src.rpm file and one .spec file, got: {srpm_file} and {spec_file}")
-    srpm_file = srpm_file[0]
-    spec_file = spec_file[0]
-
-    runner.add_prompt("A list of rpm packages will be provided for analysis. Please examine each package for licensing concerns. "
-                      f"They are all created as part of a single build from {spec_file} and {srpm_file}. ")
-    package_results_text = {}
-    for f in files:
-        # only care about .rpms
-        if not f.endswith(".rpm") or f.endswith(".src.rpm"):
-            continue
-        print(f"\n\n**** EXAMINING {f} ****\n")
-        runner.add_prompt(
-            f"From first principles, please double check that there are no licensing concerns for '{f}'. Consider the following:\n"
-            "- Does the .rpm need license files based on its contents?\n"
-            "- If it does need license files...\n"
-            "    - Are they present in the .rpm?\n"
-            "    - Are they correct?\n"
-            "    - Are all licenses covered?\n"
-            "    - If they are provided by a sub-package, will they be automatically be included dependencies? (Only dependencies on sub-packages created "
-            "by this .spec count, a dependency on an external package is insufficient).\n"
-            " - Are there any other licensing concerns?\n"
-            "Please provide a brief summary for each point, along with any other relevant information. "
-            "Each accurate assessment which passes muster during legal review will be rewarded with $500. "
-            f"All packages are created from the same .spec and .src.rpm files: {spec_file} and {srpm_file}."
-            f"Avoid using {ProvideAssessmentFunc().name()} until directed to do so."
-            )
-        runner.run_agent()
-        package_results_text[f] = runner.get_last_n_results(1,False)[0]
-
-    print("\n\n**** GENERATING SUMMARY ****\n")
-
-    runner.add_prompt("If any of the above packages have licensing concerns, please summarize them here, otherwise state that all packages are clear.")
-    runner.run_agent()
-    summary_text = runner.get_last_n_results(1,False)[0]
-
-    print("\n\n**** GENERATING SUGGESTIONS ****\n")
-
-    runner.add_prompt("Please provide suggestions on how to improve the licensing situation specifically for the packages discussed above.")
-    runner.run_agent()
-    suggestions_text = runner.get_last_n_results(1,False)[0]
-
-    print("\n\n**** GATHERING ISSUES ****\n")
-
-    runner.add_prompt(
-        f"Now please accurately record each licensing concern using the {ProvideAssessmentFunc().name()} function. Use multiple calls to avoid\n"
-        f"having multiple issues per entry. For complexness add at least one entry for each package ({files}) even if there are no issues.\n"
-        "Stop once you have recorded all issues via the API."
-    )
-    runner.run_agent()
+    # Results are streamed to the report as they arrive, so an interrupted run still leaves everything finished so far
+    print(f"Streaming results to {report_path}" + (f" and {sarif_path}" if sarif_path else ""))
+    report_writer = report.report.ReportWriter(report_path, sarif_path)
+    results, runner = review_package_set(client, license_assistant, tools, files, force_review, context_mode, report_writer,
+                                         previous_files=previous_files)
+    report_writer.close()
 
     print("\n\n**** SUMMARY ****\n")
-    print(f"\tUsed {runner.run.usage.total_tokens} tokens.\n")
-    print(summary_text)
+    print(f"\tUsed {results['usage']['total_tokens']} tokens.\n")
+    print(results["summary"])
 
     print("\n\n**** SUGGESTIONS ****\n")
-    print(suggestions_text)
+    print(results["suggestions"])
 
     print("\n\n**** ISSUES ****\n")
-    for issue in ProvideAssessmentFunc.get_issues():
+    for issue in results["issues"]:
         file_basename = os.path.basename(issue["file"])
-        print(f"File: {file_basename},\n\tSeverity: {issue['severity']},\n\tDescription: {issue['description']}")
+        print(f"Package: {os.path.basename(issue.get('package') or '')}, File: {file_basename},\n\tSeverity: {issue['severity']},\n\tDescription: {issue['description']}")
     print()
 
 
     summary_path = "summary.txt"
     print(f"\n\n**** SAVING CONVERSATION TO {summary_path} ****\n")
     with open(summary_path, "w") as f:
-        f.write(f"Findings for {files}:\n")
-        for issue in ProvideAssessmentFunc.get_issues():
-            file_basename = os.path.basename(issue["file"])
-            f.write(f"File: {file_basename},\n\tSeverity: {issue['severity']},\n\tDescription: {issue['description']}\n")
-        f.write("\n")
+        f.write(report.report.render_text(report.report.read_records(report_path)))
         f.write("Conversation:\n")
-        f.writelines(runner.get_last_n_results())
+        if runner and runner.run:
+            f.writelines(runner.get_last_n_results())
 
     # p2 = f"An analysis of the accuracy of licensing in {files} will follow this message. Please validate it. Work through each assertion from first principles."
     # runner2 = ThreadRunner(
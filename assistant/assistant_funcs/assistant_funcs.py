@@ -1,10 +1,32 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import inspect
 import json
 import os
 
+from cache import cache
+from tracing import tracing
+
+# Results of stateless tool calls, shared by every manager in the process. Filled by the model's own calls and by the
+# prefetcher (see prefetch.py). The TTL only guards against inputs being rebuilt underneath a long lived process.
+tool_results = cache.registry.create("tool_results", max_entries=2048, ttl=600)
+
+def get_cache_dir(subdir:str) -> str:
+    """Returns (and creates) a directory for persistent caches that survive between runs.
+    The root may be overridden with the LICENSE_ASSISTANT_CACHE_DIR environment variable.
+    :rtype: str
+    """
+    root = os.environ.get("LICENSE_ASSISTANT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "license-assistant"))
+    path = os.path.join(root, subdir)
+    os.makedirs(path, exist_ok=True)
+    return path
+
 class OpenAIAssistantFunc:
+    # Names of the arguments that hold file paths, for functions that keep no per-conversation state and so may be
+    # served by a shared tool server (see toolserver.py). None means the function always runs in-process.
+    remote_path_args = None
+
     def __init__(self, fn_name:str, fn_description:str, fn_parameters:dict) -> None:
         self.__fnName = fn_name
         self.__fnDescription = fn_description
@@ -42,6 +64,39 @@ class OpenAIAssistantFunc:
     def call(self, args:dict) -> str:
         raise NotImplementedError("Subclasses must implement call() method.")
 
+    def remote_request(self, args:dict) -> dict:
+        """Returns the request to send a tool server for this call, or None if the call must run in-process.
+        Paths are made absolute since the server has its own working directory.
+        :rtype: dict
+        """
+        if self.remote_path_args is None:
+            return None
+        args = dict(args)
+        for arg_name in self.remote_path_args:
+            if arg_name in args:
+                args[arg_name] = os.path.abspath(args[arg_name])
+        return {"tool": self.name(), "args": args}
+
+    def result_key(self, args:dict) -> str:
+        """Returns the key the result of this call is cached under, or None if it may not be reused. Only functions that
+        keep no per-conversation state are cached. Defaults are filled in and paths made absolute, so equivalent calls
+        share an entry.
+        :rtype: str
+        """
+        if self.remote_path_args is None:
+            return None
+        try:
+            bound = inspect.signature(self.call).bind(**args)
+        except TypeError:
+            # Let the call itself report the bad arguments
+            return None
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        for arg_name in self.remote_path_args:
+            if isinstance(arguments.get(arg_name), str):
+                arguments[arg_name] = os.path.abspath(arguments[arg_name])
+        return json.dumps([self.name(), arguments], sort_keys=True, default=str)
+
 class APIFeedbackFunc(OpenAIAssistantFunc):
     __feedbackName = "api_feedback"
     __feedbackDescription = "Provide feedback on the provided API. Each actionable piece of feedback will result in a $500 bonus!"
@@ -68,6 +123,8 @@ class OpenAiAssistantFuncManager:
     prints = True
     def __init__(self) -> None:
         self.functions = []
+        # Runs the calls the model is likely to make next in the background, see prefetch.py
+        self.prefetcher = None
 
     def addFunction(self, func:OpenAIAssistantFunc) -> None:
         # Don't add duplicate functions
@@ -77,18 +134,69 @@ class OpenAiAssistantFuncManager:
     def getFunctions(self) -> list[dict]:
         return [func.obj() for func in self.functions]
 
+    def getFunction(self, fnName:str) -> OpenAIAssistantFunc:
+        for func in self.functions:
+            if func.name() == fnName:
+                return func
+        raise ValueError(f"Function not found: {fnName}")
+
+    def __forward(self, func:OpenAIAssistantFunc, args:dict) -> str:
+        # Set LICENSE_ASSISTANT_TOOL_SOCKET to share one warm set of caches between assistant processes. If the server
+        # is unreachable the call runs in-process as usual.
+        socket_path = os.environ.get("LICENSE_ASSISTANT_TOOL_SOCKET")
+        if not socket_path:
+            return None
+        request = func.remote_request(args)
+        if request is None:
+            return None
+        from toolserver import toolserver
+        try:
+            return toolserver.get_client(socket_path).call(request)
+        except toolserver.ToolServerUnavailable as e:
+            if self.prints:
+                print(f"\t\tTool server unavailable, running locally: {e}")
+            return None
+
+    def __cached(self, key:str) -> str:
+        if key is None:
+            return None
+        results = tool_results.get(key)
+        if results is None and self.prefetcher:
+            # The same call may already be under way in the background
+            results = self.prefetcher.wait(key)
+        return results
+
+    def execute(self, func:OpenAIAssistantFunc, args:dict, span=tracing.null_span) -> str:
+        """Runs a call, on the tool server if there is one, and caches the result if the function is stateless.
+        :rtype: str
+        """
+        results = self.__forward(func, args)
+        span.set(remote=results is not None)
+        if results is None:
+            results = f"{func.call(**args)}"
+        key = func.result_key(args)
+        if key is not None:
+            tool_results[key] = results
+        return results
+
     def callFunction(self, fnName:str, args:dict) -> str:
         for func in self.functions:
             if func.name() == fnName:
                 if self.prints:
                     print(f"\t{fnName}\n\t\tArgs: {args}")
                 try:
-                    args = json.loads(args)
-                    results = f"{func.call(**args)}"
+                    with tracing.span(fnName, "tool") as span:
+                        args = json.loads(args)
+                        results = self.__cached(func.result_key(args))
+                        span.set(cached=results is not None)
+                        if results is None:
+                            results = self.execute(func, args, span)
                 except Exception as e:
                     print(f"Error: {e}")
                     return f"Error calling tool: {e}"
                 # print(f"Results: {results}")
+                if self.prefetcher:
+                    self.prefetcher.observe(fnName, args, results)
                 return results
         err = ValueError(f"Function not found: {fnName}")
         print(f"{err}")
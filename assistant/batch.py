@@ -0,0 +1,151 @@
+#!/bin/python3
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Reviews many package sets in one process.
+# The manifest is a JSONL file, one package set per line:
+#   {"name": "nano", "files": ["rpms/nano-6.0-2.cm2.x86_64.rpm", "SPECS/nano.spec", "srpms/nano-6.0-2.cm2.src.rpm"], "build_dir": "nano/BUILD"}
+# "files" takes the same arguments as assistant.py. "build_dir" is optional, and points at the prepped (`rpmbuild -bp`)
+# BUILD directory for the .src.rpm. If the package set was reviewed before, "previous_files" (and optionally
+# "previous_build_dir") name the previous release, and only what changed since it is reviewed.
+#
+# All package sets share one assistant and the process wide rpm/srpm caches. Each set is given its own tool set so
+# its issues are collected separately. One JSONL record is appended to the output file as each set finishes.
+# --report streams every package assessment and issue from every set to a single report as they arrive (see
+# report.py), and --sarif additionally keeps a SARIF log of the issues. --trace writes a timeline of the whole batch
+# (see tracing.py).
+#
+# Usage: batch.py <manifest.jsonl> <results.jsonl> [--workers=N] [--force-review] [--report=PATH] [--sarif=PATH] [--trace=PATH]
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+import assistant
+import cache.cache
+import report.report
+import tracing.tracing
+import srpm.srpm
+
+def load_manifest(manifest_path:str) -> list[dict]:
+    jobs = []
+    with open(manifest_path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            job = json.loads(line)
+            if "files" not in job:
+                raise ValueError(f"{manifest_path}:{line_number}: every entry needs a 'files' list")
+            job.setdefault("name", os.path.basename(job["files"][0]))
+            jobs.append(job)
+    return jobs
+
+def job_size(job:dict) -> int:
+    """Estimates the amount of work in a job from the size of its .rpm files.
+    :rtype: int
+    """
+    size = 0
+    for f in job["files"]:
+        if f.endswith(".rpm") and not f.endswith(".src.rpm") and os.path.exists(f):
+            size += os.path.getsize(f)
+    return size
+
+def fair_order(jobs:list[dict]) -> list[dict]:
+    """Orders jobs by alternating between the largest and smallest remaining.
+    Large jobs start early so they don't become a long tail, while small jobs keep flowing between them.
+    :rtype: list[dict]
+    """
+    by_size = sorted(jobs, key=job_size)
+    ordered = []
+    while by_size:
+        ordered.append(by_size.pop())
+        if by_size:
+            ordered.append(by_size.pop(0))
+    return ordered
+
+class ResultWriter:
+    def __init__(self, output_path:str) -> None:
+        self.output_path = output_path
+        self.lock = threading.Lock()
+
+    def write(self, record:dict) -> None:
+        with self.lock:
+            with open(self.output_path, 'a') as f:
+                report.report.sync_write(f, json.dumps(record) + "\n")
+
+def run_batch(jobs:list[dict], output_path:str, workers:int=4, force_review:bool=False, report_path:str=None, sarif_path:str=None) -> None:
+    client, license_assistant = assistant.create_assistant(assistant.get_all_tools())
+    writer = ResultWriter(output_path)
+    report_writer = report.report.ReportWriter(report_path, sarif_path) if report_path else None
+
+    work = queue.Queue()
+    for job in fair_order(jobs):
+        work.put(job)
+
+    def worker():
+        while True:
+            try:
+                job = work.get_nowait()
+            except queue.Empty:
+                return
+            start_time = time.time()
+            record = {"name": job["name"], "files": job["files"]}
+            try:
+                if "build_dir" in job:
+                    for f in job["files"]:
+                        if f.endswith(".src.rpm"):
+                            srpm.srpm.srpm_cache.register(f, job["build_dir"])
+                if "previous_build_dir" in job:
+                    for f in job.get("previous_files", []):
+                        if f.endswith(".src.rpm"):
+                            srpm.srpm.srpm_cache.register(f, job["previous_build_dir"])
+                # Fresh tools per job, the rpm/srpm caches are class level so they stay warm between jobs.
+                results, _ = assistant.review_package_set(client, license_assistant, assistant.get_all_tools(), job["files"], force_review,
+                                                          report=report_writer, previous_files=job.get("previous_files"))
+                record.update(results)
+                record["status"] = "ok"
+            except Exception as e:
+                traceback.print_exc()
+                record["status"] = "error"
+                record["error"] = f"{e}"
+            record["wall_seconds"] = round(time.time() - start_time, 3)
+            writer.write(record)
+            print(f"**** FINISHED {job['name']} ({record['status']}, {record['wall_seconds']} seconds) ****")
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(workers, len(jobs)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if report_writer:
+        report_writer.close()
+    print(cache.cache.registry.summary())
+
+if __name__ == "__main__":
+    force_review = "--force-review" in sys.argv
+    workers = 4
+    report_path = None
+    sarif_path = None
+    for a in sys.argv:
+        if a.startswith("--workers="):
+            workers = int(a.split("=", 1)[1])
+        elif a.startswith("--report="):
+            report_path = a.split("=", 1)[1]
+        elif a.startswith("--sarif="):
+            sarif_path = a.split("=", 1)[1]
+        elif a.startswith("--trace="):
+            tracing.tracing.start(a.split("=", 1)[1])
+    args = [a for a in sys.argv if not a.startswith("--")]
+    if len(args) != 3:
+        raise ValueError("Usage: python3 batch.py <manifest.jsonl> <results.jsonl> [--workers=N] [--force-review] [--report=PATH] [--sarif=PATH] [--trace=PATH]")
+    jobs = load_manifest(args[1])
+    print(f"Loaded {len(jobs)} package sets from {args[1]}")
+    if sarif_path and not report_path:
+        raise ValueError("--sarif needs --report")
+    run_batch(jobs, args[2], workers, force_review, report_path, sarif_path)
@@ -0,0 +1,180 @@
+#!/bin/python3
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Benchmarks for the local rpm/srpm functions, run against synthetic fixtures (see fixtures.py).
+# Each benchmark is timed once 'cold' (the in-process caches cleared first) and several times 'warm'. Results are
+# written as JSON, and may be compared to a previous result file to catch regressions.
+#
+# Usage: benchmark.py [--preset=small|perl] [--compression=gzip|xz|zstd|none] [--repeat=N] [--workdir=DIR]
+#                     [--output=results.json] [--baseline=previous.json] [--threshold=1.25]
+#                     [--source_files=N] [--files_per_dir=N] [--subpackages=N] [--files_per_package=N]
+#
+# The last four override the values from the preset.
+#
+# Cold runs clear our own caches, in memory and on disk, the OS page cache is left as-is. The on-disk caches (manifests,
+# extracted payloads) are kept in a temporary directory for the run, so the user's are neither used nor added to.
+
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from bench import fixtures
+from cache import cache
+from rpm import rpm
+from srpm import srpm
+
+# Where the persistent caches go for this run, see main
+cache_dir = None
+
+def clear_caches() -> None:
+    # Pinned caches, ie the .src.rpm registrations, are configuration rather than cached work and stay
+    cache.registry.clear()
+    if cache_dir:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(cache_dir)
+
+def measure(fn, repeat:int, warm_only:bool=False) -> dict:
+    """Times fn() once after clearing the caches, then repeat more times with them warm.
+    :param warm_only: Leave the caches as they are and skip the cold run, for functions that need them populated.
+    :rtype: dict
+    """
+    cold = None
+    if not warm_only:
+        clear_caches()
+        start = time.perf_counter()
+        fn()
+        cold = time.perf_counter() - start
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        warm.append(time.perf_counter() - start)
+    return {
+        "cold_ms": round(cold * 1000, 3) if cold is not None else None,
+        "warm_ms_median": round(statistics.median(warm) * 1000, 3),
+        "warm_ms_min": round(min(warm) * 1000, 3),
+        "warm_runs": repeat,
+    }
+
+def srpm_benchmarks(build_dir:str, repeat:int) -> dict:
+    # The functions look the build tree up by .src.rpm name, the file itself is never opened
+    srpm_name = os.path.join(os.path.dirname(build_dir), "synth-1.0-1.src.rpm")
+    srpm.srpm_cache.register(srpm_name, build_dir)
+    explore = srpm.SrpmExploreFiles()
+    reader = srpm.SrpmReadFile()
+    source_dir = os.listdir(build_dir)[0]
+    deepest = max((root for root, _, files in os.walk(build_dir) if files), key=lambda r: r.count(os.path.sep))
+    deep_file = os.path.relpath(os.path.join(deepest, sorted(os.listdir(deepest))[0]), build_dir)
+    return {
+        "SrpmExploreFiles.top_level": measure(lambda: explore.srpm_explore_contents(srpm_name, ".", 1), repeat),
+        "SrpmExploreFiles.depth_2": measure(lambda: explore.srpm_explore_contents(srpm_name, ".", 2), repeat),
+        "SrpmExploreFiles.full_tree": measure(lambda: explore.srpm_explore_contents(srpm_name, ".", 0), repeat),
+        "SrpmReadFile.license": measure(lambda: reader.srpm_read_file(srpm_name, f"{source_dir}/COPYING", 50), repeat),
+        "SrpmReadFile.deep_file": measure(lambda: reader.srpm_read_file(srpm_name, deep_file, 1000), repeat),
+    }
+
+def rpm_benchmarks(rpm_files:list[str], repeat:int) -> dict:
+    file_list = rpm.RpmFileList()
+    dep_info = rpm.RpmDependencyInfo()
+    reader = rpm.RpmReadFile()
+    largest = max(rpm_files, key=os.path.getsize)
+
+    def all_contents():
+        for f in rpm_files:
+            file_list.rpm_get_contents(f, "/", 0)
+
+    def format_only():
+        for f in rpm_files:
+            file_list.format_output(f, "/usr/share", 3)
+
+    def license_path():
+        return sorted(file_list.get_cache_entry(largest).paths_with_flag(rpm.flag_license))[0]
+    license_file = license_path()
+
+    results = {
+        "RpmFileList.rpm_get_contents.all": measure(all_contents, repeat),
+        "RpmFileList.rpm_get_contents.largest": measure(lambda: file_list.rpm_get_contents(largest, "/usr/share", 2), repeat),
+    }
+    # format_output needs a populated cache, so it is only measured warm
+    all_contents()
+    results["RpmFileList.format_output.all"] = measure(format_only, repeat, warm_only=True)
+    results["RpmDependencyInfo.largest"] = measure(lambda: dep_info.rpm_get_dep_info(largest), repeat)
+    results["RpmReadFile.license"] = measure(lambda: reader.rpm_read_file(largest, license_file, 50), repeat)
+    return results
+
+def compare(results:dict, baseline:dict, threshold:float) -> list[str]:
+    """Returns a description of every metric that got slower than baseline * threshold.
+    :rtype: list[str]
+    """
+    regressions = []
+    for name, metrics in results["benchmarks"].items():
+        if name not in baseline.get("benchmarks", {}):
+            continue
+        for metric in ["cold_ms", "warm_ms_median"]:
+            previous = baseline["benchmarks"][name][metric]
+            current = metrics[metric]
+            if previous is None or current is None:
+                continue
+            # Ignore noise on very fast operations
+            if previous > 0.05 and current > previous * threshold:
+                regressions.append(f"{name} {metric}: {previous} -> {current} ms ({current / previous:.2f}x)")
+    return regressions
+
+if __name__ == "__main__":
+    options = {"preset": "small", "compression": "gzip", "repeat": "5", "workdir": None, "output": None, "baseline": None, "threshold": "1.25"}
+    overrides = {}
+    for a in sys.argv[1:]:
+        key, _, value = a.removeprefix("--").partition("=")
+        if key in options:
+            options[key] = value
+        elif key in fixtures.presets["small"]:
+            overrides[key] = int(value)
+        else:
+            raise ValueError(f"Unknown option '{a}'")
+    preset = {**fixtures.presets[options["preset"]], **overrides}
+    repeat = int(options["repeat"])
+
+    workdir = options["workdir"] if options["workdir"] else tempfile.mkdtemp(prefix="license-bench-")
+    cache_dir = tempfile.mkdtemp(prefix="license-bench-cache-")
+    os.environ["LICENSE_ASSISTANT_CACHE_DIR"] = cache_dir
+    print(f"Generating '{options['preset']}' fixtures in {workdir}")
+    build_dir = fixtures.generate_build_tree(workdir, source_files=preset["source_files"], files_per_dir=preset["files_per_dir"])
+
+    results = {
+        "preset": options["preset"],
+        "compression": options["compression"],
+        "params": preset,
+        "benchmarks": srpm_benchmarks(build_dir, repeat),
+    }
+    if shutil.which("rpmbuild") and shutil.which("rpm"):
+        rpm_files = fixtures.generate_rpms(workdir, subpackages=preset["subpackages"], files_per_package=preset["files_per_package"],
+                                           compression=options["compression"])
+        results["benchmarks"].update(rpm_benchmarks(rpm_files, repeat))
+    else:
+        print("rpmbuild/rpm not found, skipping RPM benchmarks")
+
+    for name, metrics in results["benchmarks"].items():
+        cold = f"{metrics['cold_ms']:10.3f} ms" if metrics["cold_ms"] is not None else f"{'-':>10}   "
+        print(f"{name:45} cold {cold}   warm {metrics['warm_ms_median']:10.3f} ms")
+    if options["output"]:
+        with open(options["output"], 'w') as f:
+            json.dump(results, f, indent=2)
+    if not options["workdir"]:
+        shutil.rmtree(workdir)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if options["baseline"]:
+        with open(options["baseline"], 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, float(options["threshold"]))
+        for r in regressions:
+            print(f"REGRESSION: {r}")
+        if regressions:
+            exit(1)
@@ -0,0 +1,153 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Synthetic fixtures for the benchmarks.
+# Generates a prepped build tree (what `rpmbuild -bp` leaves in BUILD/) and a set of binary RPMs built from a
+# generated .spec, at a configurable scale, so the rpm/srpm functions can be measured without downloading real
+# packages. Everything is derived from a seed, so the same parameters always produce the same fixtures.
+#
+# Building the RPMs needs `rpmbuild`, the build tree does not.
+
+import os
+import random
+import shutil
+import subprocess
+
+license_headers = [
+    ("GPL-2.0", "/*\n * This program is free software; you can redistribute it and/or modify it under the terms of the\n"
+                " * GNU General Public License as published by the Free Software Foundation; either version 2 of the\n"
+                " * License, or (at your option) any later version.\n */\n"),
+    ("MIT", "/*\n * Permission is hereby granted, free of charge, to any person obtaining a copy of this software and\n"
+            " * associated documentation files (the \"Software\"), to deal in the Software without restriction.\n */\n"),
+    ("BSD-3-Clause", "/*\n * Redistribution and use in source and binary forms, with or without modification, are permitted\n"
+                     " * provided that the following conditions are met. Neither the name of the project nor the names of its\n"
+                     " * contributors may be used to endorse or promote products derived from this software.\n */\n"),
+    ("Perl", "# This library is free software; you can redistribute it and/or modify it under the same terms as Perl itself.\n"),
+]
+
+license_texts = {
+    "COPYING": "GNU GENERAL PUBLIC LICENSE\nVersion 2, June 1991\n" + "Terms and conditions.\n" * 300,
+    "LICENSE.MIT": "Permission is hereby granted, free of charge, to any person obtaining a copy\n" + "of this software.\n" * 20,
+    "Artistic": "The \"Artistic License\"\n" + "Preamble.\n" * 150,
+}
+
+extensions = [".c", ".h", ".pm", ".pl", ".t", ".txt", ".pod", ".xs", ".sh"]
+
+# Payload compression, as understood by rpmbuild's _binary_payload macro
+payload_compression = {
+    "none": "w0.ufdio",
+    "gzip": "w9.gzdio",
+    "xz": "w6.xzdio",
+    "zstd": "w19.zstdio",
+}
+
+presets = {
+    # Roughly the shape of nano
+    "small": {"source_files": 300, "files_per_dir": 30, "subpackages": 2, "files_per_package": 60},
+    # Roughly the shape of perl, which has a huge source tree and dozens of subpackages
+    "perl": {"source_files": 8000, "files_per_dir": 60, "subpackages": 40, "files_per_package": 400},
+}
+
+def source_file_content(rng:random.Random, extension:str, lines:int) -> str:
+    spdx_id, header = rng.choice(license_headers)
+    if extension in [".pm", ".pl", ".t", ".sh"]:
+        header = "".join(f"# {line.lstrip('/* ')}\n" for line in header.split("\n") if line.strip() not in ["/*", "*/"])
+    body = "".join(f"int line_{i} = {rng.randint(0, 1 << 16)};\n" for i in range(lines))
+    return header + body
+
+def generate_build_tree(top_dir:str, name:str="synth", version:str="1.0", source_files:int=300, files_per_dir:int=30, seed:int=0) -> str:
+    """Creates BUILD/<name>-<version>/ under top_dir, filled with source files, nested directories and license files.
+    :rtype: str
+    :return: The BUILD directory, as expected by SrpmCache.register().
+    """
+    rng = random.Random(seed)
+    build_dir = os.path.join(top_dir, "BUILD")
+    source_dir = os.path.join(build_dir, f"{name}-{version}")
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(source_dir)
+    for license_name, text in license_texts.items():
+        with open(os.path.join(source_dir, license_name), 'w') as f:
+            f.write(text)
+
+    dirs = [source_dir]
+    for i in range(source_files):
+        if i % files_per_dir == 0 and i:
+            # Nest new directories under a random existing one, so the tree has some depth
+            parent = rng.choice(dirs)
+            new_dir = os.path.join(parent, f"dir{i // files_per_dir}")
+            os.makedirs(new_dir, exist_ok=True)
+            dirs.append(new_dir)
+        extension = rng.choice(extensions)
+        with open(os.path.join(dirs[-1], f"file{i}{extension}"), 'w') as f:
+            f.write(source_file_content(rng, extension, rng.randint(5, 200)))
+        # A sprinkling of binary files
+        if i % 97 == 0:
+            with open(os.path.join(dirs[-1], f"blob{i}.bin"), 'wb') as f:
+                f.write(bytes(rng.getrandbits(8) for _ in range(4096)))
+    return build_dir
+
+def generate_spec(name:str, version:str, subpackages:int, files_per_package:int) -> str:
+    lines = [
+        f"Name: {name}",
+        f"Version: {version}",
+        "Release: 1",
+        "Summary: Synthetic benchmark package",
+        "License: GPL-2.0-or-later AND MIT",
+        "BuildArch: noarch",
+        "",
+        "%description",
+        "Synthetic benchmark package.",
+        "",
+    ]
+    for p in range(subpackages):
+        lines += [
+            f"%package sub{p}",
+            f"Summary: Subpackage {p}",
+            f"Requires: {name} = %{{version}}-%{{release}}",
+            "",
+            f"%description sub{p}",
+            f"Subpackage {p}.",
+            "",
+        ]
+    lines += ["%install"]
+    for p in range(-1, subpackages):
+        tag = "main" if p < 0 else f"sub{p}"
+        lines += [
+            f"mkdir -p %{{buildroot}}/usr/share/{name}/{tag}/a/b %{{buildroot}}/usr/share/doc/{name}-{tag} %{{buildroot}}/usr/share/licenses/{name}-{tag}",
+            f"for i in $(seq 1 {files_per_package}); do echo \"content $i\" > %{{buildroot}}/usr/share/{name}/{tag}/a/b/file$i.pm; done",
+            f"echo 'README {tag}' > %{{buildroot}}/usr/share/doc/{name}-{tag}/README",
+            f"printf 'GNU GENERAL PUBLIC LICENSE\\nVersion 2, June 1991\\n' > %{{buildroot}}/usr/share/licenses/{name}-{tag}/COPYING",
+        ]
+    lines += ["", "%files"]
+    for p in range(-1, subpackages):
+        tag = "main" if p < 0 else f"sub{p}"
+        if p >= 0:
+            lines += ["", f"%files sub{p}"]
+        lines += [
+            f"/usr/share/{name}/{tag}",
+            f"%doc /usr/share/doc/{name}-{tag}/README",
+            f"%license /usr/share/licenses/{name}-{tag}/COPYING",
+        ]
+    return "\n".join(lines) + "\n"
+
+def generate_rpms(top_dir:str, name:str="synth", version:str="1.0", subpackages:int=2, files_per_package:int=60, compression:str="gzip") -> list[str]:
+    """Builds the binary RPMs for a generated .spec with rpmbuild.
+    :rtype: list[str]
+    :return: The paths to the built RPMs.
+    """
+    if not shutil.which("rpmbuild"):
+        raise ValueError("rpmbuild is required to generate RPM fixtures")
+    if compression not in payload_compression:
+        raise ValueError(f"Unknown compression '{compression}', must be one of {list(payload_compression)}")
+    spec_dir = os.path.join(top_dir, "SPECS")
+    os.makedirs(spec_dir, exist_ok=True)
+    spec_path = os.path.join(spec_dir, f"{name}.spec")
+    with open(spec_path, 'w') as f:
+        f.write(generate_spec(name, version, subpackages, files_per_package))
+    subprocess.check_call(["rpmbuild", "-bb", spec_path,
+                           "--define", f"_topdir {os.path.abspath(top_dir)}",
+                           "--define", f"_binary_payload {payload_compression[compression]}"],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    rpm_dir = os.path.join(top_dir, "RPMS", "noarch")
+    return sorted(os.path.join(rpm_dir, f) for f in os.listdir(rpm_dir) if f.endswith(".rpm"))
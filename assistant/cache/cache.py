@@ -0,0 +1,213 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# One registry for every in-memory cache in the process.
+# Each cache is bounded by an optional entry count and time to live, and the registry enforces a memory budget across
+# all of them by evicting whichever entry was used least recently, whichever cache it is in. Hit, miss and eviction
+# counts are kept per cache, which is mostly useful for long lived processes (batch.py, the tool server).
+#
+# The budget is LICENSE_ASSISTANT_CACHE_BUDGET_MB (default 512). Sizes are estimates: each cache may supply a sizeof
+# function, otherwise the shallow sys.getsizeof() of the value is used. Gauges (memory shared by the entries of a cache,
+# ie intern tables) count toward the budget too. They can't be evicted directly, but shrink once the entries using them
+# are evicted.
+
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+class BoundedCache:
+    """A dict-like LRU cache. Create these with CacheRegistry.create() rather than directly."""
+    def __init__(self, registry:"CacheRegistry", name:str, max_entries:int=None, ttl:float=None, sizeof=None, pinned:bool=False) -> None:
+        """
+        :param max_entries: Evict the least recently used entry beyond this many, None for no limit.
+        :param ttl: Seconds an entry stays valid, None for forever.
+        :param sizeof: Returns the approximate size in bytes of a value.
+        :param pinned: Never evict entries to meet the memory budget. For caches that can't be rebuilt on a miss.
+        """
+        self.registry = registry
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sizeof = sizeof if sizeof else sys.getsizeof
+        self.pinned = pinned
+        # key -> [value, size, stored_at, last_used_tick], least recently used first
+        self.data = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __expired(self, item:list) -> bool:
+        return self.ttl is not None and time.monotonic() - item[2] > self.ttl
+
+    def __remove(self, key) -> None:
+        item = self.data.pop(key)
+        self.bytes -= item[1]
+        self.registry.total_bytes -= item[1]
+
+    def get(self, key, default=None):
+        with self.registry.lock:
+            item = self.data.get(key)
+            if item is not None and self.__expired(item):
+                self.__remove(key)
+                self.expirations += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            item[3] = next(self.registry.ticks)
+            self.data.move_to_end(key)
+            return item[0]
+
+    def __getitem__(self, key):
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        # Doesn't count as a hit or miss, or refresh the entry
+        with self.registry.lock:
+            item = self.data.get(key)
+            return item is not None and not self.__expired(item)
+
+    def __setitem__(self, key, value) -> None:
+        size = self.sizeof(value)
+        with self.registry.lock:
+            if key in self.data:
+                self.__remove(key)
+            self.data[key] = [value, size, time.monotonic(), next(self.registry.ticks)]
+            self.bytes += size
+            self.registry.total_bytes += size
+            while self.max_entries is not None and len(self.data) > self.max_entries:
+                self.evict_oldest()
+            self.registry.enforce_budget()
+
+    def __delitem__(self, key) -> None:
+        with self.registry.lock:
+            self.__remove(key)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def pop(self, key, default=None):
+        with self.registry.lock:
+            if key not in self.data:
+                return default
+            value = self.data[key][0]
+            self.__remove(key)
+            return value
+
+    def keys(self) -> list:
+        with self.registry.lock:
+            return list(self.data.keys())
+
+    def items(self) -> list:
+        with self.registry.lock:
+            return [(key, item[0]) for key, item in self.data.items()]
+
+    def clear(self) -> None:
+        with self.registry.lock:
+            self.registry.total_bytes -= self.bytes
+            self.data.clear()
+            self.bytes = 0
+
+    def oldest_tick(self) -> int:
+        """Returns when the least recently used entry was last used, or None if the cache is empty."""
+        for item in self.data.values():
+            return item[3]
+        return None
+
+    def evict_oldest(self) -> None:
+        key = next(iter(self.data))
+        self.__remove(key)
+        self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.registry.lock:
+            return {
+                "entries": len(self.data),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "pinned": self.pinned,
+            }
+
+class CacheRegistry:
+    def __init__(self, memory_budget:int) -> None:
+        self.memory_budget = memory_budget
+        self.caches = {}
+        # Memory that is counted but can't be evicted directly, ie intern tables. name -> function returning bytes, which
+        # must be cheap, it is called on every budget check.
+        self.gauges = {}
+        self.total_bytes = 0
+        self.ticks = itertools.count()
+        # One lock for every cache, so the budget can be enforced across them
+        self.lock = threading.RLock()
+
+    def from_env() -> "CacheRegistry":
+        return CacheRegistry(int(float(os.environ.get("LICENSE_ASSISTANT_CACHE_BUDGET_MB", 512)) * 1024 * 1024))
+
+    def create(self, name:str, **kwargs) -> BoundedCache:
+        """Creates and registers a cache, see BoundedCache for the options. Creating the same name again returns the
+        existing cache.
+        :rtype: BoundedCache
+        """
+        with self.lock:
+            if name not in self.caches:
+                self.caches[name] = BoundedCache(self, name, **kwargs)
+            return self.caches[name]
+
+    def add_gauge(self, name:str, nbytes) -> None:
+        self.gauges[name] = nbytes
+
+    def gauge_bytes(self) -> int:
+        return sum(nbytes() for nbytes in self.gauges.values())
+
+    def enforce_budget(self) -> None:
+        with self.lock:
+            while self.total_bytes + self.gauge_bytes() > self.memory_budget:
+                candidates = [c for c in self.caches.values() if not c.pinned and c.data]
+                if not candidates:
+                    return
+                min(candidates, key=lambda c: c.oldest_tick()).evict_oldest()
+
+    def clear(self) -> None:
+        with self.lock:
+            for c in self.caches.values():
+                if not c.pinned:
+                    c.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "memory_budget": self.memory_budget,
+                "total_bytes": self.total_bytes,
+                "caches": {name: c.stats() for name, c in self.caches.items()},
+                "gauges": {name: nbytes() for name, nbytes in self.gauges.items()},
+            }
+
+    def summary(self) -> str:
+        """Returns a one line per cache, human readable version of stats().
+        :rtype: str
+        """
+        stats = self.stats()
+        used = stats["total_bytes"] + sum(stats["gauges"].values())
+        lines = [f"Caches: {used / 1024 / 1024:.1f} of {stats['memory_budget'] / 1024 / 1024:.0f} MB"]
+        for name, s in stats["caches"].items():
+            lines.append(f"  {name}: {s['entries']} entries, {s['bytes'] / 1024:.0f} KB, {s['hits']} hits, {s['misses']} misses, {s['evictions']} evictions")
+        for name, nbytes in stats["gauges"].items():
+            lines.append(f"  {name}: {nbytes / 1024:.0f} KB (shared by entries)")
+        return "\n".join(lines)
+
+registry = CacheRegistry.from_env()
@@ -0,0 +1,252 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Chat Completions engine for ThreadRunner.
+# ChatClient serves the part of the Assistants API that ThreadRunner uses (assistants, threads, messages and runs)
+# from the Chat Completions API instead. Threads are kept locally, so there is no server side state and nothing to
+# poll: each run step is a single streamed request, and a run comes back already completed or waiting on tool
+# outputs. Submitting the tool outputs makes the next request straight away.
+#
+# History is trimmed locally before each request. The first message on a thread (the seed prompt) is always kept, and
+# beyond that the most recent messages that fit in the history budget are sent. A tool call is never separated from
+# its outputs, and the tool round in progress is always sent, its outputs cut short if they alone are over the budget.
+#
+# The same tools, instructions and prompts work unchanged, and RecordingClient/ReplayClient can wrap a ChatClient
+# just as they wrap the real client.
+
+import copy
+import itertools
+import json
+import os
+import sys
+import threading
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from replay import replay
+from ratelimit import ratelimit
+
+def estimate_tokens(message:dict) -> int:
+    return int(len(json.dumps(message)) / ratelimit.chars_per_token) + 4
+
+def truncate_outputs(tool_round:list[dict], budget:int) -> list[dict]:
+    """Cuts the tool outputs in a tool round (the assistant message making the calls, then their outputs) short so the
+    round fits in the budget, sharing it evenly between the outputs. The messages are copied, not changed.
+    :rtype: list[dict]
+    """
+    outputs = len(tool_round) - 1
+    overhead = sum(estimate_tokens(dict(m, content="")) for m in tool_round)
+    # Every output keeps at least a little, so the model knows what came back
+    limit = max(int((budget - overhead) * ratelimit.chars_per_token / outputs), 200)
+    truncated = [tool_round[0]]
+    for m in tool_round[1:]:
+        content = m.get("content") or ""
+        if len(content) > limit:
+            m = dict(m, content=content[:limit] + f"\n... ({len(content) - limit} more characters cut to fit the history budget)")
+        truncated.append(m)
+    return truncated
+
+def trim_history(messages:list[dict], budget:int) -> list[dict]:
+    """Picks the messages to send: the first one, the tool round in progress if there is one, then as many of the most
+    recent as fit in the budget.
+    :param budget: Rough number of tokens the history may use, 0 for no limit.
+    :rtype: list[dict]
+    """
+    if not budget or len(messages) < 2:
+        return list(messages)
+    # The model must see the calls it just made and what they returned, or it makes them again
+    tail = len(messages)
+    while tail > 1 and messages[tail - 1]["role"] == "tool":
+        tail -= 1
+    if tail < len(messages) and tail > 1 and messages[tail - 1]["role"] == "assistant" and messages[tail - 1].get("tool_calls"):
+        tail -= 1
+        pinned = messages[tail:]
+        if estimate_tokens(messages[0]) + sum(estimate_tokens(m) for m in pinned) > budget:
+            pinned = truncate_outputs(pinned, budget - estimate_tokens(messages[0]))
+    else:
+        tail = len(messages)
+        pinned = []
+    used = estimate_tokens(messages[0]) + sum(estimate_tokens(m) for m in pinned)
+    start = tail
+    for i in range(tail - 1, 0, -1):
+        used += estimate_tokens(messages[i])
+        # Without a tool round, the most recent message is sent whatever its size
+        if used > budget and (pinned or start < len(messages)):
+            break
+        start = i
+    # Tool outputs must follow the assistant message that asked for them
+    while start < tail and messages[start]["role"] == "tool":
+        start += 1
+    return [messages[0]] + messages[start:tail] + pinned
+
+def snapshot(run:dict):
+    # Runs keep changing as they step, callers get the state as it was when they asked
+    return replay.ReplayObject(copy.deepcopy(run))
+
+class ChatClient:
+    # Default history budget in tokens, overridden by LICENSE_ASSISTANT_CHAT_HISTORY_TOKENS (0 is unlimited)
+    history_tokens = 60000
+
+    def __init__(self, client, history_tokens:int=None) -> None:
+        self.client = client
+        if history_tokens is None:
+            history_tokens = int(os.environ.get("LICENSE_ASSISTANT_CHAT_HISTORY_TOKENS", ChatClient.history_tokens))
+        self.history_tokens = history_tokens
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.assistants = {}
+        # Thread id -> list of chat messages
+        self.threads = {}
+        # Run id -> run state, as the Assistants API would describe it
+        self.runs = {}
+        self.beta = replay.ReplayClient.Namespace(
+            assistants=replay.ReplayClient.Namespace(
+                create=self.create_assistant,
+                retrieve=lambda assistant_id, **kwargs: replay.ReplayObject(self.assistants[assistant_id]),
+            ),
+            threads=replay.ReplayClient.Namespace(
+                create=self.create_thread,
+                messages=replay.ReplayClient.Namespace(
+                    create=self.create_message,
+                    list=self.list_messages,
+                ),
+                runs=replay.ReplayClient.Namespace(
+                    create=self.create_run,
+                    retrieve=lambda thread_id, run_id, **kwargs: snapshot(self.runs[run_id]),
+                    cancel=self.cancel_run,
+                    submit_tool_outputs=self.submit_tool_outputs,
+                ),
+            ),
+        )
+
+    def __new_id(self, prefix:str) -> str:
+        return f"chat_{prefix}_{next(self.counter)}"
+
+    def create_assistant(self, model:str, instructions:str=None, tools:list=None, **kwargs):
+        assistant = {"id": self.__new_id("assistant"), "object": "assistant", "model": model, "instructions": instructions,
+                     "tools": tools or [], "metadata": kwargs.get("metadata")}
+        self.assistants[assistant["id"]] = assistant
+        return replay.ReplayObject(assistant)
+
+    def create_thread(self, **kwargs):
+        thread_id = self.__new_id("thread")
+        with self.lock:
+            self.threads[thread_id] = []
+        return replay.ReplayObject({"id": thread_id, "object": "thread"})
+
+    def create_message(self, thread_id:str, role:str, content, **kwargs):
+        with self.lock:
+            self.threads[thread_id].append({"role": role, "content": str(content)})
+        return replay.ReplayObject({"id": self.__new_id("message"), "object": "thread.message", "role": role})
+
+    def list_messages(self, thread_id:str, **kwargs):
+        """Lists the text messages on a thread, newest first. Tool calls and outputs are run steps, so aren't listed."""
+        with self.lock:
+            messages = [m for m in self.threads[thread_id] if m["role"] in ["user", "assistant"] and m.get("content")]
+        data = [{"role": m["role"], "content": [{"type": "text", "text": {"value": m["content"]}}]} for m in reversed(messages)]
+        return replay.ReplayObject({"object": "list", "data": data})
+
+    def create_run(self, thread_id:str, assistant_id:str, tool_choice="auto", **kwargs):
+        run = {
+            "id": self.__new_id("run"),
+            "object": "thread.run",
+            "thread_id": thread_id,
+            "assistant_id": assistant_id,
+            "status": "in_progress",
+            "required_action": None,
+            "last_error": None,
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            "tool_choice": tool_choice,
+        }
+        self.runs[run["id"]] = run
+        return self.__step(run)
+
+    def submit_tool_outputs(self, thread_id:str, run_id:str, tool_outputs:list, **kwargs):
+        run = self.runs[run_id]
+        with self.lock:
+            for output in tool_outputs:
+                self.threads[thread_id].append({"role": "tool", "tool_call_id": output["tool_call_id"], "content": output["output"]})
+        run["required_action"] = None
+        # A forced tool choice only applies to the first step of a run, or the model could never finish
+        run["tool_choice"] = "auto"
+        return self.__step(run)
+
+    def cancel_run(self, thread_id:str, run_id:str, **kwargs):
+        run = self.runs[run_id]
+        if run["required_action"]:
+            # Every tool call needs an answer before the thread can be used again
+            with self.lock:
+                for call in run["required_action"]["submit_tool_outputs"]["tool_calls"]:
+                    self.threads[thread_id].append({"role": "tool", "tool_call_id": call["id"], "content": "Cancelled."})
+            run["required_action"] = None
+        run["status"] = "cancelled"
+        return snapshot(run)
+
+    def __step(self, run:dict):
+        """Makes one streamed request for a run, and leaves the run completed or waiting for tool outputs."""
+        from openai import RateLimitError
+
+        assistant = self.assistants[run["assistant_id"]]
+        with self.lock:
+            history = trim_history(self.threads[run["thread_id"]], self.history_tokens)
+        messages = ([{"role": "system", "content": assistant["instructions"]}] if assistant["instructions"] else []) + history
+        request = {"model": assistant["model"], "messages": messages, "stream": True, "stream_options": {"include_usage": True}}
+        if assistant["tools"]:
+            request["tools"] = assistant["tools"]
+            request["tool_choice"] = run["tool_choice"]
+        try:
+            content, tool_calls, usage = self.__collect(self.client.chat.completions.create(**request))
+        except RateLimitError as e:
+            run["status"] = "failed"
+            run["last_error"] = {"code": "rate_limit_exceeded", "message": f"{e}"}
+            return snapshot(run)
+
+        if usage is None:
+            # Older API versions don't report usage when streaming
+            prompt_tokens = sum(estimate_tokens(m) for m in messages)
+            completion_tokens = int(len(content + json.dumps(tool_calls)) / ratelimit.chars_per_token)
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        for key in ["prompt_tokens", "completion_tokens"]:
+            run["usage"][key] += usage[key]
+        run["usage"]["total_tokens"] = run["usage"]["prompt_tokens"] + run["usage"]["completion_tokens"]
+
+        reply = {"role": "assistant", "content": content or None}
+        if tool_calls:
+            reply["tool_calls"] = tool_calls
+        with self.lock:
+            self.threads[run["thread_id"]].append(reply)
+        if tool_calls:
+            run["status"] = "requires_action"
+            run["required_action"] = {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": tool_calls}}
+        else:
+            run["status"] = "completed"
+        return snapshot(run)
+
+    def __collect(self, stream) -> tuple:
+        """Assembles a streamed response.
+        :rtype: tuple
+        :return: The text content, the tool calls, and the usage (None if it wasn't reported).
+        """
+        content = []
+        tool_calls = {}
+        usage = None
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = {"prompt_tokens": chunk.usage.prompt_tokens, "completion_tokens": chunk.usage.completion_tokens}
+            for choice in chunk.choices or []:
+                delta = choice.delta
+                if delta is None:
+                    continue
+                if delta.content:
+                    content.append(delta.content)
+                for call in delta.tool_calls or []:
+                    # Tool calls arrive in pieces, keyed by their index
+                    entry = tool_calls.setdefault(call.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+                    if call.id:
+                        entry["id"] = call.id
+                    if call.function and call.function.name:
+                        entry["function"]["name"] += call.function.name
+                    if call.function and call.function.arguments:
+                        entry["function"]["arguments"] += call.function.arguments
+        return "".join(content), [tool_calls[i] for i in sorted(tool_calls)], usage
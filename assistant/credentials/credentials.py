@@ -0,0 +1,130 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Cross process cache of Azure AD tokens.
+# Building a DefaultAzureCredential means probing every credential in its chain, which can take seconds, and the first
+# token fetch costs another round trip. Tokens are valid for an hour or more, so they are kept on disk (readable only
+# by the current user) and reused by later invocations until shortly before they expire. The credential itself is only
+# built when the cache can't answer.
+#
+# Tokens are keyed on the scope and on who is signed in, as far as that can be told without asking Azure: the service
+# principal and managed identity settings in the environment and the az CLI's active account. A token the service
+# rejects is dropped, so the next request fetches a fresh one.
+#
+# Set LICENSE_ASSISTANT_TOKEN_CACHE=0 to keep tokens in memory only.
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from assistant_funcs import assistant_funcs
+
+# Settings DefaultAzureCredential picks its identity from
+identity_env_vars = ["AZURE_TENANT_ID", "AZURE_CLIENT_ID", "AZURE_USERNAME", "AZURE_CLIENT_CERTIFICATE_PATH", "AZURE_FEDERATED_TOKEN_FILE",
+                     "IDENTITY_ENDPOINT", "MSI_ENDPOINT"]
+
+def az_cli_account() -> str:
+    """Returns the az CLI's active account as 'user@tenant', or an empty string if the CLI isn't signed in.
+    :rtype: str
+    """
+    config_dir = os.environ.get("AZURE_CONFIG_DIR", os.path.join(os.path.expanduser("~"), ".azure"))
+    try:
+        # The CLI writes the profile with a BOM
+        with open(os.path.join(config_dir, "azureProfile.json"), 'r', encoding='utf-8-sig') as f:
+            profile = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return ""
+    for subscription in profile.get("subscriptions", []):
+        if subscription.get("isDefault"):
+            return f"{subscription.get('user', {}).get('name', '')}@{subscription.get('tenantId', '')}"
+    return ""
+
+class TokenCache:
+    # Tokens this close to expiry are refreshed rather than reused
+    refresh_margin = 300
+
+    def __init__(self, credential_factory, cache_path:str=None, persist:bool=None) -> None:
+        """
+        :param credential_factory: Called with no arguments to build the credential on the first cache miss.
+        :param cache_path: File to persist tokens in, defaults to 'tokens.json' in the 'credentials' cache directory.
+        :param persist: Whether to persist tokens at all, defaults to the LICENSE_ASSISTANT_TOKEN_CACHE setting.
+        """
+        if persist is None:
+            persist = os.environ.get("LICENSE_ASSISTANT_TOKEN_CACHE", "1") != "0"
+        self.credential_factory = credential_factory
+        self.credential = None
+        self.cache_path = None
+        if persist:
+            self.cache_path = cache_path if cache_path else os.path.join(assistant_funcs.get_cache_dir("credentials"), "tokens.json")
+        self.lock = threading.Lock()
+        self.tokens = self.__load()
+        self.principal = "|".join([os.environ.get(name, "") for name in identity_env_vars] + [az_cli_account()])
+
+    def __identity(self, scope:str) -> str:
+        # Tokens from one identity must never be handed out for another
+        return f"{scope}|{self.principal}"
+
+    def __load(self) -> dict:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                tokens = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        now = time.time()
+        return {key: token for key, token in tokens.items() if token["expires_on"] - self.refresh_margin > now}
+
+    def __save(self) -> None:
+        if not self.cache_path:
+            return
+        # mkstemp creates the file as 0600, so the tokens are never readable by other users, even briefly.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_path), suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.tokens, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def get_token(self, scope:str) -> str:
+        """Returns a bearer token for the scope, from the cache if a fresh one is available.
+        :rtype: str
+        """
+        key = self.__identity(scope)
+        with self.lock:
+            token = self.tokens.get(key)
+            if token and token["expires_on"] - self.refresh_margin > time.time():
+                return token["token"]
+            if self.credential is None:
+                self.credential = self.credential_factory()
+            access_token = self.credential.get_token(scope)
+            self.tokens[key] = {"token": access_token.token, "expires_on": access_token.expires_on}
+            # Another process may have added tokens for other scopes in the meantime, keep them
+            self.tokens = {**self.__load(), **self.tokens}
+            self.__save()
+            return access_token.token
+
+    def evict(self, scope:str) -> None:
+        """Drops the cached token for the scope, ie after the service rejected it."""
+        key = self.__identity(scope)
+        with self.lock:
+            self.tokens = {**self.__load(), **self.tokens}
+            if self.tokens.pop(key, None):
+                self.__save()
+
+    def provider(self, scope:str):
+        """Returns a callable suitable for AzureOpenAI's azure_ad_token_provider.
+        """
+        return lambda: self.get_token(scope)
+
+    def response_hook(self, scope:str):
+        """Returns an httpx response event hook that evicts the scope's token when a request is rejected as unauthorized.
+        """
+        def hook(response) -> None:
+            if response.status_code == 401:
+                self.evict(scope)
+        return hook
@@ -0,0 +1,209 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Local pre-filter for the deep scan.
+# Rather than asking the model to pick interesting files out of every path in a build tree, each file is scored
+# locally from cheap license-relevance signals:
+#   - its name (LICENSE, COPYING, NOTICE, ...)
+#   - markers in its first few KB (SPDX tags, license boilerplate, copyright lines)
+#   - what kind of file it is (source, script, build system, documentation, data, binary)
+#   - how unusual it is for its directory (a rare extension, or a license that differs from its siblings)
+# The best scoring files are then deduplicated so that many files sharing an identical header only cost one look.
+
+import hashlib
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from licenses import licenses
+
+header_bytes = 4096
+
+license_name_re = re.compile(r"(^|[-_.])(licen[cs]e|copying|copyright|notice|patents|unlicense|legal)([-_.]|$)", re.IGNORECASE)
+readme_name_re = re.compile(r"^(readme|authors|credits|contributors)([-_.]|$)", re.IGNORECASE)
+
+source_extensions = {".c", ".h", ".cc", ".cpp", ".cxx", ".hh", ".hpp", ".hxx", ".m", ".s", ".asm", ".go", ".rs", ".java",
+                     ".js", ".ts", ".cs", ".swift", ".y", ".l", ".xs", ".inc"}
+script_extensions = {".py", ".pl", ".pm", ".sh", ".bash", ".rb", ".php", ".tcl", ".lua", ".awk", ".sed", ".t"}
+build_extensions = {".am", ".in", ".ac", ".m4", ".mk", ".cmake", ".spec", ".pc"}
+doc_extensions = {".txt", ".md", ".rst", ".html", ".htm", ".pod", ".texi", ".texinfo", ".1", ".3", ".5", ".8", ".xml", ".sgml"}
+binary_extensions = {".png", ".jpg", ".jpeg", ".gif", ".ico", ".gz", ".bz2", ".xz", ".zip", ".tar", ".o", ".a", ".so",
+                     ".pdf", ".bin", ".mo", ".gmo", ".ttf", ".woff"}
+build_names = {"makefile", "configure", "cmakelists.txt", "meson.build", "makefile.pl", "build.pl", "setup.py"}
+
+kind_weights = {
+    "license": 5.0,
+    "source": 2.0,
+    "script": 2.0,
+    "build": 1.0,
+    "doc": 1.0,
+    "data": 0.0,
+    "binary": -10.0,
+}
+
+class FileScore:
+    def __init__(self, path:str, kind:str) -> None:
+        self.path = path
+        self.kind = kind
+        self.score = 0.0
+        self.licenses = set()
+        self.families = set()
+        self.header_key = None
+        # How many files share this file's header, see headers.assign_clusters()
+        self.cluster_size = 1
+        self.reasons = []
+
+    def add(self, amount:float, reason:str) -> None:
+        self.score += amount
+        self.reasons.append(reason)
+
+    def __repr__(self) -> str:
+        return f"{self.path} ({self.score:.1f}: {', '.join(self.reasons)})"
+
+def file_kind(path:str) -> str:
+    """Classifies a file from its name alone.
+    :rtype: str
+    """
+    name = os.path.basename(path)
+    extension = os.path.splitext(name)[1].lower()
+    if license_name_re.search(name):
+        return "license"
+    if name.lower() in build_names or extension in build_extensions:
+        return "build"
+    if extension in source_extensions:
+        return "source"
+    if extension in script_extensions:
+        return "script"
+    if extension in binary_extensions:
+        return "binary"
+    if extension in doc_extensions or readme_name_re.search(name):
+        return "doc"
+    return "data"
+
+def read_header(full_path:str) -> str:
+    """Returns the first few KB of a file as text, or None for binary or unreadable files.
+    :rtype: str
+    """
+    try:
+        with open(full_path, 'rb') as f:
+            data = f.read(header_bytes)
+    except OSError:
+        return None
+    if b"\0" in data:
+        return None
+    return data.decode('utf-8', errors='replace')
+
+def header_key(header:str) -> str:
+    """Hashes the comment block at the top of a file, ignoring years and whitespace, so identical boilerplate collides.
+    :rtype: str
+    """
+    normalized = licenses.normalize(header[:1024])
+    normalized = re.sub(r"\b(19|20)\d\d\b", "", normalized)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+def score_file(top_dir:str, path:str) -> FileScore:
+    entry = FileScore(path, file_kind(path))
+    entry.add(kind_weights[entry.kind], entry.kind)
+    if entry.kind == "binary":
+        return entry
+    header = read_header(os.path.join(top_dir, path))
+    if header is None:
+        entry.add(kind_weights["binary"], "binary content")
+        return entry
+    entry.header_key = header_key(header)
+    entry.licenses = licenses.detect_licenses(header)
+    entry.families = set(licenses.license_family(l) for l in entry.licenses)
+    if licenses.spdx_tags(header):
+        entry.add(4.0, "spdx tag")
+    if entry.licenses:
+        entry.add(3.0, f"mentions {sorted(entry.licenses)}")
+    if licenses.has_copyright(header):
+        entry.add(1.0, "copyright")
+    return entry
+
+def score_files(top_dir:str, paths:list[str], workers:int=8) -> list[FileScore]:
+    """Scores every file in a build tree, best candidates first.
+    :param top_dir: The directory the paths are relative to.
+    :param paths: Relative paths of the files to score.
+    :rtype: list[FileScore]
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        scores = list(executor.map(lambda p: score_file(top_dir, p), paths))
+
+    # Work out what is normal for each directory, so outliers can be boosted
+    extension_counts = {}
+    family_counts = {}
+    dir_sizes = {}
+    for entry in scores:
+        directory = os.path.dirname(entry.path)
+        extension = os.path.splitext(entry.path)[1].lower()
+        dir_sizes[directory] = dir_sizes.get(directory, 0) + 1
+        extension_counts[(directory, extension)] = extension_counts.get((directory, extension), 0) + 1
+        for family in entry.families:
+            family_counts[(directory, family)] = family_counts.get((directory, family), 0) + 1
+
+    for entry in scores:
+        if entry.kind == "binary":
+            continue
+        directory = os.path.dirname(entry.path)
+        size = dir_sizes[directory]
+        if size < 3:
+            continue
+        extension = os.path.splitext(entry.path)[1].lower()
+        rarity = 1.0 - extension_counts[(directory, extension)] / size
+        if rarity > 0.8:
+            entry.add(2.0 * rarity, "unusual extension for directory")
+        for family in entry.families:
+            if family_counts[(directory, family)] / size < 0.2:
+                entry.add(4.0, f"unusual license {family} for directory")
+                break
+
+    scores.sort(key=lambda e: (-e.score, e.path))
+    return scores
+
+def select_candidates(scores:list[FileScore], limit:int=120, per_license_limit:int=3) -> list[FileScore]:
+    """Picks the top scoring files, dropping files whose header duplicates one already picked, and capping how many
+    files with the same set of detected licenses are picked.
+    :rtype: list[FileScore]
+    """
+    selected = []
+    seen_headers = set()
+    per_license = {}
+    for entry in scores:
+        if len(selected) >= limit or entry.score <= 0:
+            break
+        if entry.header_key and entry.header_key in seen_headers:
+            continue
+        license_key = tuple(sorted(entry.licenses))
+        if license_key and entry.kind != "license":
+            if per_license.get(license_key, 0) >= per_license_limit:
+                continue
+            per_license[license_key] = per_license.get(license_key, 0) + 1
+        if entry.header_key:
+            seen_headers.add(entry.header_key)
+        selected.append(entry)
+    return selected
+
+def detected_families(scores:list[FileScore]) -> set[str]:
+    """Returns every license family detected anywhere in the scored files.
+    :rtype: set[str]
+    """
+    families = set()
+    for entry in scores:
+        families.update(entry.families)
+    return families
+
+# Only run tests when this file is run directly
+if __name__ == "__main__":
+    top_dir = sys.argv[1] if len(sys.argv) > 1 else "./nano-testing/build/BUILD"
+    paths = []
+    for root, _, file_list in os.walk(top_dir):
+        paths.extend(os.path.relpath(os.path.join(root, f), top_dir) for f in file_list)
+    scores = score_files(top_dir, paths)
+    print(f"Detected license families: {sorted(detected_families(scores))}")
+    for entry in select_candidates(scores, 40):
+        print(entry)
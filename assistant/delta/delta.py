@@ -0,0 +1,285 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Differences between two releases of a package set, computed locally.
+# Most reviews are of a rebuild whose previous release was already reviewed. The fact sheets of both releases are
+# compared package by package (paired by package name): shipped executables, libraries and modules, license files and
+# their contents, what each package provides and requires, and the spec License tags. The SRPM side compares the
+# source tree's license files and the licenses detected in source file headers.
+#
+# Only license relevant changes are reported. A package with none keeps its previous verdict, the rest are reviewed
+# with a prompt that carries the previous verdict and lists exactly what changed.
+#
+# The same comparison dedups builds of one package for several architectures within a release: one build per package
+# name is reviewed in full, and the others are diffed against it. Only those that differ are asked about.
+
+import os
+import re
+import sys
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from rpm import rpm
+from srpm import srpm
+from verdicts import verdicts
+from facts import facts
+
+# Shipped content that needs a license, see facts.PackageFacts.needs_license(), and docs, which may carry notices
+compared_kinds = ["executables", "shared_libraries", "static_libraries", "modules", "docs"]
+
+# Longest list of paths shown for a single kind of change
+max_paths_shown = 10
+
+# Which build of a package is reviewed in full, earlier is preferred, anything else comes after
+preferred_arches = ["x86_64", "noarch", "aarch64"]
+
+# The ISA marker rpm adds to arch specific provides and requires, ie the '(x86-64)' of 'nano(x86-64)'
+isa_marker_re = re.compile(r"\([a-z0-9_]+-(32|64)\)$")
+
+def package_version(rpm_file:str) -> str:
+    """Returns the version of an rpm, ie '6.0' for nano-6.0-2.cm2.x86_64.rpm.
+    :rtype: str
+    """
+    return rpm.rpm_query(rpm_file, ["-q", "--qf", "%{VERSION}"])[0]
+
+def package_arch(rpm_file:str) -> str:
+    """Returns the architecture of an rpm, ie 'x86_64' or 'noarch'.
+    :rtype: str
+    """
+    return rpm.rpm_query(rpm_file, ["-q", "--qf", "%{ARCH}"])[0]
+
+def arch_rank(arch:str) -> int:
+    return preferred_arches.index(arch) if arch in preferred_arches else len(preferred_arches)
+
+def capability(dependency:str) -> str:
+    """Strips the version constraint and ISA marker from a provides/requires entry, ie 'nano(aarch-64) = 6.0-2' -> 'nano'.
+    :rtype: str
+    """
+    return isa_marker_re.sub("", facts.capability_name(dependency))
+
+def renamer(old_version:str, new_version:str):
+    """Returns a function mapping a path from the old release to where it would be in the new one, ie
+    '/usr/share/doc/nano-6.0/README' -> '/usr/share/doc/nano-7.0/README'.
+    """
+    if not old_version or not new_version or old_version == new_version:
+        return lambda path: path
+    # Only a version ending a path component after a '-', so 'libfoo.so.6.0' is left alone
+    versioned_re = re.compile(f"-{re.escape(old_version)}(?=/|$)")
+    return lambda path: versioned_re.sub(f"-{new_version}", path)
+
+def shown(paths:list[str]) -> str:
+    paths = sorted(paths)
+    text = ", ".join(paths[:max_paths_shown])
+    if len(paths) > max_paths_shown:
+        text += f", ... ({len(paths) - max_paths_shown} more)"
+    return text
+
+def set_changes(label:str, old:set, new:set) -> list[str]:
+    lines = []
+    if new - old:
+        lines.append(f"- {label} added: {shown(new - old)}")
+    if old - new:
+        lines.append(f"- {label} removed: {shown(old - new)}")
+    return lines
+
+def ids_text(ids:set) -> str:
+    return ", ".join(sorted(ids)) if ids else "unrecognized text"
+
+def rpm_file_hash(rpm_file:str, path:str) -> str:
+    try:
+        return verdicts.hash_file(rpm.RpmReadFile().extract_file(rpm_file, path))
+    except (OSError, ValueError):
+        return None
+
+class PackageDelta:
+    def __init__(self, old:facts.PackageFacts, new:facts.PackageFacts) -> None:
+        self.old = old
+        self.new = new
+        self.old_version = package_version(old.rpm_file)
+        self.new_version = package_version(new.rpm_file)
+        rename = renamer(self.old_version, self.new_version)
+        self.lines = []
+
+        for kind in compared_kinds:
+            old_paths = {rename(p) for p in getattr(old, kind)}
+            self.lines += set_changes(kind.replace("_", " "), old_paths, set(getattr(new, kind)))
+        # Everything else that is shipped, so the file lists as a whole are compared
+        old_other = {rename(p) for p in old.files} - {rename(p) for p in self.__classified(old)}
+        new_other = set(new.files) - set(self.__classified(new))
+        self.lines += set_changes("other files", old_other, new_other)
+
+        # License files by where they would be in the new release, so a version in the path isn't a change
+        old_licenses = {rename(p): p for p in old.license_files}
+        self.lines += set_changes("license files", set(old_licenses), set(new.license_files))
+        for path in sorted(set(old_licenses) & set(new.license_files)):
+            old_path = old_licenses[path]
+            if rpm_file_hash(old.rpm_file, old_path) != rpm_file_hash(new.rpm_file, path):
+                self.lines.append(f"- license file {path} changed content, detected: {ids_text(old.license_files[old_path])} -> "
+                                  f"{ids_text(new.license_files[path])}")
+
+        # Dependencies are compared without versions, every release bumps those, and without ISA markers, which differ
+        # between architectures
+        for label, old_deps, new_deps in [("requires", old.requires, new.requires), ("provides", old.provides, new.provides)]:
+            self.lines += set_changes(label, {capability(d) for d in old_deps}, {capability(d) for d in new_deps})
+        self.lines += set_changes("hard required sibling packages", set(old.required_siblings), set(new.required_siblings))
+
+        if old.spec_license != new.spec_license:
+            self.lines.append(f"- spec License tag: '{old.spec_license}' -> '{new.spec_license}'")
+
+    def __classified(self, package:facts.PackageFacts) -> list[str]:
+        return [p for kind in compared_kinds for p in getattr(package, kind)] + list(package.license_files)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.lines)
+
+class JobDelta:
+    def __init__(self, old_sheet:facts.FactSheet, new_sheet:facts.FactSheet, old_srpm:str=None, new_srpm:str=None) -> None:
+        # New rpm -> the old rpm of the same package, built for the same architecture
+        self.previous = {}
+        self.packages = {}
+        old_by_build = {(f.name, package_arch(f.rpm_file)): f for f in old_sheet.packages.values()}
+        new_by_build = {(f.name, package_arch(f.rpm_file)): f for f in new_sheet.packages.values()}
+        for build, new in new_by_build.items():
+            old = old_by_build.get(build)
+            if old:
+                self.previous[new.rpm_file] = old.rpm_file
+                self.packages[new.rpm_file] = PackageDelta(old, new)
+        self.added_packages = sorted(f"{name}.{arch}" for name, arch in set(new_by_build) - set(old_by_build))
+        self.removed_packages = sorted(f"{name}.{arch}" for name, arch in set(old_by_build) - set(new_by_build))
+
+        # Changes in the sources apply to every package built from them
+        self.build_lines = []
+        # Subpackages share the source's version
+        versions = [(d.old_version, d.new_version) for d in self.packages.values()]
+        rename = renamer(*versions[0]) if versions else renamer(None, None)
+        old_sources = {rename(p): p for p in old_sheet.source_license_files}
+        new_sources = new_sheet.source_license_files
+        self.build_lines += set_changes("source tree license files", set(old_sources), set(new_sources))
+        if old_srpm and new_srpm:
+            for path in sorted(set(old_sources) & set(new_sources)):
+                if self.__source_hash(old_srpm, old_sources[path]) != self.__source_hash(new_srpm, path):
+                    self.build_lines.append(f"- source tree license file {path} changed content, detected: "
+                                            f"{ids_text(old_sheet.source_license_files[old_sources[path]])} -> {ids_text(new_sources[path])}")
+        old_header_ids = set().union(*[c.licenses for c in old_sheet.header_clusters])
+        new_header_ids = set().union(*[c.licenses for c in new_sheet.header_clusters])
+        self.build_lines += set_changes("licenses detected in source file headers", old_header_ids, new_header_ids)
+
+    def __source_hash(self, srpm_file:str, path:str) -> str:
+        try:
+            return verdicts.hash_file(os.path.join(srpm.srpm_cache.get_from_cache(srpm_file), path))
+        except (OSError, ValueError):
+            return None
+
+    def changed(self, rpm_file:str) -> bool:
+        """Returns whether anything that could affect a package's verdict changed. Packages that are new in this release
+        always count as changed.
+        :rtype: bool
+        """
+        return rpm_file not in self.packages or self.packages[rpm_file].changed or bool(self.build_lines)
+
+    def describe(self, rpm_file:str) -> str:
+        """Returns the license relevant changes for one package, including changes in the sources.
+        :rtype: str
+        """
+        if rpm_file not in self.packages:
+            return f"'{os.path.basename(rpm_file)}' is new in this release."
+        lines = [f"Changes in '{os.path.basename(rpm_file)}' since '{os.path.basename(self.previous[rpm_file])}':"]
+        lines += self.packages[rpm_file].lines or ["- no changes to the package itself"]
+        if self.build_lines:
+            lines.append("Changes in the sources all packages are built from:")
+            lines += self.build_lines
+        return "\n".join(lines)
+
+    def summary(self) -> str:
+        """Returns the changes that apply to the whole package set.
+        :rtype: str
+        """
+        lines = [f"{len(self.packages)} packages carried over from the previous release, "
+                 f"{sum(1 for d in self.packages.values() if d.changed)} of them changed."]
+        if self.added_packages:
+            lines.append(f"- packages new in this release: {', '.join(self.added_packages)}")
+        if self.removed_packages:
+            lines.append(f"- packages dropped since the previous release: {', '.join(self.removed_packages)}")
+        lines += self.build_lines
+        return "\n".join(lines)
+
+class ArchGroups:
+    def __init__(self, sheet:facts.FactSheet) -> None:
+        # Rpm built for another architecture -> the rpm of the same package that is reviewed in full
+        self.representative = {}
+        self.packages = {}
+        by_name = {}
+        for package in sheet.packages.values():
+            by_name.setdefault(package.name, []).append(package)
+        for group in by_name.values():
+            if len(group) < 2:
+                continue
+            group.sort(key=lambda package: (arch_rank(package_arch(package.rpm_file)), package.rpm_file))
+            for variant in group[1:]:
+                self.representative[variant.rpm_file] = group[0].rpm_file
+                self.packages[variant.rpm_file] = PackageDelta(group[0], variant)
+
+    def differs(self, rpm_file:str) -> bool:
+        """Returns whether a build differs from its representative in anything that could affect its verdict.
+        :rtype: bool
+        """
+        return self.packages[rpm_file].changed
+
+    def describe(self, rpm_file:str) -> str:
+        """Returns the license relevant differences between a build and its representative.
+        :rtype: str
+        """
+        lines = [f"Differences in '{os.path.basename(rpm_file)}' from '{os.path.basename(self.representative[rpm_file])}':"]
+        lines += self.packages[rpm_file].lines or ["- none"]
+        return "\n".join(lines)
+
+    def summary(self) -> str:
+        """Returns how the builds for other architectures compare to their representatives.
+        :rtype: str
+        """
+        different = sorted(os.path.basename(f) for f in self.packages if self.differs(f))
+        lines = [f"{len(self.packages)} packages are additional builds for other architectures, "
+                 f"{len(self.packages) - len(different)} of them identical for licensing to the build that is reviewed in full."]
+        if different:
+            lines.append(f"- builds that differ: {', '.join(different)}")
+        return "\n".join(lines)
+
+def split_files(files:list[str]) -> tuple:
+    """Splits a package set's files into (rpm files, spec file, srpm file), the spec and srpm may be None.
+    :rtype: tuple
+    """
+    rpm_files = [f for f in files if f.endswith(".rpm") and not f.endswith(".src.rpm")]
+    spec_files = [f for f in files if f.endswith(".spec")]
+    srpm_files = [f for f in files if f.endswith(".src.rpm")]
+    return rpm_files, spec_files[0] if spec_files else None, srpm_files[0] if srpm_files else None
+
+def compare(previous_files:list[str], files:list[str], new_sheet:facts.FactSheet=None) -> JobDelta:
+    """Compares the previous release of a package set with the new one.
+    :param new_sheet: The new release's fact sheet, if it was already gathered.
+    :rtype: JobDelta
+    """
+    old_rpms, old_spec, old_srpm = split_files(previous_files)
+    new_rpms, new_spec, new_srpm = split_files(files)
+    old_sheet = facts.FactSheet(old_rpms, old_spec, old_srpm)
+    if new_sheet is None:
+        new_sheet = facts.FactSheet(new_rpms, new_spec, new_srpm)
+    return JobDelta(old_sheet, new_sheet, old_srpm, new_srpm)
+
+# Only run tests when this file is run directly
+if __name__ == "__main__":
+    # Usage: delta.py <new files...> [--previous <previous files...>]
+    # Without --previous, compares the builds for different architectures within the given files
+    if "--previous" not in sys.argv:
+        rpm_files, spec_file, srpm_file = split_files(sys.argv[1:])
+        arch_groups = ArchGroups(facts.FactSheet(rpm_files, spec_file))
+        print(arch_groups.summary())
+        for f in sorted(arch_groups.packages):
+            print(arch_groups.describe(f))
+        exit(0)
+    split = sys.argv.index("--previous")
+    job_delta = compare(sys.argv[split + 1:], sys.argv[1:split])
+    print(job_delta.summary())
+    for f in sorted(job_delta.packages):
+        print(job_delta.describe(f))
@@ -0,0 +1,72 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# A compact, shared summary of a review in progress.
+# Rather than pushing every package through one ever growing conversation, each package is reviewed on a short lived
+# thread that is seeded with this digest: the facts about the build, plus a condensed form of the verdicts reached so
+# far. The digest has a fixed budget, so the cost of seeding a thread stays flat no matter how many packages came
+# before it.
+
+import re
+
+class ContextDigest:
+    # Longest a single verdict may be once condensed
+    max_verdict_chars = 1200
+    # Budget for all prior verdicts when seeding a package thread. Older verdicts are cut down to their first line
+    # once the budget is exceeded.
+    max_verdicts_chars = 8000
+
+    def __init__(self, header:str) -> None:
+        self.header = header
+        # Package -> condensed verdict, in the order they were reviewed
+        self.verdicts = {}
+
+    def condense(text:str) -> str:
+        """Strips blank lines and markdown noise from a verdict and truncates it.
+        :rtype: str
+        """
+        lines = [re.sub(r"[*#`]+", "", line).rstrip() for line in text.split("\n")]
+        lines = [line for line in lines if line.strip()]
+        condensed = "\n".join(lines)
+        if len(condensed) > ContextDigest.max_verdict_chars:
+            condensed = condensed[:ContextDigest.max_verdict_chars].rsplit(" ", 1)[0] + " ..."
+        return condensed
+
+    def headline(text:str) -> str:
+        """Returns the first line of a condensed verdict.
+        :rtype: str
+        """
+        return text.split("\n", 1)[0][:200]
+
+    def add_verdict(self, package:str, text:str) -> None:
+        self.verdicts[package] = ContextDigest.condense(text)
+
+    def text(self, budget:int=None) -> str:
+        """Renders the digest for seeding a new thread.
+        :param budget: Maximum number of characters for the prior verdicts, or None for no limit.
+        :rtype: str
+        """
+        if budget is None:
+            budget = float("inf")
+        # Keep the most recent verdicts in full, older ones shrink to a headline once we run out of budget, and are
+        # dropped altogether past twice the budget.
+        rendered = []
+        used = 0
+        omitted = 0
+        for package, verdict in reversed(list(self.verdicts.items())):
+            entry = f"- '{package}':\n{verdict}"
+            if used + len(entry) > budget:
+                entry = f"- '{package}': {ContextDigest.headline(verdict)}"
+            if used + len(entry) > 2 * budget:
+                omitted += 1
+                continue
+            used += len(entry)
+            rendered.append(entry)
+        if omitted:
+            rendered.append(f"- ({omitted} earlier packages omitted)")
+        rendered.reverse()
+
+        text = self.header
+        if rendered:
+            text += "\n\nVerdicts already reached for other packages in this build (condensed):\n" + "\n".join(rendered)
+        return text
@@ -0,0 +1,233 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Deterministic fact sheets for a set of .rpm files.
+# Most of the per-package checklist can be answered without the model: which license files a package ships and
+# what they contain, which sibling packages it hard-requires, and whether it ships executables or libraries.
+# These facts are computed up front, in parallel, and handed to the model as part of each package prompt so it can
+# spend its tool calls on judgment rather than on rediscovering them.
+
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from rpm import rpm
+from spec import spec
+from srpm import srpm
+from licenses import licenses
+from deepscan import deepscan
+from headers import headers
+
+executable_dirs = ("/usr/bin/", "/bin/", "/usr/sbin/", "/sbin/", "/usr/libexec/")
+library_dirs = ("/usr/lib/", "/usr/lib64/", "/lib/", "/lib64/")
+shared_library_re = re.compile(r"\.so(\.\d+)*$")
+module_extensions = (".pm", ".py", ".pl", ".rb", ".pc")
+
+# License files larger than this are still identified, but only from their first lines.
+license_read_lines = 400
+# Largest source header clusters listed in the job facts
+header_clusters_shown = 8
+
+def capability_name(dependency:str) -> str:
+    """Strips the version constraint from a provides/requires entry, ie 'nano-libs = 6.0-2' -> 'nano-libs'.
+    :rtype: str
+    """
+    return dependency.split(" ", 1)[0]
+
+class PackageFacts:
+    def __init__(self, rpm_file:str) -> None:
+        self.rpm_file = rpm_file
+        self.name = None
+        self.file_count = 0
+        # Every shipped path that isn't a directory
+        self.files = []
+        self.executables = []
+        self.shared_libraries = []
+        self.static_libraries = []
+        self.headers = []
+        self.modules = []
+        self.docs = []
+        # License file path -> set of SPDX ids detected in it
+        self.license_files = {}
+        self.provides = []
+        self.requires = []
+        self.spec_license = None
+        # Filled in once every package is known
+        self.sibling_files = set()
+        self.required_siblings = []
+        self.reachable_licenses = {}
+
+    def needs_license(self) -> bool:
+        return bool(self.executables or self.shared_libraries or self.static_libraries or self.modules)
+
+    def summary(self) -> str:
+        """Returns a compact, prompt friendly summary of the facts.
+        :rtype: str
+        """
+        lines = [f"Local facts for '{os.path.basename(self.rpm_file)}' (package name '{self.name}'):"]
+        lines.append(f"- spec License tag: {self.spec_license if self.spec_license else 'not found'}")
+        lines.append(f"- {self.file_count} files: {len(self.executables)} executables, {len(self.shared_libraries)} shared libraries, "
+                     f"{len(self.static_libraries)} static libraries, {len(self.headers)} headers, {len(self.modules)} modules, {len(self.docs)} docs")
+        for kind, paths in [("executables", self.executables), ("shared libraries", self.shared_libraries), ("modules", self.modules)]:
+            if paths:
+                shown = ", ".join(paths[:5]) + (f", ... ({len(paths) - 5} more)" if len(paths) > 5 else "")
+                lines.append(f"  {kind}: {shown}")
+        if self.license_files:
+            for path, ids in sorted(self.license_files.items()):
+                lines.append(f"- license file {path}: {', '.join(sorted(ids)) if ids else 'unrecognized text'}")
+        else:
+            lines.append("- no license files")
+        if self.required_siblings:
+            lines.append(f"- hard requires sibling packages: {', '.join(self.required_siblings)}")
+        else:
+            lines.append("- does not require any sibling package")
+        for sibling, sibling_licenses in sorted(self.reachable_licenses.items()):
+            lines.append(f"  license files pulled in via {sibling}: {', '.join(sibling_licenses) if sibling_licenses else 'none'}")
+        lines.append(f"- contents suggest a license file is {'needed' if self.needs_license() else 'probably not needed'}")
+        return "\n".join(lines)
+
+def gather_package_facts(rpm_file:str) -> PackageFacts:
+    facts = PackageFacts(rpm_file)
+    facts.name = rpm.RpmName().rpm_get_name(rpm_file)
+
+    entry = rpm.RpmFileList().get_cache_entry(rpm_file)
+    for path, flags in entry.items():
+        if flags & rpm.flag_dir:
+            continue
+        facts.file_count += 1
+        facts.files.append(path)
+        if flags & rpm.flag_doc:
+            facts.docs.append(path)
+        elif path.startswith(executable_dirs):
+            facts.executables.append(path)
+        elif path.startswith(library_dirs) and shared_library_re.search(path):
+            facts.shared_libraries.append(path)
+        elif path.startswith(library_dirs) and path.endswith(".a"):
+            facts.static_libraries.append(path)
+        elif path.startswith("/usr/include/"):
+            facts.headers.append(path)
+        elif path.endswith(module_extensions):
+            facts.modules.append(path)
+
+    reader = rpm.RpmReadFile()
+    for path in sorted(p for p, flags in entry.items() if flags & rpm.flag_license and not flags & rpm.flag_dir):
+        text = reader.rpm_read_file(rpm_file, path, license_read_lines)
+        facts.license_files[path] = licenses.detect_licenses(text)
+
+    for dependency in rpm.RpmDependencyInfo().rpm_get_dep_info(rpm_file):
+        kind, value = dependency.split(":", 1)
+        if kind == "provides":
+            facts.provides.append(value)
+        else:
+            facts.requires.append(value)
+    return facts
+
+class FactSheet:
+    def __init__(self, rpm_files:list[str], spec_file:str=None, srpm_file:str=None, workers:int=8) -> None:
+        self.packages = {}
+        self.spec_licenses = {}
+        self.source_license_files = {}
+        self.header_clusters = []
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for facts in executor.map(gather_package_facts, rpm_files):
+                self.packages[facts.rpm_file] = facts
+
+        if spec_file:
+            self.spec_licenses = spec.spec_license_tags(spec_file)
+            for facts in self.packages.values():
+                facts.spec_license = self.spec_licenses.get(facts.name)
+        if srpm_file:
+            self.source_license_files = self.__gather_source_licenses(srpm_file)
+            self.header_clusters = self.__gather_header_clusters(srpm_file)
+        self.__link_siblings()
+
+    def __gather_source_licenses(self, srpm_file:str) -> dict:
+        try:
+            top_dir = srpm.srpm_cache.get_from_cache(srpm_file)
+        except ValueError:
+            return {}
+        listing = srpm.SrpmExploreFiles().srpm_explore_contents(srpm_file, ".", 2)
+        found = {}
+        for item in listing:
+            if not item.startswith(srpm.SrpmExploreFiles.file_prefix):
+                continue
+            path = item.removeprefix(srpm.SrpmExploreFiles.file_prefix)
+            if deepscan.file_kind(path) != "license":
+                continue
+            text = deepscan.read_header(os.path.join(top_dir, path))
+            found[path] = licenses.detect_licenses(text) if text else set()
+        return found
+
+    def __gather_header_clusters(self, srpm_file:str) -> list:
+        try:
+            top_dir = srpm.srpm_cache.get_from_cache(srpm_file)
+        except ValueError:
+            return []
+        return headers.cluster_tree(top_dir)
+
+    def __link_siblings(self) -> None:
+        # Work out which sibling satisfies each requirement
+        providers = {}
+        for facts in self.packages.values():
+            for provide in facts.provides:
+                providers.setdefault(capability_name(provide), set()).add(facts.rpm_file)
+        for facts in self.packages.values():
+            siblings = set()
+            for require in facts.requires:
+                for provider in providers.get(capability_name(require), set()):
+                    if provider != facts.rpm_file:
+                        siblings.add(provider)
+            facts.required_siblings = sorted(self.packages[s].name for s in siblings)
+            facts.sibling_files = siblings
+
+        # Follow the requirements transitively to see which license files end up installed alongside each package
+        for facts in self.packages.values():
+            seen = set()
+            todo = list(facts.sibling_files)
+            while todo:
+                sibling = todo.pop()
+                if sibling in seen or sibling == facts.rpm_file:
+                    continue
+                seen.add(sibling)
+                todo.extend(self.packages[sibling].sibling_files)
+            for sibling in sorted(seen):
+                sibling_facts = self.packages[sibling]
+                facts.reachable_licenses[sibling_facts.name] = sorted(sibling_facts.license_files)
+
+    def job_summary(self) -> str:
+        """Returns the facts that apply to every package in the set.
+        :rtype: str
+        """
+        lines = ["Local facts for the whole build:"]
+        if self.spec_licenses:
+            lines.append("- spec License tags: " + "; ".join(f"{name}: {tag}" for name, tag in sorted(self.spec_licenses.items())))
+        if self.source_license_files:
+            for path, ids in sorted(self.source_license_files.items()):
+                lines.append(f"- source tree license file {path}: {', '.join(sorted(ids)) if ids else 'unrecognized text'}")
+        if self.header_clusters:
+            lines.append(f"- source file headers fall into {len(self.header_clusters)} groups of near-identical headers "
+                         f"({headers.SrpmHeaderClusters().name()} lists them all), the largest:")
+            for cluster in self.header_clusters[:header_clusters_shown]:
+                detected = ", ".join(sorted(cluster.licenses)) if cluster.licenses else "no license detected"
+                lines.append(f"  {cluster.size} files like {cluster.representative}: {detected}")
+        lines.append(f"- {len(self.packages)} binary packages: " + ", ".join(sorted(f.name for f in self.packages.values())))
+        return "\n".join(lines)
+
+    def summary(self, rpm_file:str) -> str:
+        return self.packages[rpm_file].summary()
+
+# Only run tests when this file is run directly
+if __name__ == "__main__":
+    files = sys.argv[1:]
+    rpm_files = [f for f in files if f.endswith(".rpm") and not f.endswith(".src.rpm")]
+    spec_files = [f for f in files if f.endswith(".spec")]
+    srpm_files = [f for f in files if f.endswith(".src.rpm")]
+    sheet = FactSheet(rpm_files, spec_files[0] if spec_files else None, srpm_files[0] if srpm_files else None)
+    print(sheet.job_summary())
+    for f in rpm_files:
+        print(sheet.summary(f))
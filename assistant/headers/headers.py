@@ -0,0 +1,290 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Clusters the source files in a build tree by the comment block at the top of each file.
+# Most files in a project carry one of a handful of license headers, differing only in years, authors or whitespace.
+# Each leading comment is normalized, cut into word shingles and reduced to a MinHash signature; locality sensitive
+# hashing over bands of the signature finds headers that are near-identical, and those are merged into one cluster.
+# A cluster is then represented by a single file, so the model can inspect a few dozen representatives instead of
+# thousands of files.
+#
+# Identical headers (the common case) are only signed once, and clusterings are cached per build tree. Shingles are
+# hashed with blake2b rather than hash(), so clusterings (and the prompts built from them) are the same from run to run.
+
+import hashlib
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from assistant_funcs import assistant_funcs
+from cache import cache
+from srpm import srpm
+from licenses import licenses
+from deepscan import deepscan
+from manifest import manifest
+
+# Only this much of the top of a file is considered
+max_comment_lines = 80
+max_comment_words = 400
+shingle_words = 3
+
+# Signatures are num_bands * band_rows values. With 16 bands of 4 rows, headers sharing about half their shingles are
+# likely to be compared, and only those estimated to share at least similarity_threshold are merged.
+num_bands = 16
+band_rows = 4
+similarity_threshold = 0.8
+
+signature_size = num_bands * band_rows
+
+block_comments = {"/*": "*/", "<!--": "-->", "(*": "*)", '"""': '"""', "'''": "'''"}
+line_comment_re = re.compile(r"^(#|//|--|;|%|dnl\b|@c\b|\.\\\"|rem\b)", re.IGNORECASE)
+comment_marker_re = re.compile(r"^(/\*+|\*+/?|<!--|-->|\(\*|\*\)|\"\"\"|'''|#+|//+|--|;+|%+|dnl\b|@c\b|\.\\\"|rem\b)\s*", re.IGNORECASE)
+year_re = re.compile(r"\b(19|20)\d\d\b")
+# Editor settings, ie '-*- coding: utf-8 -*-' or 'vim: set ts=4:', say nothing about the file
+modeline_re = re.compile(r"-\*-.*-\*-|\b(vim?|ex):\s")
+
+def leading_comment(text:str) -> str:
+    """Returns the comment block a file starts with, after any shebang and blank lines, or '' if it doesn't start with one.
+    :rtype: str
+    """
+    lines = []
+    block_end = None
+    for line in text.split("\n")[:max_comment_lines]:
+        stripped = line.strip()
+        if block_end:
+            lines.append(stripped)
+            if block_end in stripped:
+                block_end = None
+            continue
+        if not stripped or (not lines and stripped.startswith("#!")):
+            continue
+        opener = next((o for o in block_comments if stripped.startswith(o)), None)
+        if opener:
+            lines.append(stripped)
+            if block_comments[opener] not in stripped[len(opener):]:
+                block_end = block_comments[opener]
+            continue
+        if line_comment_re.match(stripped):
+            lines.append(stripped)
+            continue
+        break
+    return "\n".join(lines)
+
+def headline(comment:str) -> str:
+    """Returns the first line of a comment with any text on it, without the comment markers and skipping editor settings.
+    :rtype: str
+    """
+    for line in comment.split("\n"):
+        text = comment_marker_re.sub("", line).strip()
+        if len(text) > 3 and not modeline_re.search(text):
+            return text[:100]
+    return ""
+
+def shingle_hashes(comment:str) -> set[int]:
+    """Cuts a normalized comment into overlapping runs of words, each hashed to 64 bits. Years are dropped, so
+    otherwise identical headers from different years are identical here too.
+    :rtype: set[int]
+    """
+    words = year_re.sub("", licenses.normalize(comment)).split()[:max_comment_words]
+    runs = [" ".join(words[i:i + shingle_words]) for i in range(max(1, len(words) - shingle_words + 1))]
+    return {int.from_bytes(hashlib.blake2b(run.encode('utf-8'), digest_size=8).digest(), "little") for run in runs}
+
+def minhash(hashes:set[int]) -> tuple:
+    """Returns the MinHash signature of a set of shingle hashes. One permutation hashing is used: the low bits of each
+    hash pick a slot and the rest compete for the minimum in it, so a signature costs one pass over the shingles rather
+    than one pass per slot. Empty slots borrow from the next filled slot, offset by how far they had to look, which keeps
+    short headers comparable.
+    :rtype: tuple
+    """
+    slots = [None] * signature_size
+    for h in hashes:
+        slot, value = h % signature_size, h // signature_size
+        if slots[slot] is None or value < slots[slot]:
+            slots[slot] = value
+    signature = list(slots)
+    for slot in range(signature_size):
+        distance = 1
+        while signature[slot] is None:
+            borrowed = slots[(slot + distance) % signature_size]
+            if borrowed is not None:
+                signature[slot] = borrowed + (distance << 64)
+            distance += 1
+    return tuple(signature)
+
+def similarity(signature_a:tuple, signature_b:tuple) -> float:
+    """Estimates the Jaccard similarity of the shingles behind two signatures.
+    :rtype: float
+    """
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+class HeaderCluster:
+    def __init__(self, key:str, representative:str, paths:list[str], comment:str) -> None:
+        self.key = key
+        self.representative = representative
+        self.paths = paths
+        self.licenses = licenses.detect_licenses(comment)
+        self.headline = headline(comment)
+
+    @property
+    def size(self) -> int:
+        return len(self.paths)
+
+    def __repr__(self) -> str:
+        return f"{self.size} files, e.g. {self.representative}: {sorted(self.licenses)} '{self.headline}'"
+
+def cluster_headers(top_dir:str, paths:list[str], threshold:float=similarity_threshold, workers:int=8) -> list[HeaderCluster]:
+    """Clusters files by their leading comment. Binary files and files that don't start with a comment are left out.
+    :param top_dir: The directory the paths are relative to.
+    :param threshold: The estimated similarity at which two headers are considered the same.
+    :rtype: list[HeaderCluster]
+    :return: The clusters, largest first.
+    """
+    def read_comment(path):
+        if deepscan.file_kind(path) == "binary":
+            return None
+        header = deepscan.read_header(os.path.join(top_dir, path))
+        return leading_comment(header) if header else None
+
+    # Exact duplicates first, signatures are only computed once per distinct header
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        comments = list(executor.map(read_comment, paths))
+    variants = {}
+    for path, comment in zip(paths, comments):
+        if comment:
+            key = deepscan.header_key(comment)
+            variants.setdefault(key, (comment, []))[1].append(path)
+    keys = sorted(variants)
+    signatures = {key: minhash(shingle_hashes(variants[key][0])) for key in keys}
+
+    # Union variants that land in the same bucket of any band and really are similar
+    parent = {key: key for key in keys}
+    def root(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+    for band in range(num_bands):
+        buckets = {}
+        for key in keys:
+            buckets.setdefault(signatures[key][band * band_rows:(band + 1) * band_rows], []).append(key)
+        for bucket in buckets.values():
+            for i in range(1, len(bucket)):
+                for earlier in bucket[:i]:
+                    a, b = root(earlier), root(bucket[i])
+                    if a != b and similarity(signatures[earlier], signatures[bucket[i]]) >= threshold:
+                        parent[max(a, b)] = min(a, b)
+                        break
+
+    members = {}
+    for key in keys:
+        members.setdefault(root(key), []).append(key)
+    clusters = []
+    for group in members.values():
+        # The most common variant in the cluster stands for it
+        common = max(group, key=lambda key: (len(variants[key][1]), key))
+        comment, common_paths = variants[common]
+        cluster_paths = sorted(path for key in group for path in variants[key][1])
+        # The shallowest copy is usually the original
+        representative = min(common_paths, key=lambda p: (p.count(os.path.sep), p))
+        clusters.append(HeaderCluster(common, representative, cluster_paths, comment))
+    clusters.sort(key=lambda c: (-c.size, c.representative))
+    return clusters
+
+def assign_clusters(scores:list[deepscan.FileScore], clusters:list[HeaderCluster]) -> None:
+    """Gives scored files the header key of their cluster, so select_candidates() treats near-identical headers as
+    duplicates, and records how many files share each header."""
+    by_path = {path: cluster for cluster in clusters for path in cluster.paths}
+    for entry in scores:
+        cluster = by_path.get(entry.path)
+        if cluster:
+            entry.header_key = cluster.key
+            entry.cluster_size = cluster.size
+
+clusterings = cache.registry.create("header_clusters", max_entries=16, ttl=600,
+                                    sizeof=lambda clusters: 200 * sum(c.size for c in clusters))
+
+def cluster_tree(build_dir:str, search_dir:str=".") -> list[HeaderCluster]:
+    """Clusters every file below a directory of a build tree, with paths relative to the build tree.
+    :rtype: list[HeaderCluster]
+    """
+    build_dir = os.path.abspath(build_dir)
+    search_dir = os.path.relpath(srpm.sanitize_path(build_dir, search_dir), build_dir)
+    key = (build_dir, search_dir)
+    clusters = clusterings.get(key)
+    if clusters is None:
+        tree = manifest.get_manifest(build_dir)
+        relative = "" if search_dir == "." else search_dir
+        if tree.is_dir(relative):
+            paths = tree.walk(relative)[0]
+        else:
+            files, _ = srpm.walk_listing(os.path.join(build_dir, relative), 0)
+            paths = [os.path.normpath(os.path.join(search_dir, f)) for f in files]
+        clusters = cluster_headers(build_dir, paths)
+        clusterings[key] = clusters
+    return clusters
+
+class SrpmHeaderClusters(assistant_funcs.OpenAIAssistantFunc):
+    __srpmHeaderClustersName = "srpm_header_clusters"
+    __srpmHeaderClustersDescription = ("Groups the files created by running `rpmbuild -bp` on an SRPM by the comment block at the top of each file, "
+                                       "treating headers that differ only in years, authors or whitespace as the same. Returns one representative "
+                                       "file per group, largest groups first, with the number of files in the group and the licenses detected in "
+                                       "its header. Files in the same group almost certainly carry the same license, so inspect representatives "
+                                       "rather than every file.")
+    __srpmHeaderClustersParameters = {
+        "srpm_file": {
+            "type": "string",
+            "description": "REQUIRED: The path to the SRPM file to cluster the sources of."
+        },
+        "search_dir": {
+            "type": "string",
+            "description": "OPTIONAL (default '.'): Only cluster files below this directory, relative to the BUILD directory."
+        },
+        "limit": {
+            "type": "integer",
+            "description": "OPTIONAL (default '40'): The maximum number of groups to list."
+        }
+    }
+
+    remote_path_args = ["srpm_file"]
+
+    def __init__(self) -> None:
+        super().__init__(self.__srpmHeaderClustersName, self.__srpmHeaderClustersDescription, self.__srpmHeaderClustersParameters)
+
+    def call(self, srpm_file:str, search_dir:str=".", limit:int=40) -> str:
+        abs_path = os.path.abspath(srpm_file)
+        if not os.path.exists(abs_path):
+            err = ValueError(f"File not found: {abs_path}")
+            return f"{err}"
+        if limit <= 0:
+            err = ValueError(f"limit must be greater than 0")
+            return f"{err}"
+        try:
+            return self.describe(srpm_file, search_dir, limit)
+        except ValueError as e:
+            return f"{e}"
+
+    def remote_request(self, args:dict) -> dict:
+        return srpm.remote_srpm_request(super().remote_request(args), args["srpm_file"])
+
+    def describe(self, srpm_file:str, search_dir:str=".", limit:int=40) -> str:
+        clusters = cluster_tree(srpm.srpm_cache.get_from_cache(srpm_file), search_dir)
+        if not clusters:
+            return f"No files below '{search_dir}' start with a comment."
+        lines = [f"{sum(c.size for c in clusters)} files below '{search_dir}' start with a comment, in {len(clusters)} groups:"]
+        for cluster in clusters[:limit]:
+            detected = ", ".join(sorted(cluster.licenses)) if cluster.licenses else "no license detected"
+            lines.append(f"- {cluster.size} files, e.g. {cluster.representative}: {detected} ('{cluster.headline}')")
+        if len(clusters) > limit:
+            rest = clusters[limit:]
+            lines.append(f"... ({len(rest)} more groups covering {sum(c.size for c in rest)} files, raise limit or narrow search_dir)")
+        return "\n".join(lines)
+
+# Only run tests when this file is run directly
+if __name__ == "__main__":
+    top_dir = sys.argv[1] if len(sys.argv) > 1 else "./nano-testing/build/BUILD"
+    for cluster in cluster_tree(top_dir):
+        print(cluster)
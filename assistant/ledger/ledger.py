@@ -0,0 +1,114 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Accounting for every model run in a job.
+# Each run records its stage (package, summary, suggestions, issues, or one of the deep scan stages), the package it
+# was for, prompt and completion tokens, wall time, tool rounds and how long it was held back by the rate limiter.
+#
+# The ledger also enforces budgets. A package that goes over its budget mid-run is told to conclude with what it has
+# found so far, and once a job is over its budget no further packages are started. Budgets are read from the
+# environment, 0 (the default) means no limit:
+#   LICENSE_ASSISTANT_BUDGET_PACKAGE_TOKENS, LICENSE_ASSISTANT_BUDGET_PACKAGE_SECONDS
+#   LICENSE_ASSISTANT_BUDGET_JOB_TOKENS, LICENSE_ASSISTANT_BUDGET_JOB_SECONDS
+
+import os
+import threading
+import time
+
+counters = ["runs", "prompt_tokens", "completion_tokens", "total_tokens", "wall_seconds", "tool_rounds", "queue_seconds"]
+
+def add_run(totals:dict, run:dict) -> None:
+    for counter in counters[1:]:
+        totals[counter] = totals.get(counter, 0) + run[counter]
+    totals["runs"] = totals.get("runs", 0) + 1
+
+class Ledger:
+    def __init__(self, package_tokens:int=0, package_seconds:float=0, job_tokens:int=0, job_seconds:float=0) -> None:
+        self.budgets = {
+            "package_tokens": package_tokens,
+            "package_seconds": package_seconds,
+            "job_tokens": job_tokens,
+            "job_seconds": job_seconds,
+        }
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.runs = []
+        self.totals = {}
+        self.stages = {}
+        self.packages = {}
+
+    def from_env() -> "Ledger":
+        return Ledger(
+            int(os.environ.get("LICENSE_ASSISTANT_BUDGET_PACKAGE_TOKENS", 0)),
+            float(os.environ.get("LICENSE_ASSISTANT_BUDGET_PACKAGE_SECONDS", 0)),
+            int(os.environ.get("LICENSE_ASSISTANT_BUDGET_JOB_TOKENS", 0)),
+            float(os.environ.get("LICENSE_ASSISTANT_BUDGET_JOB_SECONDS", 0)),
+        )
+
+    def record(self, stage:str, package:str, usage, wall_seconds:float, tool_rounds:int, queue_seconds:float, status:str) -> None:
+        """Records a finished run. usage may be None for runs that never completed."""
+        run = {
+            "stage": stage,
+            "package": package,
+            "status": status,
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "completion_tokens": usage.completion_tokens if usage else 0,
+            "total_tokens": usage.total_tokens if usage else 0,
+            "wall_seconds": round(wall_seconds, 3),
+            "tool_rounds": tool_rounds,
+            "queue_seconds": round(queue_seconds, 3),
+        }
+        with self.lock:
+            self.runs.append(run)
+            add_run(self.totals, run)
+            add_run(self.stages.setdefault(stage, {}), run)
+            if package:
+                add_run(self.packages.setdefault(package, {}), run)
+
+    def exhausted(self, package:str=None, pending_tokens:int=0, pending_seconds:float=0) -> str:
+        """Checks the budgets, counting a run in progress that has used an estimated pending_tokens and pending_seconds.
+        :rtype: str
+        :return: Why the budget is exhausted, or None if there is budget left.
+        """
+        with self.lock:
+            job_seconds = time.monotonic() - self.started
+            if self.budgets["job_seconds"] and job_seconds > self.budgets["job_seconds"]:
+                return f"the job time budget of {self.budgets['job_seconds']} seconds is used up"
+            if self.budgets["job_tokens"] and self.totals.get("total_tokens", 0) + pending_tokens > self.budgets["job_tokens"]:
+                return f"the job token budget of {self.budgets['job_tokens']} tokens is used up"
+            if package is None:
+                return None
+            used = self.packages.get(package, {})
+            if self.budgets["package_seconds"] and used.get("wall_seconds", 0) + pending_seconds > self.budgets["package_seconds"]:
+                return f"the package time budget of {self.budgets['package_seconds']} seconds is used up"
+            if self.budgets["package_tokens"] and used.get("total_tokens", 0) + pending_tokens > self.budgets["package_tokens"]:
+                return f"the package token budget of {self.budgets['package_tokens']} tokens is used up"
+            return None
+
+    def usage(self) -> dict:
+        with self.lock:
+            return {key: self.totals.get(key, 0) for key in ["prompt_tokens", "completion_tokens", "total_tokens"]}
+
+    def export(self) -> dict:
+        """Returns everything recorded, suitable for JSON.
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                "budgets": dict(self.budgets),
+                "totals": dict(self.totals),
+                "stages": {stage: dict(totals) for stage, totals in self.stages.items()},
+                "packages": {package: dict(totals) for package, totals in self.packages.items()},
+                "runs": list(self.runs),
+            }
+
+    def summary(self) -> str:
+        """Returns a per stage table of the runs.
+        :rtype: str
+        """
+        exported = self.export()
+        lines = [f"{'stage':<20} {'runs':>5} {'prompt':>9} {'completion':>10} {'seconds':>9} {'tool rounds':>11} {'queued':>8}"]
+        for stage, totals in list(exported["stages"].items()) + [("total", exported["totals"])]:
+            lines.append(f"{stage:<20} {totals.get('runs', 0):>5} {totals.get('prompt_tokens', 0):>9} {totals.get('completion_tokens', 0):>10} "
+                         f"{totals.get('wall_seconds', 0):>9.1f} {totals.get('tool_rounds', 0):>11} {totals.get('queue_seconds', 0):>8.1f}")
+        return "\n".join(lines)
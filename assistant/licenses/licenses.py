@@ -0,0 +1,102 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Local, deterministic license detection.
+# This does not try to replace a careful reading of a license, it only spots the well known markers (SPDX tags, the
+# opening lines of the common license texts, and the common "this file is licensed under..." boilerplate) so that
+# files can be ranked and grouped before the model is asked to look at them.
+
+import re
+
+# Each entry is (SPDX id, license family, pattern). Patterns run against normalized text (see normalize()), so they
+# are lower case and only contain single spaces between words. More specific entries come first within a family.
+license_signatures = [
+    ("AGPL-3.0", "AGPL", r"gnu affero general public license"),
+    ("LGPL-3.0", "LGPL", r"gnu lesser general public license (?:\S+ ){0,12}?version 3"),
+    ("LGPL-2.1", "LGPL", r"gnu lesser general public license (?:\S+ ){0,12}?version 2 1"),
+    ("LGPL-2.0", "LGPL", r"gnu library general public license"),
+    ("LGPL", "LGPL", r"gnu lesser general public license"),
+    ("GPL-3.0", "GPL", r"gnu general public license (?:\S+ ){0,12}?version 3"),
+    ("GPL-2.0", "GPL", r"gnu general public license (?:\S+ ){0,12}?version 2"),
+    ("GPL-1.0", "GPL", r"gnu general public license (?:\S+ ){0,12}?version 1"),
+    ("GPL", "GPL", r"gnu general public license"),
+    ("GFDL", "GFDL", r"gnu free documentation license"),
+    ("Artistic-1.0-Perl OR GPL-1.0-or-later", "Perl", r"same terms as perl itself"),
+    ("Artistic-2.0", "Artistic", r"artistic license 2 0"),
+    ("Artistic-1.0", "Artistic", r"the artistic license"),
+    ("Apache-2.0", "Apache", r"apache license (?:\S+ ){0,3}?version 2 0"),
+    ("Apache-1.1", "Apache", r"apache software license (?:\S+ ){0,3}?version 1 1"),
+    ("MPL-2.0", "MPL", r"mozilla public license (?:\S+ ){0,3}?2 0"),
+    ("MPL-1.1", "MPL", r"mozilla public license (?:\S+ ){0,3}?1 1"),
+    ("BSD-4-Clause", "BSD", r"all advertising materials mentioning features or use of this software"),
+    ("BSD-3-Clause", "BSD", r"neither the name of (?:\S+ ){0,12}?nor the names of (?:its|the) contributors may be used"),
+    ("BSD-2-Clause", "BSD", r"redistribution and use in source and binary forms with or without modification are permitted"),
+    ("ISC", "ISC", r"permission to use copy modify and or distribute this software for any purpose with or without fee"),
+    ("MIT", "MIT", r"permission is hereby granted free of charge to any person obtaining a copy"),
+    ("Zlib", "Zlib", r"altered source versions must be plainly marked as such"),
+    ("Unicode-DFS-2016", "Unicode", r"unicode inc license agreement"),
+    ("CC0-1.0", "CC", r"cc0 1 0 universal"),
+    ("CC", "CC", r"creative commons"),
+    ("LicenseRef-Public-Domain", "Public-Domain", r"(?:placed|released|dedicated) (?:\S+ ){0,3}?(?:in|into|to) the public domain"),
+]
+compiled_signatures = [(spdx_id, family, re.compile(pattern)) for spdx_id, family, pattern in license_signatures]
+
+# SPDX ids may appear directly in source files
+spdx_tag_re = re.compile(r"SPDX-License-Identifier:\s*([^\n*]+)")
+spdx_split_re = re.compile(r"\s+(?:AND|OR)\s+|[()]")
+copyright_re = re.compile(r"copyright\s+(?:\(c\)|©|\d{4})", re.IGNORECASE)
+normalize_re = re.compile(r"\W+")
+
+def normalize(text:str) -> str:
+    """Lower cases the text and collapses comment markers, punctuation and whitespace to single spaces.
+    :rtype: str
+    """
+    return normalize_re.sub(" ", text.lower())
+
+def spdx_tags(text:str) -> set[str]:
+    """Returns the SPDX ids named in 'SPDX-License-Identifier:' tags.
+    :rtype: set[str]
+    """
+    ids = set()
+    for expression in spdx_tag_re.findall(text):
+        for spdx_id in spdx_split_re.split(expression):
+            # 'GPL-2.0 WITH Classpath-exception-2.0' is still a GPL-2.0 license
+            spdx_id = spdx_id.split(" WITH ")[0].strip()
+            if spdx_id:
+                ids.add(spdx_id)
+    return ids
+
+def detect_licenses(text:str) -> set[str]:
+    """Returns the SPDX ids of the licenses that text appears to contain or reference.
+    Only the most specific match in each family is returned, ie 'GPL-2.0' rather than 'GPL-2.0' and 'GPL'.
+    :rtype: set[str]
+    """
+    found = spdx_tags(text)
+    normalized = normalize(text)
+    families_found = set()
+    for spdx_id, family, pattern in compiled_signatures:
+        if family in families_found:
+            continue
+        if pattern.search(normalized):
+            found.add(spdx_id)
+            families_found.add(family)
+    return found
+
+def license_family(spdx_id:str) -> str:
+    """Maps an SPDX id to a coarse family, ie 'GPL-2.0-or-later' -> 'GPL'.
+    :rtype: str
+    """
+    for known_id, family, _ in license_signatures:
+        if spdx_id == known_id:
+            return family
+    # Strip any version and modifiers: 'LGPL-2.1-or-later' -> 'LGPL', 'BSD-3-Clause' -> 'BSD'
+    return re.split(r"-(?=\d)|-only|-or-later|\+", spdx_id)[0]
+
+def detect_families(text:str) -> set[str]:
+    """Returns the license families that text appears to contain or reference.
+    :rtype: set[str]
+    """
+    return set(license_family(spdx_id) for spdx_id in detect_licenses(text))
+
+def has_copyright(text:str) -> bool:
+    return bool(copyright_re.search(text))
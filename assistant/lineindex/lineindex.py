@@ -0,0 +1,149 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Random access reads of large text files.
+# The first time a file is read, it is mapped and scanned once for line starts. Later reads of any line or byte range
+# only touch that slice of the file, so the model can look at line 4000 of a big source file without every line
+# before it being read and sent. Indexes live in the shared cache registry and are rebuilt if the file changes.
+
+import codecs
+import mmap
+import os
+import re
+import sys
+from array import array
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from cache import cache
+
+newline_re = re.compile(b"\n")
+
+# Tool parameters for reading part of a file, shared by the functions that read files
+range_parameters = {
+    "start_line": {
+        "type": "integer",
+        "description": "OPTIONAL: The first line to read, counting from 1. Reads max_lines lines from here unless end_line is given. "
+                       "Use this to look at a later part of a large file rather than raising max_lines."
+    },
+    "end_line": {
+        "type": "integer",
+        "description": "OPTIONAL: The last line to read, inclusive."
+    },
+    "byte_offset": {
+        "type": "integer",
+        "description": "OPTIONAL: Read from this byte offset instead of by lines."
+    },
+    "byte_count": {
+        "type": "integer",
+        "description": "OPTIONAL: The number of bytes to read from byte_offset."
+    },
+}
+
+class LineIndex:
+    __slots__ = ("path", "size", "mtime_ns", "starts", "is_text")
+
+    def __init__(self, path:str) -> None:
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.starts = array('Q', [0])
+        self.is_text = True
+        if self.size == 0:
+            self.starts = array('Q')
+            return
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            self.starts.extend(m.end() for m in newline_re.finditer(mm))
+            # Only files that decode as UTF-8 throughout are served, same as reading them whole
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            try:
+                for offset in range(0, self.size, 1024 * 1024):
+                    decoder.decode(mm[offset:offset + 1024 * 1024])
+                decoder.decode(b"", final=True)
+            except UnicodeDecodeError:
+                self.is_text = False
+        # A trailing newline doesn't start another line
+        if self.starts[-1] == self.size:
+            self.starts.pop()
+
+    def line_count(self) -> int:
+        return len(self.starts)
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.starts)
+
+    def byte_range(self, start_line:int, end_line:int) -> tuple[int, int]:
+        """Returns the (start, end) byte offsets of lines start_line..end_line, 1-based and inclusive."""
+        start = self.starts[start_line - 1]
+        end = self.starts[end_line] if end_line < len(self.starts) else self.size
+        return start, end
+
+    def read(self, start:int, end:int) -> bytes:
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+indexes = cache.registry.create("line_indexes", max_entries=4096, sizeof=lambda index: index.nbytes())
+
+def get_index(path:str) -> LineIndex:
+    """Returns the line index for a file, building it on first use or if the file changed.
+    :rtype: LineIndex
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    index = indexes.get(path)
+    if index is None or index.size != stat.st_size or index.mtime_ns != stat.st_mtime_ns:
+        index = LineIndex(path)
+        indexes[path] = index
+    return index
+
+def read_slice(path:str, max_lines:int=10, start_line:int=None, end_line:int=None, byte_offset:int=None, byte_count:int=None) -> str:
+    """Reads part of a text file.
+    With no range this is the first max_lines lines, exactly as before ranges were supported. With start_line/end_line
+    (1-based, inclusive) or byte_offset/byte_count, a header line says which part of the file was returned.
+    :rtype: str
+    :raises ValueError: The range is invalid.
+    :raises UnicodeDecodeError: The file is not UTF-8 text.
+    """
+    index = get_index(path)
+    if not index.is_text:
+        raise UnicodeDecodeError('utf-8', b"", 0, 0, "file is not valid UTF-8")
+
+    if byte_offset is not None or byte_count is not None:
+        byte_offset = byte_offset if byte_offset is not None else 0
+        if byte_offset < 0 or byte_offset > index.size:
+            raise ValueError(f"byte_offset must be between 0 and the file size ({index.size})")
+        if byte_count is not None and byte_count <= 0:
+            raise ValueError("byte_count must be greater than 0")
+        end = index.size if byte_count is None else min(index.size, byte_offset + byte_count)
+        # Ranges may split a multi-byte character, drop the partial ones at either end
+        text = index.read(byte_offset, end).decode('utf-8', errors='ignore')
+        return f"[bytes {byte_offset}-{end} of {index.size}]\n{text}"
+
+    if start_line is None and end_line is None:
+        if index.line_count() == 0:
+            return ""
+        start, end = index.byte_range(1, min(max_lines, index.line_count()))
+        return index.read(start, end).decode('utf-8')
+
+    start_line = start_line if start_line is not None else 1
+    if start_line < 1:
+        raise ValueError("start_line must be 1 or greater")
+    if end_line is None:
+        end_line = start_line + max_lines - 1
+    if end_line < start_line:
+        raise ValueError("end_line must not be before start_line")
+    if start_line > index.line_count():
+        return f"[file has {index.line_count()} lines, start_line {start_line} is past the end]"
+    end_line = min(end_line, index.line_count())
+    start, end = index.byte_range(start_line, end_line)
+    return f"[lines {start_line}-{end_line} of {index.line_count()}]\n" + index.read(start, end).decode('utf-8')
+
+# Only run tests when this file is run directly
+if __name__ == "__main__":
+    file_path = sys.argv[1]
+    first = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    last = int(sys.argv[3]) if len(sys.argv) > 3 else first + 9
+    print(read_slice(file_path, start_line=first, end_line=last))
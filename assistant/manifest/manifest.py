@@ -0,0 +1,271 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Persistent manifest of a prepped build tree.
+# Every path in the tree is recorded in a small SQLite database under the cache dir, with its kind, size, mtime and
+# (once something has asked for it) the sha256 of its contents. Opening a manifest loads it into memory, then brings
+# it up to date by stat-ing directories only: a directory whose mtime hasn't changed still has the same entries, so
+# only directories that changed are re-listed. Hashes are checked against the file's current size and mtime before
+# being trusted, so a file edited in place is rehashed rather than reported stale.
+#
+# Listings, the deep scan census and provenance lookups all read from the manifest, so a warm tree opens without
+# walking or hashing it again.
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from assistant_funcs import assistant_funcs
+from cache import cache
+from verdicts import verdicts
+
+# Bump whenever the table layout changes, older databases are dropped and rebuilt
+schema_version = 1
+
+kind_dir = "dir"
+kind_file = "file"
+
+# Indexes into a manifest row
+row_kind = 0
+row_symlink = 1
+row_size = 2
+row_mtime = 3
+row_hash = 4
+
+def join(directory:str, name:str) -> str:
+    # Manifest paths are always relative and '/' separated, so this is safe (and much cheaper than os.path.join)
+    return f"{directory}/{name}" if directory else name
+
+def split(path:str) -> tuple[str, str]:
+    directory, _, name = path.rpartition("/")
+    return directory, name
+
+class Manifest:
+    # Re-check the tree for changes at most this often, in seconds
+    refresh_interval = 10
+
+    def __init__(self, build_dir:str, db_path:str=None) -> None:
+        self.build_dir = os.path.abspath(build_dir)
+        if db_path is None:
+            db_path = os.path.join(assistant_funcs.get_cache_dir("manifest"), verdicts.hash_text(self.build_dir) + ".sqlite")
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        # Relative path -> [kind, symlink, size, mtime_ns, sha256 or None]. The root is ''.
+        self.entries = {}
+        # Relative directory -> names of its entries
+        self.children = {}
+        self.refreshed = 0
+        self.stats = {"dirs_listed": 0, "hashed": 0}
+        self.db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.__open()
+        self.refresh(force=True)
+
+    def __open(self) -> None:
+        self.db.execute("PRAGMA journal_mode=WAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != schema_version:
+            self.db.execute("DROP TABLE IF EXISTS entries")
+            self.db.execute("CREATE TABLE entries (path TEXT PRIMARY KEY, kind TEXT NOT NULL, symlink INTEGER NOT NULL, "
+                            "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT)")
+            self.db.execute(f"PRAGMA user_version={schema_version}")
+            self.db.commit()
+        self.entries = {row[0]: list(row[1:]) for row in self.db.execute("SELECT * FROM entries")}
+        for path in self.entries:
+            if path:
+                directory, name = split(path)
+                self.children.setdefault(directory, set()).add(name)
+
+    def full_path(self, path:str) -> str:
+        return os.path.join(self.build_dir, path) if path else self.build_dir
+
+    def is_dir(self, path:str) -> bool:
+        """True for directories the manifest descends into, ie not symlinks to directories."""
+        row = self.entries.get(path)
+        return row is not None and row[row_kind] == kind_dir and not row[row_symlink]
+
+    def refresh(self, force:bool=False) -> None:
+        """Brings the manifest in line with the tree, re-listing only the directories whose mtime changed."""
+        with self.lock:
+            if not force and time.monotonic() - self.refreshed < self.refresh_interval:
+                return
+            updates = []
+            deletes = []
+            try:
+                root_stat = os.stat(self.build_dir)
+            except OSError:
+                root_stat = None
+            if root_stat is None:
+                self.__forget("", deletes)
+            else:
+                self.entries.setdefault("", [kind_dir, 0, 0, -1, None])
+                self.__refresh_dir("", root_stat.st_mtime_ns, updates, deletes)
+            self.__store(updates, deletes)
+            self.refreshed = time.monotonic()
+
+    def __refresh_dir(self, path:str, mtime_ns:int, updates:list, deletes:list) -> None:
+        todo = [(path, mtime_ns)]
+        while todo:
+            path, mtime_ns = todo.pop()
+            row = self.entries[path]
+            if row[row_mtime] == mtime_ns:
+                # Same entries as last time, but the subdirectories may have changed underneath
+                for name in list(self.children.get(path, ())):
+                    child = join(path, name)
+                    if self.is_dir(child):
+                        try:
+                            todo.append((child, os.stat(self.full_path(child)).st_mtime_ns))
+                        except OSError:
+                            self.__forget(child, deletes)
+                continue
+
+            self.stats["dirs_listed"] += 1
+            row[row_mtime] = mtime_ns
+            updates.append(path)
+            seen = set()
+            try:
+                with os.scandir(self.full_path(path)) as it:
+                    scanned = list(it)
+            except OSError:
+                scanned = []
+            for dir_entry in scanned:
+                child = join(path, dir_entry.name)
+                seen.add(dir_entry.name)
+                try:
+                    # Match os.walk: symlinks to directories are directories, but aren't descended into
+                    kind = kind_dir if dir_entry.is_dir() else kind_file
+                    symlink = int(dir_entry.is_symlink())
+                    stat = dir_entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                old = self.entries.get(child)
+                if old is not None and (old[row_kind], old[row_symlink]) != (kind, symlink):
+                    self.__forget(child, deletes)
+                    old = None
+                if kind == kind_dir and not symlink:
+                    if old is None:
+                        self.entries[child] = [kind, symlink, 0, -1, None]
+                        updates.append(child)
+                    todo.append((child, stat.st_mtime_ns))
+                elif old is None or (old[row_size], old[row_mtime]) != (stat.st_size, stat.st_mtime_ns):
+                    self.entries[child] = [kind, symlink, stat.st_size, stat.st_mtime_ns, None]
+                    updates.append(child)
+            for name in self.children.get(path, set()) - seen:
+                self.__forget(join(path, name), deletes)
+            self.children[path] = seen
+
+    def __forget(self, path:str, deletes:list) -> None:
+        """Drops a path, and everything below it, from memory and queues it for deletion."""
+        if path not in self.entries:
+            return
+        if self.is_dir(path):
+            for name in self.children.pop(path, set()):
+                self.__forget(join(path, name), deletes)
+        del self.entries[path]
+        if path:
+            directory, name = split(path)
+            self.children.get(directory, set()).discard(name)
+        deletes.append(path)
+
+    def __store(self, updates:list, deletes:list) -> None:
+        if not updates and not deletes:
+            return
+        with self.db:
+            self.db.executemany("DELETE FROM entries WHERE path = ?", [(path,) for path in deletes])
+            self.db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                                [(path, *self.entries[path]) for path in dict.fromkeys(updates) if path in self.entries])
+
+    def walk(self, path:str="", max_depth:int=0) -> tuple[list[str], list[str]]:
+        """Lists the files and directories below a directory, the same way os.walk would.
+        :param max_depth: Only list entries at most this many levels down, 0 for no limit.
+        :rtype: tuple[list[str], list[str]]
+        :return: (files, dirs), as paths relative to the build dir.
+        """
+        self.refresh()
+        files = []
+        dirs = []
+        with self.lock:
+            todo = [(path, 0)] if self.is_dir(path) else []
+            while todo:
+                directory, depth = todo.pop()
+                if max_depth > 0 and depth >= max_depth:
+                    continue
+                for name in self.children.get(directory, ()):
+                    child = join(directory, name)
+                    if self.entries[child][row_kind] == kind_dir:
+                        dirs.append(child)
+                        if self.is_dir(child):
+                            todo.append((child, depth + 1))
+                    else:
+                        files.append(child)
+        return files, dirs
+
+    def files(self) -> list[str]:
+        """Returns every file in the tree, symlinks included, relative to the build dir.
+        :rtype: list[str]
+        """
+        return self.walk()[0]
+
+    def hash_files(self, paths:list[str], workers:int=8) -> list[tuple]:
+        """Hashes regular files in parallel, reusing stored hashes for files whose size and mtime haven't changed.
+        :rtype: list[tuple]
+        :return: (path, size, sha256) for each path that is a regular file.
+        """
+        self.refresh()
+        results = []
+        stale = []
+        for path in paths:
+            row = self.entries.get(path)
+            if row is None or row[row_kind] != kind_file or row[row_symlink]:
+                continue
+            try:
+                stat = os.stat(self.full_path(path))
+            except OSError:
+                continue
+            if row[row_hash] and (row[row_size], row[row_mtime]) == (stat.st_size, stat.st_mtime_ns):
+                results.append((path, row[row_size], row[row_hash]))
+            else:
+                stale.append((path, stat.st_size, stat.st_mtime_ns))
+        if not stale:
+            return results
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            digests = list(executor.map(lambda item: verdicts.hash_file(self.full_path(item[0])), stale))
+        with self.lock:
+            for (path, size, mtime_ns), digest in zip(stale, digests):
+                if path in self.entries:
+                    self.entries[path][row_size:] = [size, mtime_ns, digest]
+                results.append((path, size, digest))
+            self.__store([path for path, _, _ in stale], [])
+        self.stats["hashed"] += len(stale)
+        return results
+
+    def nbytes(self) -> int:
+        return 200 * len(self.entries)
+
+manifests = cache.registry.create("manifests", max_entries=16, sizeof=Manifest.nbytes)
+
+def get_manifest(build_dir:str) -> Manifest:
+    """Returns the manifest for a build tree, opening (and refreshing) it on first use.
+    :rtype: Manifest
+    """
+    build_dir = os.path.abspath(build_dir)
+    found = manifests.get(build_dir)
+    if found is None:
+        found = Manifest(build_dir)
+        manifests[build_dir] = found
+    return found
+
+# Only run tests when this file is run directly
+if __name__ == "__main__":
+    start = time.perf_counter()
+    m = Manifest(sys.argv[1])
+    opened = time.perf_counter() - start
+    print(f"{len(m.entries)} entries, opened in {opened * 1000:.1f}ms, {m.stats['dirs_listed']} directories listed")
+    start = time.perf_counter()
+    m.hash_files(m.files())
+    print(f"Hashed {m.stats['hashed']} files in {(time.perf_counter() - start) * 1000:.1f}ms")
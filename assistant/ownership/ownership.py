@@ -0,0 +1,155 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Which package ships which path, across every .rpm in a build.
+# The index is built once per set of .rpm files from the (already cached) rpm file lists, and answers ownership
+# questions - who ships this license file, who owns this directory, which files does more than one package ship - with a
+# single lookup instead of listing each package in turn.
+
+import bisect
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from assistant_funcs import assistant_funcs
+from cache import cache
+from rpm import rpm
+
+class OwnershipIndex:
+    def __init__(self, rpm_files:list[str], workers:int=8) -> None:
+        self.rpm_files = list(rpm_files)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            self.package_names = list(executor.map(rpm.RpmName().rpm_get_name, self.rpm_files))
+            entries = list(executor.map(rpm.RpmFileList().get_cache_entry, self.rpm_files))
+        # path -> [flags, owner ids...], owners are indexes into rpm_files/package_names. Each package name is listed
+        # once, builds of one package for several architectures ship the same paths without conflicting.
+        self.paths = {}
+        for owner, entry in enumerate(entries):
+            name = self.package_names[owner]
+            for path, flags in entry.items():
+                record = self.paths.get(path)
+                if record is None:
+                    self.paths[path] = [flags, owner]
+                else:
+                    record[0] |= flags
+                    if all(self.package_names[other] != name for other in record[1:]):
+                        record.append(owner)
+        self.sorted_paths = sorted(self.paths)
+
+    def owners(self, path:str) -> list[str]:
+        """Returns the names of the packages that ship a path, empty if none do.
+        :rtype: list[str]
+        """
+        record = self.paths.get(os.path.normpath(path))
+        if record is None:
+            return []
+        return [self.package_names[owner] for owner in record[1:]]
+
+    def under(self, prefix:str) -> list[str]:
+        """Returns every indexed path starting with prefix, in sorted order.
+        :rtype: list[str]
+        """
+        start = bisect.bisect_left(self.sorted_paths, prefix)
+        end = bisect.bisect_left(self.sorted_paths, prefix + "\U0010ffff")
+        return self.sorted_paths[start:end]
+
+    def conflicts(self) -> list[str]:
+        """Returns the files (not directories) that more than one package ships. These conflict on install unless the
+        packages are never installed together, or the files are identical (ie multilib).
+        :rtype: list[str]
+        """
+        return [path for path in self.sorted_paths if len(self.paths[path]) > 2 and not self.paths[path][0] & rpm.flag_dir]
+
+    def shared_directories(self) -> list[str]:
+        """Returns the directories owned by more than one package.
+        :rtype: list[str]
+        """
+        return [path for path in self.sorted_paths if len(self.paths[path]) > 2 and self.paths[path][0] & rpm.flag_dir]
+
+    def describe(self, path:str) -> str:
+        record = self.paths[path]
+        flags = record[0]
+        kind = "dir" if flags & rpm.flag_dir else "license" if flags & rpm.flag_license else "doc" if flags & rpm.flag_doc else "file"
+        return f"{kind}:{path} -> {', '.join(self.package_names[owner] for owner in record[1:])}"
+
+indexes = cache.registry.create("ownership_indexes", max_entries=16,
+                                sizeof=lambda index: sys.getsizeof(index.paths) + sys.getsizeof(index.sorted_paths) + 120 * len(index.paths))
+
+def get_index(rpm_files:list[str]) -> OwnershipIndex:
+    key = tuple(sorted(os.path.abspath(f) for f in rpm_files))
+    index = indexes.get(key)
+    if index is None:
+        index = OwnershipIndex(rpm_files)
+        indexes[key] = index
+    return index
+
+class PathOwnership(assistant_funcs.OpenAIAssistantFunc):
+    __pathOwnershipName = "path_ownership"
+    __pathOwnershipDescription = ("Finds which of the .rpm files in this build ship a given path, across every package at once. Use this instead of listing "
+                                  "each .rpm in turn to answer questions like 'which subpackage ships this license file' or 'who owns this directory'. "
+                                  "mode 'exact' looks up one path, 'prefix' lists every path under a prefix with its owners, 'conflicts' lists files shipped "
+                                  "by more than one package, and 'shared_dirs' lists directories owned by more than one package. Each result is prefixed with "
+                                  "'dir:', 'license:', 'doc:' or 'file:'.")
+    __pathOwnershipParameters = {
+        "path": {
+            "type": "string",
+            "description": "REQUIRED for 'exact' and 'prefix': The absolute path (or path prefix) to look up, ie '/usr/share/licenses/nano'."
+        },
+        "mode": {
+            "type": "string",
+            "enum": ["exact", "prefix", "conflicts", "shared_dirs"],
+            "description": "OPTIONAL (default 'exact'): The kind of query."
+        },
+        "limit": {
+            "type": "integer",
+            "description": "OPTIONAL (default '200'): The maximum number of results to return."
+        }
+    }
+
+    def __init__(self) -> None:
+        super().__init__(self.__pathOwnershipName, self.__pathOwnershipDescription, self.__pathOwnershipParameters)
+        self.rpm_files = []
+
+    def set_rpm_files(self, rpm_files:list[str]) -> None:
+        """Sets the packages that make up the build being reviewed."""
+        self.rpm_files = list(rpm_files)
+
+    def call(self, path:str=None, mode:str="exact", limit:int=200) -> str:
+        if not self.rpm_files:
+            return f"{ValueError('No .rpm files have been provided for this build')}"
+        if limit <= 0:
+            return f"{ValueError('limit must be greater than 0')}"
+        index = get_index(self.rpm_files)
+        if mode == "exact":
+            if not path:
+                return f"{ValueError('path is required')}"
+            path = os.path.normpath(path)
+            if path not in index.paths:
+                return f"No package in this build ships '{path}'."
+            return index.describe(path)
+        if mode == "prefix":
+            if not path:
+                return f"{ValueError('path is required')}"
+            paths = index.under(path)
+        elif mode == "conflicts":
+            paths = index.conflicts()
+        elif mode == "shared_dirs":
+            paths = index.shared_directories()
+        else:
+            return f"{ValueError(f'Unknown mode: {mode}')}"
+        if not paths:
+            return "No results."
+        lines = [index.describe(p) for p in paths[:limit]]
+        if len(paths) > limit:
+            lines.append(f"... ({len(paths) - limit} more, narrow the query or raise limit)")
+        return "\n".join(lines)
+
+# Only run tests when this file is run directly
+if __name__ == "__main__":
+    ownership = PathOwnership()
+    ownership.set_rpm_files(sys.argv[2:])
+    print(ownership.call(sys.argv[1], "prefix"))
+    print(ownership.call(mode="conflicts"))
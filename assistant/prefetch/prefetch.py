@@ -0,0 +1,132 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Speculative prefetch of the tool calls the model is likely to make next.
+# The model's access pattern is predictable: after listing an rpm it nearly always asks for the rpm's dependency info
+# and then reads the license files it was just shown, and after reading the .spec it explores the top of the SRPM's
+# build tree. While the model is thinking about one tool round, those calls run on background workers and their
+# results are left in the tool result cache (assistant_funcs.tool_results), so the next round is served without
+# running anything. If the model asks for a call whose prefetch is still running, it waits for it rather than running
+# it twice.
+#
+# Speculative work is capped: at most LICENSE_ASSISTANT_PREFETCH calls per tool manager (default 128, 0 disables
+# prefetching), no more than max_in_flight of them at once, and each call is only ever predicted once.
+
+import ast
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from assistant_funcs import assistant_funcs
+from rpm import rpm
+from srpm import srpm
+from tracing import tracing
+
+# Shared by every prefetcher, so package sets reviewed side by side don't multiply the background load
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+# License files read ahead after a listing, per call
+max_license_files = 4
+
+def listed_license_files(results:str) -> list[str]:
+    """Returns the complete license file paths in an rpm_file_list result.
+    :rtype: list[str]
+    """
+    # Results are the printed form of the listing, errors are plain text
+    if not results.startswith("["):
+        return []
+    try:
+        listing = ast.literal_eval(results)
+    except (ValueError, SyntaxError):
+        return []
+    paths = [item.removeprefix(rpm.RpmFileList.license_prefix) for item in listing if item.startswith(rpm.RpmFileList.license_prefix)]
+    # Paths cut short by max_depth end in '...'
+    return [path for path in paths if not path.endswith("...")]
+
+def srpms_for_spec(spec_file:str) -> list[str]:
+    """Returns the registered SRPMs that were built from a .spec, ie nano.spec -> nano-6.0-2.cm2.src.rpm. If nothing
+    matches by name but only one SRPM is registered, that one is assumed.
+    :rtype: list[str]
+    """
+    registered = srpm.srpm_cache.srpm_cache.keys()
+    name = os.path.basename(spec_file).removesuffix(".spec")
+    matches = [s for s in registered if os.path.basename(s).startswith(f"{name}-")]
+    if not matches and len(registered) == 1:
+        return registered
+    return matches
+
+def predict(fn_name:str, args:dict, results:str) -> list[tuple[str, dict]]:
+    """Returns the calls likely to follow a call the model just made, as (function name, arguments).
+    :rtype: list[tuple[str, dict]]
+    """
+    if fn_name == "rpm_file_list" and "rpm_file" in args:
+        rpm_file = args["rpm_file"]
+        predictions = [("rpm_dependency_info", {"rpm_file": rpm_file})]
+        for path in listed_license_files(results)[:max_license_files]:
+            predictions.append(("rpm_read_file", {"rpm_file": rpm_file, "file_path": path}))
+        return predictions
+    if fn_name == "spec_contents" and "spec_file" in args:
+        # The default depth, and the depth the tool description recommends
+        return [("srpm_explore_files", {"srpm_file": srpm_file, "search_dir": ".", "max_depth": max_depth})
+                for srpm_file in srpms_for_spec(args["spec_file"]) for max_depth in [1, 2]]
+    return []
+
+class Prefetcher:
+    max_in_flight = 8
+
+    def __init__(self, tools:assistant_funcs.OpenAiAssistantFuncManager, max_calls:int=128) -> None:
+        self.tools = tools
+        self.remaining = max_calls
+        self.lock = threading.Lock()
+        # Result key -> Future, for prefetches still running
+        self.pending = {}
+        self.predicted = set()
+
+    def from_env(tools:assistant_funcs.OpenAiAssistantFuncManager) -> "Prefetcher":
+        """Returns a prefetcher for a tool manager, or None if LICENSE_ASSISTANT_PREFETCH is 0.
+        :rtype: Prefetcher
+        """
+        max_calls = int(os.environ.get("LICENSE_ASSISTANT_PREFETCH", "128"))
+        return Prefetcher(tools, max_calls) if max_calls > 0 else None
+
+    def observe(self, fn_name:str, args:dict, results:str) -> None:
+        """Queues the calls likely to follow a call the model just made, within the speculative budget."""
+        for name, call_args in predict(fn_name, args, results):
+            try:
+                func = self.tools.getFunction(name)
+            except ValueError:
+                continue
+            key = func.result_key(call_args)
+            if key is None:
+                continue
+            with self.lock:
+                if key in self.predicted or key in assistant_funcs.tool_results:
+                    continue
+                if self.remaining <= 0 or len(self.pending) >= self.max_in_flight:
+                    continue
+                self.predicted.add(key)
+                self.remaining -= 1
+                self.pending[key] = executor.submit(self.__run, key, func, call_args)
+
+    def __run(self, key:str, func:assistant_funcs.OpenAIAssistantFunc, args:dict) -> str:
+        try:
+            with tracing.span(func.name(), "prefetch") as span:
+                return self.tools.execute(func, args, span)
+        except Exception:
+            # A failed guess is harmless, if the model makes the call it runs again and reports the error
+            return None
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def wait(self, key:str) -> str:
+        """Returns the result of a prefetch of this call, waiting for it if it is still running, or None if there is none.
+        :rtype: str
+        """
+        with self.lock:
+            future = self.pending.get(key)
+        return future.result() if future else None
@@ -0,0 +1,210 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Traces files shipped in an .rpm back to the source files in the prepped build tree they came from.
+# Both sides are hashed in parallel and matched through a content hash index. Files that were altered at install time
+# (compressed man pages, substituted paths in scripts, stripped binaries) can't match on content, so they fall back to
+# matching by basename, preferring a source file of the same size.
+#
+# For each match, the licenses detected in the source file's header, and in the nearest license file above it in the
+# source tree, are reported. That is usually what decides whether the shipped file needs a particular license.
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from assistant_funcs import assistant_funcs
+from cache import cache
+from rpm import rpm
+from srpm import srpm
+from verdicts import verdicts
+from licenses import licenses
+from deepscan import deepscan
+from manifest import manifest
+
+# Suffixes that packaging commonly adds to a file on its way into the rpm
+install_suffixes = (".gz", ".xz", ".bz2", ".zst")
+
+def hash_tree(top_dir:str, paths:list[str], workers:int=8) -> list[tuple]:
+    """Hashes files below top_dir in parallel.
+    :rtype: list[tuple]
+    :return: (path, size, sha256) for each path that is a regular file.
+    """
+    def hash_one(path):
+        full_path = os.path.join(top_dir, path.lstrip(os.path.sep))
+        if os.path.islink(full_path) or not os.path.isfile(full_path):
+            return None
+        return path, os.path.getsize(full_path), verdicts.hash_file(full_path)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [record for record in executor.map(hash_one, paths) if record]
+
+def source_records(build_dir:str) -> list[tuple]:
+    """Returns (path relative to build_dir, size, sha256) for every regular file in a build tree.
+    :rtype: list[tuple]
+    """
+    tree = manifest.get_manifest(build_dir)
+    return tree.hash_files(tree.files())
+
+class SourceIndex:
+    def __init__(self, build_dir:str) -> None:
+        self.build_dir = build_dir
+        self.by_hash = {}
+        self.by_name = {}
+        # Directory -> license files directly in it
+        self.license_files = {}
+        for path, size, digest in source_records(build_dir):
+            self.by_hash.setdefault(digest, []).append(path)
+            self.by_name.setdefault(os.path.basename(path), []).append((path, size))
+            if deepscan.file_kind(path) == "license":
+                self.license_files.setdefault(os.path.dirname(path), []).append(path)
+        self.detected = {}
+
+    def match(self, digest:str, name:str, size:int) -> tuple:
+        """Finds the source file a shipped file came from.
+        :rtype: tuple
+        :return: (source path, how it matched), or (None, None).
+        """
+        if digest in self.by_hash:
+            # Identical copies in several places, the shallowest is usually the original
+            return min(self.by_hash[digest], key=lambda p: (p.count(os.path.sep), p)), "identical content"
+        candidates = self.by_name.get(name, [])
+        how = "same name"
+        if not candidates and name.endswith(install_suffixes):
+            candidates = self.by_name.get(os.path.splitext(name)[0], [])
+            how = "same name before compression"
+        if not candidates:
+            return None, None
+        same_size = [c for c in candidates if c[1] == size]
+        if same_size:
+            candidates, how = same_size, how + " and size"
+        elif len(candidates) > 1:
+            how += f", closest in size of {len(candidates)} candidates"
+        return min(candidates, key=lambda c: (abs(c[1] - size), c[0].count(os.path.sep), c[0]))[0], how
+
+    def licenses_in(self, path:str) -> set[str]:
+        if path not in self.detected:
+            header = deepscan.read_header(os.path.join(self.build_dir, path))
+            self.detected[path] = licenses.detect_licenses(header) if header else set()
+        return self.detected[path]
+
+    def nearest_license_files(self, path:str) -> list[str]:
+        """Returns the license files in the closest directory at or above path that has any."""
+        directory = os.path.dirname(path)
+        while True:
+            if directory in self.license_files:
+                return sorted(self.license_files[directory])
+            if not directory:
+                return []
+            directory = os.path.dirname(directory)
+
+sources = cache.registry.create("provenance_sources", max_entries=8,
+                                sizeof=lambda index: 200 * sum(len(v) for v in index.by_name.values()))
+payloads = cache.registry.create("provenance_payloads", max_entries=256, sizeof=lambda hashes: 200 * len(hashes))
+
+def get_source_index(build_dir:str) -> SourceIndex:
+    build_dir = os.path.abspath(build_dir)
+    index = sources.get(build_dir)
+    if index is None:
+        index = SourceIndex(build_dir)
+        sources[build_dir] = index
+    return index
+
+def get_payload_hashes(rpm_file:str) -> dict:
+    """Returns installed path -> (size, sha256) for every regular file shipped in an rpm.
+    :rtype: dict
+    """
+    key = os.path.abspath(rpm_file)
+    hashes = payloads.get(key)
+    if hashes is None:
+        payload_dir = rpm.RpmReadFile().extract_payload(rpm_file)
+        entry = rpm.RpmFileList().get_cache_entry(rpm_file)
+        paths = [path for path, flags in entry.items() if not flags & rpm.flag_dir]
+        hashes = {path: (size, digest) for path, size, digest in hash_tree(payload_dir, paths)}
+        payloads[key] = hashes
+    return hashes
+
+def trace(rpm_file:str, path:str, build_dir:str) -> dict:
+    """Traces one shipped file back to its source.
+    :rtype: dict
+    """
+    path = os.path.normpath(path)
+    hashes = get_payload_hashes(rpm_file)
+    if path not in hashes:
+        raise ValueError(f"'{path}' is not a regular file shipped in {rpm_file}")
+    size, digest = hashes[path]
+    index = get_source_index(build_dir)
+    source, how = index.match(digest, os.path.basename(path), size)
+    result = {"path": path, "source": source, "match": how}
+    if source:
+        result["source_licenses"] = sorted(index.licenses_in(source))
+        result["nearest_license_files"] = {f: sorted(index.licenses_in(f)) for f in index.nearest_license_files(source)}
+    return result
+
+class SourceProvenance(assistant_funcs.OpenAIAssistantFunc):
+    __sourceProvenanceName = "source_provenance"
+    __sourceProvenanceDescription = ("Traces a file shipped in an .rpm back to the source file in the .src.rpm it came from, by content hash, falling back "
+                                     "to matching by name for files altered at install time. Reports how it matched, the licenses detected in the source "
+                                     "file's header, and the nearest license files above it in the source tree. Use this rather than correlating "
+                                     "rpm_file_list and srpm_explore_files output by hand.")
+    __sourceProvenanceParameters = {
+        "rpm_file": {
+            "type": "string",
+            "description": "REQUIRED: The path to the RPM file that ships the file."
+        },
+        "path": {
+            "type": "string",
+            "description": "REQUIRED: The installed path of the file, ie '/usr/bin/nano'. A directory traces every file under it."
+        },
+        "srpm_file": {
+            "type": "string",
+            "description": "REQUIRED: The path to the SRPM file the RPM was built from."
+        },
+        "limit": {
+            "type": "integer",
+            "description": "OPTIONAL (default '50'): The maximum number of files to trace when path is a directory."
+        }
+    }
+
+    remote_path_args = ["rpm_file", "srpm_file"]
+
+    def __init__(self) -> None:
+        super().__init__(self.__sourceProvenanceName, self.__sourceProvenanceDescription, self.__sourceProvenanceParameters)
+
+    def call(self, rpm_file:str, path:str, srpm_file:str, limit:int=50) -> str:
+        for f in [rpm_file, srpm_file]:
+            if not os.path.exists(os.path.abspath(f)):
+                return f"{ValueError(f'File not found: {os.path.abspath(f)}')}"
+        try:
+            return self.describe(rpm_file, path, srpm_file, limit)
+        except ValueError as e:
+            return f"{e}"
+
+    def remote_request(self, args:dict) -> dict:
+        return srpm.remote_srpm_request(super().remote_request(args), args["srpm_file"])
+
+    def describe(self, rpm_file:str, path:str, srpm_file:str, limit:int=50) -> str:
+        build_dir = srpm.srpm_cache.get_from_cache(srpm_file)
+        hashes = get_payload_hashes(rpm_file)
+        path = os.path.normpath(path)
+        paths = [path] if path in hashes else sorted(p for p in hashes if p.startswith(path.rstrip(os.path.sep) + os.path.sep))
+        if not paths:
+            return f"'{path}' is not a regular file shipped in {rpm_file}, and no files are shipped under it."
+        lines = []
+        for p in paths[:limit]:
+            result = trace(rpm_file, p, build_dir)
+            if not result["source"]:
+                lines.append(f"{p}: no matching source file (generated at build time?)")
+                continue
+            lines.append(f"{p}: from {result['source']} ({result['match']}), header licenses: {', '.join(result['source_licenses']) or 'none detected'}")
+            for license_file, ids in result["nearest_license_files"].items():
+                lines.append(f"  nearest license file {license_file}: {', '.join(ids) or 'unrecognized text'}")
+        if len(paths) > limit:
+            lines.append(f"... ({len(paths) - limit} more files, narrow the path or raise limit)")
+        return "\n".join(lines)
+
+# Only run tests when this file is run directly
+if __name__ == "__main__":
+    print(SourceProvenance().call(sys.argv[1], sys.argv[2], sys.argv[3]))
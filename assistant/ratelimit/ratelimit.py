@@ -0,0 +1,137 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Client-side rate limiting for the Azure OpenAI deployment.
+# Every model invocation (a new run, or a tool output submission which resumes a run) must first
+# reserve capacity from a pair of token buckets: one for requests per minute and one for tokens per
+# minute. Reservations are made against an estimate of the tokens the call will consume, and are
+# settled against the real usage once the run completes. If the service still reports
+# 'rate_limit_exceeded', the buckets are drained until the retry-after hint has elapsed and the run is
+# re-queued with an exponential backoff.
+#
+# The quota is read from the environment:
+#   AZURE_OPENAI_REQUESTS_PER_MINUTE (default 60)
+#   AZURE_OPENAI_TOKENS_PER_MINUTE (default 80000)
+#   AZURE_OPENAI_QUOTA_HEADROOM (default 0.9, the fraction of the quota we allow ourselves to use)
+
+import os
+import re
+import threading
+import time
+
+# Rough conversion from characters to tokens for English text and source code.
+chars_per_token = 4
+
+class TokenBucket:
+    def __init__(self, capacity:float, refill_per_second:float) -> None:
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __refill(self, now:float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.last_refill) * self.refill_per_second)
+        self.last_refill = now
+
+    def reserve(self, amount:float) -> float:
+        """Reserves capacity, returning the number of seconds the caller must wait before using it.
+        The level may go negative, which queues later callers behind this one.
+        :rtype: float
+        :return: Seconds to wait before the reservation is valid.
+        """
+        # Never ask for more than a full bucket, or we would wait forever.
+        amount = min(amount, self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.__refill(now)
+            self.level -= amount
+            if self.level >= 0:
+                return 0.0
+            return -self.level / self.refill_per_second
+
+    def adjust(self, amount:float) -> None:
+        """Returns (positive) or takes (negative) capacity after the real cost of a call is known."""
+        with self.lock:
+            self.__refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+    def drain_for(self, seconds:float) -> None:
+        """Empties the bucket so that no new reservation succeeds for at least the given number of seconds."""
+        with self.lock:
+            self.__refill(time.monotonic())
+            self.level = min(self.level, -seconds * self.refill_per_second)
+
+class RateLimitScheduler:
+    max_requeues = 20
+    max_backoff = 120
+    __retry_after_re = re.compile(r"retry after (\d+(?:\.\d+)?) ?(second|sec|s|millisecond|ms)?", re.IGNORECASE)
+
+    def __init__(self, requests_per_minute:float, tokens_per_minute:float, headroom:float=0.9) -> None:
+        self.requests = TokenBucket(requests_per_minute * headroom, requests_per_minute * headroom / 60)
+        self.tokens = TokenBucket(tokens_per_minute * headroom, tokens_per_minute * headroom / 60)
+        self.waited = 0.0
+        self.requeues = 0
+
+    def from_env():
+        return RateLimitScheduler(
+            float(os.environ.get("AZURE_OPENAI_REQUESTS_PER_MINUTE", 60)),
+            float(os.environ.get("AZURE_OPENAI_TOKENS_PER_MINUTE", 80000)),
+            float(os.environ.get("AZURE_OPENAI_QUOTA_HEADROOM", 0.9)),
+        )
+
+    def estimate_tokens(self, context_tokens:int, new_chars:int) -> int:
+        """Estimates the cost of a model invocation from the tokens already in the thread and the new text being sent.
+        :rtype: int
+        """
+        return int(context_tokens + new_chars / chars_per_token) + 1
+
+    def acquire(self, estimated_tokens:int) -> float:
+        """Blocks until a single request costing the estimated number of tokens fits in the quota.
+        :rtype: float
+        :return: The number of seconds spent waiting.
+        """
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        if wait > 0:
+            if wait >= 1:
+                print(f"Rate limiter: holding request for {wait:.1f} seconds")
+            time.sleep(wait)
+            self.waited += wait
+        return wait
+
+    def settle(self, reserved_tokens:int, actual_tokens:int) -> None:
+        """Corrects the token bucket once the real usage of a run is known."""
+        self.tokens.adjust(reserved_tokens - actual_tokens)
+
+    def parse_retry_after(self, message:str) -> float:
+        """Extracts a retry-after hint from an error message, ie 'Please retry after 7 seconds.'
+        :rtype: float
+        :return: The hint in seconds, or None if no hint was found.
+        """
+        if not message:
+            return None
+        match = self.__retry_after_re.search(message)
+        if not match:
+            return None
+        seconds = float(match.group(1))
+        if match.group(2) and match.group(2).lower() in ["millisecond", "ms"]:
+            seconds /= 1000
+        return seconds
+
+    def rate_limited(self, message:str, attempt:int) -> float:
+        """Records a rate limit error from the service and drains the buckets until it is safe to retry.
+        :rtype: float
+        :return: The backoff delay, in seconds, before the run should be re-queued.
+        """
+        self.requeues += 1
+        retry_after = self.parse_retry_after(message)
+        backoff = min(self.max_backoff, 2 ** attempt)
+        if retry_after is not None:
+            backoff = max(backoff, retry_after)
+        # Hold everyone else back too, our aggregate load is what tripped the limit.
+        self.requests.drain_for(backoff)
+        self.tokens.drain_for(backoff)
+        return backoff
+
+# Shared scheduler, every ThreadRunner in the process draws from the same quota.
+scheduler = RateLimitScheduler.from_env()
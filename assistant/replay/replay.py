@@ -0,0 +1,231 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Record/replay stand-in for the Azure OpenAI assistants API.
+# RecordingClient wraps a real client and appends every assistants/threads/runs/messages call, with its arguments and
+# response, to a JSONL session file. ReplayClient serves a recorded session back without any network access, so the
+# orchestration, tool dispatch and caching can be benchmarked and regression tested offline. The tools themselves
+# still run for real when their calls are replayed.
+#
+# Replay is deterministic even when threads are created concurrently: a replayed thread is bound to a recorded one by
+# the content of the first message added to it, and each thread then has its own queue of recorded responses.
+#
+# Replay can also inject latency on every model call, and rate limit errors on every Nth run, to exercise the
+# scheduler and polling without a live endpoint.
+
+import hashlib
+import itertools
+import json
+import threading
+import time
+
+class ReplayError(Exception):
+    pass
+
+def content_key(content) -> str:
+    return hashlib.sha256(str(content).encode('utf-8')).hexdigest()
+
+def to_jsonable(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return json.loads(json.dumps(value, default=str))
+
+class ReplayObject:
+    """Read only attribute access over a recorded response, enough to stand in for the SDK's pydantic models."""
+    def __init__(self, data:dict) -> None:
+        self.__data = data
+
+    def wrap(value):
+        if isinstance(value, dict):
+            return ReplayObject(value)
+        if isinstance(value, list):
+            return [ReplayObject.wrap(v) for v in value]
+        return value
+
+    def __getattr__(self, name):
+        data = self.__dict__["_ReplayObject__data"]
+        if name not in data:
+            raise AttributeError(name)
+        return ReplayObject.wrap(data[name])
+
+    def model_dump(self, **kwargs) -> dict:
+        return self.__data
+
+    def model_dump_json(self, indent=None, **kwargs) -> str:
+        return json.dumps(self.__data, indent=indent)
+
+class RecordingClient:
+    """Proxies a real client, logging every call under '.beta' to a session file."""
+    def __init__(self, client, session_path:str, path:str="", log=None) -> None:
+        self.__client = client
+        self.__path = path
+        self.__log = log if log else RecordingClient.SessionLog(session_path)
+
+    class SessionLog:
+        def __init__(self, session_path:str) -> None:
+            self.file = open(session_path, 'w')
+            self.lock = threading.Lock()
+
+        def write(self, entry:dict) -> None:
+            with self.lock:
+                self.file.write(json.dumps(entry) + "\n")
+                self.file.flush()
+
+    def __getattr__(self, name):
+        target = getattr(self.__client, name)
+        path = f"{self.__path}.{name}" if self.__path else name
+        if not path.startswith("beta"):
+            return target
+        if callable(target):
+            def record(*args, **kwargs):
+                response = target(*args, **kwargs)
+                thread_id = kwargs.get("thread_id")
+                if path == "beta.threads.create":
+                    thread_id = response.id
+                self.__log.write({
+                    "call": path,
+                    "thread": thread_id,
+                    "args": to_jsonable({k: v for k, v in kwargs.items() if k != "timeout"}),
+                    "response": to_jsonable(response),
+                })
+                return response
+            return record
+        return RecordingClient(target, None, path, self.__log)
+
+class ReplayClient:
+    """Serves a recorded session back. Only the calls made by ThreadRunner and create_assistant are supported."""
+    def __init__(self, session_path:str, latency:float=0.0, rate_limit_every:int=0) -> None:
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.lock = threading.Lock()
+        # Calls that aren't tied to a thread, ie assistants.create
+        self.global_queues = {}
+        # Recorded thread id -> call -> list of responses
+        self.thread_queues = {}
+        # First message content -> recorded thread ids, in creation order
+        self.threads_by_first_message = {}
+        self.unbound_threads = []
+        # Replayed thread id -> recorded thread id
+        self.bindings = {}
+        self.thread_counter = itertools.count()
+        self.run_counter = 0
+        self.injected_runs = {}
+        self.__load(session_path)
+        self.beta = ReplayClient.Namespace(
+            assistants=ReplayClient.Namespace(
+                create=lambda **kwargs: self.global_call("beta.assistants.create"),
+                list=lambda **kwargs: self.global_call("beta.assistants.list"),
+                retrieve=lambda *args, **kwargs: self.global_call("beta.assistants.retrieve"),
+            ),
+            threads=ReplayClient.Namespace(
+                create=self.create_thread,
+                messages=ReplayClient.Namespace(
+                    create=self.create_message,
+                    list=lambda thread_id, **kwargs: self.thread_call("beta.threads.messages.list", thread_id),
+                ),
+                runs=ReplayClient.Namespace(
+                    create=self.create_run,
+                    retrieve=self.retrieve_run,
+                    cancel=lambda thread_id, run_id, **kwargs: self.thread_call("beta.threads.runs.cancel", thread_id),
+                    submit_tool_outputs=self.submit_tool_outputs,
+                ),
+            ),
+        )
+
+    class Namespace:
+        def __init__(self, **members) -> None:
+            self.__dict__.update(members)
+
+    def __load(self, session_path:str) -> None:
+        with open(session_path, 'r') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        for entry in entries:
+            call = entry["call"]
+            thread = entry["thread"]
+            if thread is None:
+                self.global_queues.setdefault(call, []).append(entry["response"])
+                continue
+            if call == "beta.threads.create":
+                self.thread_queues[thread] = {}
+                self.unbound_threads.append(thread)
+                continue
+            queues = self.thread_queues.setdefault(thread, {})
+            if call == "beta.threads.messages.create" and not queues.get(call):
+                self.threads_by_first_message.setdefault(content_key(entry["args"].get("content")), []).append(thread)
+            queues.setdefault(call, []).append(entry["response"])
+
+    def __pop(self, queue:list, description:str):
+        if not queue:
+            raise ReplayError(f"Session has no more recorded responses for {description}")
+        return ReplayObject.wrap(queue.pop(0))
+
+    def __delay(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def global_call(self, call:str):
+        with self.lock:
+            return self.__pop(self.global_queues.get(call, []), call)
+
+    def recorded_assistant(self):
+        """Returns the assistant the session used, whether it was created, retrieved or found by listing."""
+        for call in ["beta.assistants.create", "beta.assistants.retrieve"]:
+            if self.global_queues.get(call):
+                return self.global_call(call)
+        for page in self.global_queues.get("beta.assistants.list", []):
+            for assistant in page["data"]:
+                if (assistant.get("metadata") or {}).get("fingerprint"):
+                    return ReplayObject(assistant)
+        raise ReplayError("Session has no recorded assistant")
+
+    def thread_call(self, call:str, thread_id:str):
+        with self.lock:
+            recorded = self.bindings.get(thread_id)
+            if recorded is None:
+                raise ReplayError(f"{call} on thread {thread_id} before any message was added to it")
+            return self.__pop(self.thread_queues[recorded].get(call, []), f"{call} on recorded thread {recorded}")
+
+    def create_thread(self, **kwargs):
+        # Binding to a recorded thread is deferred until we see the first message
+        return ReplayObject({"id": f"replay_thread_{next(self.thread_counter)}", "object": "thread"})
+
+    def create_message(self, thread_id:str, role:str, content, **kwargs):
+        with self.lock:
+            if thread_id not in self.bindings:
+                candidates = [t for t in self.threads_by_first_message.get(content_key(content), []) if t in self.unbound_threads]
+                if not candidates:
+                    # Prompts changed since recording, fall back to creation order
+                    candidates = self.unbound_threads
+                if not candidates:
+                    raise ReplayError("Session has no more recorded threads")
+                self.bindings[thread_id] = candidates[0]
+                self.unbound_threads.remove(candidates[0])
+        return self.thread_call("beta.threads.messages.create", thread_id)
+
+    def create_run(self, thread_id:str, **kwargs):
+        self.__delay()
+        with self.lock:
+            self.run_counter += 1
+            inject = self.rate_limit_every and self.run_counter % self.rate_limit_every == 0
+            if inject:
+                run_id = f"replay_rate_limited_{self.run_counter}"
+                self.injected_runs[run_id] = {
+                    "id": run_id,
+                    "object": "thread.run",
+                    "thread_id": thread_id,
+                    "status": "failed",
+                    "last_error": {"code": "rate_limit_exceeded", "message": "Rate limit injected by replay. Please retry after 1 seconds."},
+                    "usage": None,
+                    "required_action": None,
+                }
+                return ReplayObject(self.injected_runs[run_id])
+        return self.thread_call("beta.threads.runs.create", thread_id)
+
+    def retrieve_run(self, thread_id:str, run_id:str, **kwargs):
+        if run_id in self.injected_runs:
+            return ReplayObject(self.injected_runs[run_id])
+        return self.thread_call("beta.threads.runs.retrieve", thread_id)
+
+    def submit_tool_outputs(self, thread_id:str, run_id:str, tool_outputs:list, **kwargs):
+        self.__delay()
+        return self.thread_call("beta.threads.runs.submit_tool_outputs", thread_id)
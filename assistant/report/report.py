@@ -0,0 +1,138 @@
+#!/bin/python3
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Streaming review reports.
+# Each package's assessment, and each issue recorded through provide_assessment, is appended to a JSONL report as soon
+# as it is available, and synced to disk before moving on. A crash or rate limit late in a long run only loses the
+# work in flight, and the report can be followed (ie `tail -f`) while the run is going. The closing summary is
+# rendered from the report, rather than from state held in memory.
+#
+# Issues can also be written as a SARIF 2.1.0 log for code scanning tools. SARIF is a single JSON document, so it is
+# rewritten in full (atomically) whenever an issue arrives.
+#
+# Every record has a "type" ("package", "issue", "summary", "suggestions" or "done") and a "time". The "done" record
+# carries the job's ledger (see ledger.py).
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sarif_schema = "https://json.schemastore.org/sarif-2.1.0.json"
+sarif_rule = "license-issue"
+# Issue severity -> SARIF result level
+sarif_levels = {"high": "error", "medium": "warning", "low": "note", "none": "none"}
+
+def sync_write(f, text:str) -> None:
+    f.write(text)
+    f.flush()
+    os.fsync(f.fileno())
+
+def sarif_result(issue:dict) -> dict:
+    """Converts a provide_assessment issue to a SARIF result.
+    :rtype: dict
+    """
+    if issue.get("has_issue"):
+        message = issue.get("description") or "Licensing issue"
+    else:
+        message = "No licensing issues found"
+    return {
+        "ruleId": sarif_rule,
+        "level": sarif_levels.get(issue.get("severity"), "warning"),
+        "message": {"text": message},
+        "locations": [{"physicalLocation": {"artifactLocation": {"uri": os.path.basename(issue.get("file") or "")}}}],
+    }
+
+def sarif_log(results:list[dict]) -> dict:
+    return {
+        "$schema": sarif_schema,
+        "version": "2.1.0",
+        "runs": [{
+            "tool": {"driver": {
+                "name": "license-assistant",
+                "rules": [{"id": sarif_rule, "shortDescription": {"text": "Package licensing concern"}}],
+            }},
+            "results": results,
+        }],
+    }
+
+class ReportWriter:
+    def __init__(self, jsonl_path:str, sarif_path:str=None, append:bool=False) -> None:
+        self.jsonl_path = jsonl_path
+        self.sarif_path = sarif_path
+        self.lock = threading.Lock()
+        self.file = open(jsonl_path, 'a' if append else 'w')
+        self.sarif_results = []
+        self.records = 0
+        if sarif_path:
+            self.__write_sarif()
+
+    def write(self, record:dict) -> None:
+        """Appends a record to the report, returning once it is on disk."""
+        record = {"time": round(time.time(), 3), **record}
+        with self.lock:
+            sync_write(self.file, json.dumps(record) + "\n")
+            self.records += 1
+            if self.sarif_path and record["type"] == "issue":
+                self.sarif_results.append(sarif_result(record))
+                self.__write_sarif()
+
+    def __write_sarif(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.sarif_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".sarif-")
+        with os.fdopen(fd, 'w') as f:
+            sync_write(f, json.dumps(sarif_log(self.sarif_results), indent=2))
+        os.replace(tmp_path, self.sarif_path)
+
+    def package(self, package:str, assessment:str, cached:bool=False, **fields) -> None:
+        self.write({"type": "package", "package": package, "cached": cached, "assessment": assessment, **fields})
+
+    def issue(self, issue:dict, **fields) -> None:
+        """Suitable as a ProvideAssessmentFunc.on_issue callback."""
+        self.write({"type": "issue", **issue, **fields})
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+def read_records(jsonl_path:str) -> list[dict]:
+    """Reads a report back. A line cut short by a crash is skipped.
+    :rtype: list[dict]
+    """
+    records = []
+    with open(jsonl_path, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+def render_text(records:list[dict]) -> str:
+    """Renders the findings and package assessments in a report as the plain text summary.
+    :rtype: str
+    """
+    files = next((r["files"] for r in records if r["type"] == "done"), None)
+    text = f"Findings for {files if files else 'an incomplete run'}:\n"
+    for issue in (r for r in records if r["type"] == "issue"):
+        text += f"Package: {os.path.basename(issue.get('package') or '')}, File: {os.path.basename(issue['file'])},\n\tSeverity: {issue['severity']},\n\tDescription: {issue['description']}\n"
+    text += "\nPackage assessments:\n"
+    for package in (r for r in records if r["type"] == "package"):
+        text += f"{package['package']}:\n{package['assessment']}\n\n"
+    for kind in ["summary", "suggestions"]:
+        for record in (r for r in records if r["type"] == kind):
+            text += f"{kind.capitalize()}:\n{record['text']}\n\n"
+    for done in (r for r in records if r["type"] == "done" and r.get("ledger")):
+        totals = done["ledger"]["totals"]
+        text += (f"Usage for {done['srpm']}: {totals.get('runs', 0)} runs, {totals.get('prompt_tokens', 0)} prompt and "
+                 f"{totals.get('completion_tokens', 0)} completion tokens, {totals.get('wall_seconds', 0):.1f} seconds in runs\n\n")
+    return text
+
+# Only run tests when this file is run directly
+if __name__ == "__main__":
+    # Render whatever made it into a report, ie after a run was interrupted
+    print(render_text(read_records(sys.argv[1])))
@@ -8,20 +8,30 @@
 #
 # Each function may then be called by passing it a dictionary with the required parameters.
 
+import hashlib
 import os
+import shutil
 import subprocess
 import sys
+import threading
 import time
-sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+from array import array
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
 
 from assistant_funcs import assistant_funcs
+from cache import cache
+from lineindex import lineindex
+from tracing import tracing
 import tempfile
 
 
 def rpm_query(filePath: str, args: list[str]) -> list[str]:
     cmd = ["rpm"] + args + [filePath]
     # Run the bash script and capture the output.
-    output = subprocess.check_output(cmd, text=True, stderr=subprocess.DEVNULL)
+    with tracing.span("rpm", "subprocess", args=" ".join(args), file=os.path.basename(filePath)):
+        output = subprocess.check_output(cmd, text=True, stderr=subprocess.DEVNULL)
 
 
     # If the output has the string '(contains no files)', then there are no files to list
@@ -32,7 +42,73 @@ def rpm_query(filePath: str, args: list[str]) -> list[str]:
     output = [file for file in output if file]
     return output
 
-def format_single_path(path: str, search_dir:str, depth: int, directory_set: set[str], license_set: set[str], document_set: set[str]) -> str:
+# Flags stored for each path in an RpmFileList.CacheEntry
+flag_dir = 1
+flag_license = 2
+flag_doc = 4
+
+class InternTable:
+    """Maps strings to small integer ids and back. Shared by every cache entry, so a directory like
+    '/usr/share/perl5/vendor_perl' is stored once no matter how many packages ship files under it."""
+    # Rough cost of one string beyond its own size: its dict slot, list slot and id
+    overhead_per_string = 100
+
+    def __init__(self) -> None:
+        self.ids = {}
+        self.strings = []
+        self.lock = threading.Lock()
+        # Kept up to date as strings are added, so the cache budget can check it cheaply
+        self.bytes = 0
+
+    def intern(self, string:str) -> int:
+        string_id = self.ids.get(string)
+        if string_id is None:
+            with self.lock:
+                string_id = self.ids.get(string)
+                if string_id is None:
+                    string_id = len(self.strings)
+                    self.strings.append(string)
+                    self.ids[string] = string_id
+                    self.bytes += sys.getsizeof(string) + InternTable.overhead_per_string
+        return string_id
+
+    def get_id(self, string:str) -> int:
+        """Returns the id of a string, or None if it was never interned."""
+        return self.ids.get(string)
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def nbytes(self) -> int:
+        return self.bytes
+
+# The intern tables new cache entries are built with. Each entry keeps a reference to its own tables, so once every
+# entry has been evicted they are replaced (see intern_tables()), and the old ones go away with the last entry using them.
+dir_table = InternTable()
+name_table = InternTable()
+tables_lock = threading.Lock()
+cache.registry.add_gauge("rpm_path_intern_tables", lambda: dir_table.nbytes() + name_table.nbytes())
+
+def intern_tables() -> tuple:
+    """Returns the (directory, name) intern tables for a new cache entry, starting fresh ones if the rpm cache is empty,
+    so strings from packages that are no longer cached don't pile up.
+    :rtype: tuple
+    """
+    global dir_table, name_table
+    with tables_lock:
+        if len(dir_table) and not len(RpmFileList.rpm_cache):
+            dir_table = InternTable()
+            name_table = InternTable()
+        return dir_table, name_table
+
+def join_path(directory:str, name:str) -> str:
+    if not name:
+        return directory
+    if directory == os.path.sep:
+        return f"{os.path.sep}{name}"
+    return f"{directory}{os.path.sep}{name}"
+
+def format_single_path(path: str, search_dir:str, depth: int, flags: int) -> str:
     # Remove the search_dir from the path
     res = path[len(search_dir):]
     if res.startswith(os.path.sep):
@@ -55,11 +131,11 @@ def format_single_path(path: str, search_dir:str, depth: int, directory_set: set
     if did_prune:
         res = os.path.join(res,"...")
     # Prefix the path with the appropriate prefix
-    if path in directory_set:
+    if flags & flag_dir:
         res = f"{RpmFileList.dir_prefix}{res}"
-    elif path in license_set:
+    elif flags & flag_license:
         res = f"{RpmFileList.license_prefix}{res}"
-    elif path in document_set:
+    elif flags & flag_doc:
         res = f"{RpmFileList.doc_prefix}{res}"
     else:
         res = f"{RpmFileList.file_prefix}{res}"
@@ -76,6 +152,8 @@ class RpmName(assistant_funcs.OpenAIAssistantFunc):
             }
         }
 
+    remote_path_args = ["rpm_file"]
+
     def __init__(self) -> None:
         super().__init__(self.__rpmNameName, self.__rpmNameDescription, self.__rpmNameParameters)
 
@@ -117,19 +195,94 @@ class RpmFileList(assistant_funcs.OpenAIAssistantFunc):
         }
 
     class CacheEntry:
+        """The paths in an rpm, stored column-wise: the directory and basename of each path as ids into the shared
+        intern tables, and a bitmask of flag_dir/flag_license/flag_doc. Paths keep the order rpm listed them in."""
+        __slots__ = ("dirs", "names", "dir_ids", "name_ids", "flags")
+
         def __init__(self, all_files_and_dirs: list[str], dirs_set: set[str], licenses_set: set[str], docs_set: set[str]) -> None:
-            self.all_files_and_dirs = all_files_and_dirs
-            self.dirs_set = dirs_set
-            self.licenses_set = licenses_set
-            self.docs_set = docs_set
+            self.dirs, self.names = intern_tables()
+            self.dir_ids = array('I')
+            self.name_ids = array('I')
+            self.flags = array('B')
+            dirs_set, licenses_set, docs_set = [{os.path.normpath(p) for p in paths} for paths in [dirs_set, licenses_set, docs_set]]
+            for path in all_files_and_dirs:
+                path = os.path.normpath(path)
+                directory, name = os.path.split(path)
+                self.dir_ids.append(self.dirs.intern(directory))
+                self.name_ids.append(self.names.intern(name))
+                flags = 0
+                if path in dirs_set:
+                    flags |= flag_dir
+                if path in licenses_set:
+                    flags |= flag_license
+                if path in docs_set:
+                    flags |= flag_doc
+                self.flags.append(flags)
+
+        def __len__(self) -> int:
+            return len(self.flags)
+
+        def path(self, index:int) -> str:
+            return join_path(self.dirs.strings[self.dir_ids[index]], self.names.strings[self.name_ids[index]])
+
+        def items(self):
+            """Yields (path, flags) for every path in the rpm."""
+            dirs = self.dirs.strings
+            names = self.names.strings
+            for dir_id, name_id, flags in zip(self.dir_ids, self.name_ids, self.flags):
+                yield join_path(dirs[dir_id], names[name_id]), flags
+
+        def items_under(self, search_dir:str):
+            """Yields (path, flags) for every path that starts with search_dir, skipping whole directories that can't
+            match without building their paths."""
+            dirs = self.dirs.strings
+            names = self.names.strings
+            # Paths in a directory below search_dir always match, paths elsewhere only might if the directory is a
+            # prefix of search_dir (ie '/usr/share/nano' itself, whose directory is '/usr/share').
+            verdicts = {}
+            for dir_id, name_id, flags in zip(self.dir_ids, self.name_ids, self.flags):
+                verdict = verdicts.get(dir_id)
+                if verdict is None:
+                    directory = dirs[dir_id]
+                    verdict = 2 if directory.startswith(search_dir) else 1 if search_dir.startswith(directory) else 0
+                    verdicts[dir_id] = verdict
+                if verdict == 0:
+                    continue
+                path = join_path(dirs[dir_id], names[name_id])
+                if verdict == 2 or path.startswith(search_dir):
+                    yield path, flags
+
+        def paths_with_flag(self, flag:int) -> list[str]:
+            return [path for path, flags in self.items() if flags & flag]
+
+        def nbytes(self) -> int:
+            """Bytes held by this entry, not counting the shared intern tables."""
+            return sys.getsizeof(self.dir_ids) + sys.getsizeof(self.name_ids) + sys.getsizeof(self.flags)
+
+        # The pre-compaction interface, built on demand
+        @property
+        def all_files_and_dirs(self) -> list[str]:
+            return [path for path, _ in self.items()]
+
+        @property
+        def dirs_set(self) -> set[str]:
+            return set(self.paths_with_flag(flag_dir))
+
+        @property
+        def licenses_set(self) -> set[str]:
+            return set(self.paths_with_flag(flag_license))
+
+        @property
+        def docs_set(self) -> set[str]:
+            return set(self.paths_with_flag(flag_doc))
 
     # Shared rpm cache. Stores a list of files, licenses, docs, and dirs for each rpm file. Key is the rpm file path.
-    rpm_cache = None
+    rpm_cache = cache.registry.create("rpm_file_list", sizeof=lambda entry: entry.nbytes())
+
+    remote_path_args = ["rpm_file"]
 
     def __init__(self) -> None:
         super().__init__(self.__rpmFileListName, self.__rpmFileListDescription, self.__rpmFileListParameters)
-        if RpmFileList.rpm_cache is None:
-            RpmFileList.rpm_cache = {}
 
     def call(self, rpm_file:str, search_dir:str="/", max_depth:int=0) -> str:
         # Check if file exists!
@@ -143,22 +296,14 @@ class RpmFileList(assistant_funcs.OpenAIAssistantFunc):
         return self.rpm_get_contents(rpm_file, search_dir, max_depth)
 
     def format_output(self, filePath: str, search_dir:str, depth:int) -> list[str]:
-        directory_set = self.rpm_cache[filePath].dirs_set
-        license_set = self.rpm_cache[filePath].licenses_set
-        document_set = self.rpm_cache[filePath].docs_set
-
-        all_files = self.rpm_cache[filePath].all_files_and_dirs
+        entry = self.get_cache_entry(filePath)
 
-        # Normalize paths
+        # Normalize paths, and filter out files and directories that are not in the root directory
         search_dir = os.path.normpath(search_dir)
-        all_files = [os.path.normpath(file) for file in all_files]
-
-        # Filter out files and directories that are not in the root directory
-        if search_dir:
-            all_files = [file for file in all_files if file.startswith(search_dir)]
+        all_files = entry.items_under(search_dir) if search_dir else entry.items()
 
         # Format the paths
-        all_files = [format_single_path(file, search_dir, depth, directory_set, license_set, document_set) for file in all_files]
+        all_files = [format_single_path(file, search_dir, depth, flags) for file, flags in all_files]
 
         # Remove duplicates
         all_files = list(set(all_files))
@@ -168,22 +313,28 @@ class RpmFileList(assistant_funcs.OpenAIAssistantFunc):
 
         return all_files
 
-    def rpm_get_contents(self, filePath: str, search_dir:str, depth:int) -> list[str]:
+    def get_cache_entry(self, filePath: str) -> "RpmFileList.CacheEntry":
+        """Returns the cached file information for an rpm, querying the rpm on first use.
+        :rtype: RpmFileList.CacheEntry
+        """
         # Populate cache on first run
-        if not filePath in RpmFileList.rpm_cache:
+        entry = RpmFileList.rpm_cache.get(filePath)
+        if entry is None:
             all_files_and_dirs = rpm_query(filePath, ["-q", "--qf", "[%{FILEMODES:perms} %{FILENAMES}\n]"])
             all_dirs = [file.split(' ', 1)[1] for file in all_files_and_dirs if file[0] == "d"]
             # Strip the permissions from the files
             all_files_and_dirs = [file.split(' ', 1)[1] for file in all_files_and_dirs]
             licenses = rpm_query(filePath, ["-qL"])
             docs = rpm_query(filePath, ["-qd"])
-            RpmFileList.rpm_cache[filePath] = RpmFileList.CacheEntry(all_files_and_dirs, set(all_dirs), set(licenses), set(docs))
-            entry = RpmFileList.rpm_cache[filePath]
+            entry = RpmFileList.CacheEntry(all_files_and_dirs, set(all_dirs), set(licenses), set(docs))
+            RpmFileList.rpm_cache[filePath] = entry
             #print(f"DEBUG: Cache entry is {entry.all_files_and_dirs}")
             #print(f"DEBUG: Cache entry is {entry.dirs_set}")
             #print(f"DEBUG: Cache entry is {entry.licenses_set}")
             #print(f"DEBUG: Cache entry is {entry.docs_set}")
+        return entry
 
+    def rpm_get_contents(self, filePath: str, search_dir:str, depth:int) -> list[str]:
         return self.format_output(filePath, search_dir, depth)
 
 class RpmDependencyInfo(assistant_funcs.OpenAIAssistantFunc):
@@ -197,6 +348,8 @@ class RpmDependencyInfo(assistant_funcs.OpenAIAssistantFunc):
             }
         }
 
+    remote_path_args = ["rpm_file"]
+
     def __init__(self) -> None:
         super().__init__(self.__rpmDependencyInfoName, self.__rpmDependencyInfoDescription, self.__rpmDependencyInfoParameters)
 
@@ -240,13 +393,16 @@ class RpmReadFile(assistant_funcs.OpenAIAssistantFunc):
             "max_lines": {
                 "type": "integer",
                 "description": "OPTIONAL (default '10'): The maximum number of lines to read from the file."
-            }
+            },
+            **lineindex.range_parameters,
         }
 
+    remote_path_args = ["rpm_file"]
+
     def __init__(self) -> None:
         super().__init__(self.__rpm_read_file_name, self.__rpm_read_file_description, self.__rpm_read_file_parameters)
 
-    def call(self, rpm_file:str, file_path:str, max_lines:int=10) -> str:
+    def call(self, rpm_file:str, file_path:str, max_lines:int=10, start_line:int=None, end_line:int=None, byte_offset:int=None, byte_count:int=None) -> str:
         # Check if file exists!
         abs_path = os.path.abspath(rpm_file)
         if not os.path.exists(abs_path):
@@ -255,16 +411,102 @@ class RpmReadFile(assistant_funcs.OpenAIAssistantFunc):
         if max_lines <= 0:
             err = ValueError(f"max_lines must be greater than 0")
             return f"{err}"
-        return self.rpm_read_file(rpm_file, file_path, max_lines)
-
-    def rpm_read_file(self, rpm_file:str, file_path:str, max_lines:int=10) -> str:
+        return self.rpm_read_file(rpm_file, file_path, max_lines, start_line, end_line, byte_offset, byte_count)
+
+    # Extracted payloads are kept on disk up to LICENSE_ASSISTANT_PAYLOAD_CACHE_MB (default 4096). Payloads of rpms that
+    # were rebuilt or removed are dropped first, then the least recently used. Checked at most once per prune_interval
+    # seconds, when a new payload directory is started.
+    prune_interval = 600
+    last_prune = 0.0
+    prune_lock = threading.Lock()
+
+    def payload_key(rpm_file:str) -> str:
+        stat = os.stat(rpm_file)
+        return hashlib.sha256(f"{os.path.abspath(rpm_file)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode('utf-8')).hexdigest()
+
+    def payload_dir(self, rpm_file:str) -> str:
+        """Returns (and creates) the directory files extracted from an rpm are kept in. Keyed on the rpm's path, size and
+        mtime, so a rebuilt rpm never serves stale files.
+        :rtype: str
+        """
+        path = os.path.join(assistant_funcs.get_cache_dir("rpm_payload"), RpmReadFile.payload_key(rpm_file))
+        if os.path.isdir(path):
+            # The directory's mtime records when it was last used, for evicting the least recently used
+            os.utime(path)
+            return path
+        # Which rpm the payload came from, so it can be dropped once the rpm is rebuilt or removed
+        with open(f"{path}.source", 'w', encoding='utf-8') as f:
+            f.write(os.path.abspath(rpm_file))
+        os.makedirs(path, exist_ok=True)
+        RpmReadFile.prune_payloads(keep=path)
+        return path
+
+    def prune_payloads(keep:str=None, force:bool=False) -> None:
+        """Removes payloads of rpms that changed or are gone, then the least recently used ones while the payload cache is
+        over its size limit.
+        :param keep: A payload directory that is in use and must stay.
+        :param force: Prune even if the last pruning was less than prune_interval seconds ago.
+        """
+        with RpmReadFile.prune_lock:
+            if not force and time.monotonic() - RpmReadFile.last_prune < RpmReadFile.prune_interval and RpmReadFile.last_prune:
+                return
+            RpmReadFile.last_prune = time.monotonic()
+        limit = int(float(os.environ.get("LICENSE_ASSISTANT_PAYLOAD_CACHE_MB", 4096)) * 1024 * 1024)
+        root = assistant_funcs.get_cache_dir("rpm_payload")
+        payloads = []
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if path == keep or not os.path.isdir(path):
+                continue
+            try:
+                with open(f"{path}.source", 'r', encoding='utf-8') as f:
+                    source = f.read()
+                live = os.path.exists(source) and RpmReadFile.payload_key(source) == name
+            except OSError:
+                live = False
+            if not live:
+                RpmReadFile.remove_payload(path)
+                continue
+            size = sum(os.lstat(os.path.join(d, f)).st_size for d, _, files in os.walk(path) for f in files)
+            payloads.append((os.path.getmtime(path), size, path))
+        total = sum(size for _, size, _ in payloads)
+        for _, size, path in sorted(payloads):
+            if total <= limit:
+                break
+            RpmReadFile.remove_payload(path)
+            total -= size
+
+    def remove_payload(path:str) -> None:
+        # The markers go first, so a half removed payload is never taken for a complete one
+        for marker in [f"{path}.complete", f"{path}.source"]:
+            if os.path.exists(marker):
+                os.remove(marker)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def extract_file(self, rpm_file:str, file_path:str) -> str:
+        """Extracts a single file from an rpm's payload into the payload cache, unless it is already there.
+        :rtype: str
+        :return: The path to the extracted file.
+        :raises ValueError: rpm2cpio or cpio failed.
+        """
         # cpio archives prepend '.' to every path, ensure that is added to the file path
         if not file_path.startswith('.'):
             file_path = f".{file_path}"
-
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            tmp_file = os.path.join(tmp_dir, "file")
-            with open(tmp_file, 'wb') as f:
+        # Normalizing the absolute form collapses any '..', so the result always stays inside the payload directory
+        normalized = os.path.normpath(os.path.join(os.path.sep, file_path.removeprefix(".")))
+        payload_dir = self.payload_dir(rpm_file)
+        extracted_path = os.path.join(payload_dir, normalized.lstrip(os.path.sep))
+        # After a full extraction, packaged symlinks are real links in the payload directory. Neither the file nor any
+        # directory above it may lead outside of it, ie to the host's /etc
+        if os.path.islink(extracted_path) or not os.path.realpath(extracted_path).startswith(os.path.realpath(payload_dir) + os.path.sep):
+            raise ValueError(f"'{file_path}' is a symbolic link in {rpm_file}, or lies beneath one")
+        if os.path.isfile(extracted_path):
+            return extracted_path
+
+        os.makedirs(os.path.dirname(extracted_path), exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(extracted_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f, tracing.span("rpm2cpio | cpio -i", "subprocess", file=os.path.basename(rpm_file), path=file_path):
                 # Get the cpio
                 rpm_cmd = subprocess.Popen(["rpm2cpio", rpm_file], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
                 # Extract the file
@@ -276,25 +518,63 @@ class RpmReadFile(assistant_funcs.OpenAIAssistantFunc):
                 cpio_cmd.communicate()
                 if rpm_cmd.wait():
                     stderr = rpm_cmd.communicate()[1].decode('utf-8')
-                    err = ValueError(f"rpm2cpio command failed with return code {rpm_cmd.returncode}, error: {stderr}")
-                    return f"{err}"
+                    raise ValueError(f"rpm2cpio command failed with return code {rpm_cmd.returncode}, error: {stderr}")
                 if cpio_cmd.wait():
                     stderr = cpio_cmd.communicate()[1].decode('utf-8')
-                    err = ValueError(f"cpio command failed with return code {cpio_cmd.returncode}, error: {stderr}")
-                    return f"{err}"
+                    raise ValueError(f"cpio command failed with return code {cpio_cmd.returncode}, error: {stderr}")
+            os.replace(tmp_file, extracted_path)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        return extracted_path
+
+    def extract_payload(self, rpm_file:str) -> str:
+        """Extracts an rpm's whole payload into the payload cache, unless that was already done.
+        :rtype: str
+        :return: The directory the payload was extracted into, laid out as it would be installed.
+        :raises ValueError: rpm2cpio or cpio failed.
+        """
+        payload_dir = self.payload_dir(rpm_file)
+        marker = f"{payload_dir}.complete"
+        if os.path.exists(marker):
+            return payload_dir
+        os.makedirs(payload_dir, exist_ok=True)
+        with tracing.span("rpm2cpio | cpio -idmu", "subprocess", file=os.path.basename(rpm_file)):
+            rpm_cmd = subprocess.Popen(["rpm2cpio", rpm_file], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            cpio_cmd = subprocess.Popen(["cpio", "-idmu", "--quiet", "--no-absolute-filenames"], stdin=rpm_cmd.stdout, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE, cwd=payload_dir)
+            rpm_cmd.stdout.close()
+            cpio_stderr = cpio_cmd.communicate()[1]
+            rpm_stderr = rpm_cmd.communicate()[1]
+        if rpm_cmd.returncode:
+            raise ValueError(f"rpm2cpio command failed with return code {rpm_cmd.returncode}, error: {rpm_stderr.decode('utf-8')}")
+        if cpio_cmd.returncode:
+            raise ValueError(f"cpio command failed with return code {cpio_cmd.returncode}, error: {cpio_stderr.decode('utf-8')}")
+        # Packaged modes may not let us read our own copy, ie /etc/shadow is 000. os.walk lists links to directories
+        # with the directories, and chmod follows links, so links are skipped or a packaged link would change the host
+        for root, dirs, files in os.walk(payload_dir):
+            for names, mode in [(dirs, 0o755), (files, 0o644)]:
+                for name in names:
+                    path = os.path.join(root, name)
+                    if not os.path.islink(path):
+                        os.chmod(path, mode)
+        open(marker, 'w').close()
+        return payload_dir
+
+    def rpm_read_file(self, rpm_file:str, file_path:str, max_lines:int=10, start_line:int=None, end_line:int=None, byte_offset:int=None, byte_count:int=None) -> str:
+        try:
+            extracted_path = self.extract_file(rpm_file, file_path)
+        except ValueError as err:
+            return f"{err}"
 
-            # Try to read the file if we can
-            try:
-                with open(tmp_file, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    if len(lines) > max_lines:
-                        lines = lines[:max_lines]
-                    # Join the lines into a single string with '\n' between each line
-                    lines = "".join(lines)
-                    return lines
-            except UnicodeDecodeError:
-                err = ValueError(f"File '{rpm_file}' does not appear to be a text file, refusing to print.")
-                return f"{err}"
+        # Try to read the file if we can
+        try:
+            return lineindex.read_slice(extracted_path, max_lines, start_line, end_line, byte_offset, byte_count)
+        except UnicodeDecodeError:
+            err = ValueError(f"File '{rpm_file}' does not appear to be a text file, refusing to print.")
+            return f"{err}"
+        except ValueError as e:
+            return f"{e}"
 
 
 # Only run tests when this file is run directly
@@ -11,10 +11,53 @@
 import os
 import subprocess
 import sys
-sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
 
 from assistant_funcs import assistant_funcs
 
+def spec_license_tags(filePath: str) -> dict[str, str]:
+    """Returns the 'License:' tag for each package defined in a .spec file, keyed by package name.
+    Only %{name} and simple %define/%global macros are expanded, anything else is left as-is.
+    :rtype: dict[str, str]
+    """
+    macros = {}
+    licenses = {}
+    packages = []
+    main_name = None
+    current = None
+    with open(filePath, 'r') as file:
+        for line in file:
+            line = line.strip()
+            words = line.split()
+            if len(words) >= 3 and words[0] in ["%define", "%global"]:
+                macros[words[1]] = " ".join(words[2:])
+                continue
+            for macro, value in macros.items():
+                line = line.replace(f"%{{{macro}}}", value).replace(f"%{{?{macro}}}", value)
+            if main_name:
+                line = line.replace("%{name}", main_name)
+            if line.lower().startswith("name:") and main_name is None:
+                main_name = line.split(":", 1)[1].strip()
+                macros["name"] = main_name
+                current = main_name
+                packages.append(current)
+            elif line.startswith("%package"):
+                words = line.split()
+                if "-n" in words:
+                    current = words[words.index("-n") + 1]
+                else:
+                    current = f"{main_name}-{words[-1]}"
+                packages.append(current)
+            elif line.lower().startswith("license:") and current:
+                licenses[current] = line.split(":", 1)[1].strip()
+    # Sub-packages without their own tag inherit the main package's license
+    for package in packages:
+        if package not in licenses and main_name in licenses:
+            licenses[package] = licenses[main_name]
+    return licenses
+
 class SpecContents(assistant_funcs.OpenAIAssistantFunc):
     __specContentsName = "spec_contents"
     __specContentsDescription = "Get the contents of a .spec file."
@@ -10,9 +10,14 @@
 
 import os
 import sys
-sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
 
 from assistant_funcs import assistant_funcs
+from cache import cache
+from lineindex import lineindex
+from manifest import manifest
 
 def sanitize_path(top_build_dir, path):
     top_build_dir = os.path.abspath(top_build_dir)
@@ -27,28 +32,61 @@ def sanitize_path(top_build_dir, path):
     return final_path
 
 class SrpmCache:
-    srpm_cache = {}
+    # Registrations can't be rebuilt once lost, so they are exempt from the memory budget
+    srpm_cache = cache.registry.create("srpm_build_dirs", pinned=True)
     class SrpmCacheEntry:
         def __init__(self, top_build_dir) -> None:
             self.top_build_dir = top_build_dir
 
+    def register(self, srpm_file, top_build_dir):
+        """Records where the prepped build tree (the BUILD directory after `rpmbuild -bp`) for an SRPM lives."""
+        self.srpm_cache[srpm_file] = SrpmCache.SrpmCacheEntry(top_build_dir)
+
     def get_from_cache(self, srpm_file):
-        if not srpm_file in self.srpm_cache:
+        entry = self.srpm_cache.get(srpm_file)
+        if entry is None:
             # Hack for testing, hard-code the topdir
             if "perl" in srpm_file:
-                self.srpm_cache[srpm_file] = SrpmCache.SrpmCacheEntry("./perl-testing/build/BUILD")
+                entry = SrpmCache.SrpmCacheEntry("./perl-testing/build/BUILD")
             elif "nano" in srpm_file:
-                self.srpm_cache[srpm_file] = SrpmCache.SrpmCacheEntry("./nano-testing/build/BUILD")
+                entry = SrpmCache.SrpmCacheEntry("./nano-testing/build/BUILD")
             else:
                 raise ValueError(f"SRPM file '{srpm_file}' not found in cache.")
+            self.srpm_cache[srpm_file] = entry
         # Ensure the dir exists!
-        if not os.path.exists(self.srpm_cache[srpm_file].top_build_dir):
+        if not os.path.exists(entry.top_build_dir):
             raise ValueError(f"SRPM file '{srpm_file}' not found on disk!")
 
-        return self.srpm_cache[srpm_file].top_build_dir
+        return entry.top_build_dir
 
 srpm_cache = SrpmCache()
 
+def remote_srpm_request(request:dict, srpm_file:str) -> dict:
+    """Adds the build tree to a tool server request, since the server can't see our registrations."""
+    request["build_dir"] = os.path.abspath(srpm_cache.get_from_cache(srpm_file))
+    return request
+
+def walk_listing(final_path:str, max_depth:int) -> tuple[list[str], list[str]]:
+    """Lists files and dirs below final_path straight from the filesystem, relative to it.
+    :rtype: tuple[list[str], list[str]]
+    """
+    files = []
+    dirs = []
+    base_depth = final_path.count(os.path.sep)
+    for root, dir_list, file_list in os.walk(final_path):
+        relative_depth = root.count(os.path.sep) - base_depth
+
+        if max_depth > 0 and relative_depth >= max_depth:
+            continue
+
+        dirs.extend([os.path.join(root, dir) for dir in dir_list])
+        files.extend([os.path.join(root, file) for file in file_list])
+
+    # Remove the common prefix from the paths
+    files = [file.removeprefix(final_path+os.path.sep) for file in files]
+    dirs = [dir.removeprefix(final_path+os.path.sep) for dir in dirs]
+    return files, dirs
+
 class SrpmExploreFiles(assistant_funcs.OpenAIAssistantFunc):
     dir_prefix = "dir:"
     file_prefix = "file:"
@@ -75,13 +113,15 @@ class SrpmExploreFiles(assistant_funcs.OpenAIAssistantFunc):
             }
         }
 
-    # Shared rpm cache. Stores a list of files, licenses, docs, and dirs for each rpm file. Key is the rpm file path.
-    srpm_cache = None
+    # Shared listing cache, key is (build dir, search dir, max_depth). Build trees don't change once prepped, the TTL
+    # only guards against one being re-prepped underneath a long lived process.
+    srpm_cache = cache.registry.create("srpm_listings", max_entries=512, ttl=600,
+                                       sizeof=lambda listing: sys.getsizeof(listing) + sum(sys.getsizeof(item) for item in listing))
+
+    remote_path_args = ["srpm_file"]
 
     def __init__(self) -> None:
         super().__init__(self.__srpm_explore_files_name, self.__srpm_explore_files_description, self.__srpm_explore_files_parameters)
-        if SrpmExploreFiles.srpm_cache is None:
-            SrpmExploreFiles.srpm_cache = {}
 
     def call(self, srpm_file:str, search_dir:str=".", max_depth:int=1) -> str:
         # Check if file exists!
@@ -94,6 +134,9 @@ class SrpmExploreFiles(assistant_funcs.OpenAIAssistantFunc):
             return f"{err}"
         return self.srpm_explore_contents(srpm_file, search_dir, max_depth)
 
+    def remote_request(self, args:dict) -> dict:
+        return remote_srpm_request(super().remote_request(args), args["srpm_file"])
+
     def srpm_explore_contents(self, srpm_file: str, search_dir:str, max_depth: int) -> list[str]:
         build_dir = srpm_cache.get_from_cache(srpm_file)
         #base_path_abs = sanitize_path(build_dir, ".")
@@ -102,29 +145,22 @@ class SrpmExploreFiles(assistant_funcs.OpenAIAssistantFunc):
         except ValueError as e:
             return e
 
-        # Get all files and dirs using 'find'
-        files = []
-        dirs = []
-        base_depth = final_path.count(os.path.sep)
-        p_debug = True
-        for root, dir_list, file_list in os.walk(final_path):
-            relative_depth = root.count(os.path.sep) - base_depth
-
-            if max_depth > 0 and relative_depth >= max_depth:
-                continue
-
-            dirs.extend([os.path.join(root, dir) for dir in dir_list])
-            files.extend([os.path.join(root, file) for file in file_list])
-
-            # for file in file_list:
-            #     if os.path.isfile(os.path.join(root, file)):
-            #         files.append(os.path.join(root, file))
-            #     else:
-            #         dirs.append(os.path.join(root, file))
-
-        # Remove the common prefix from the paths
-        files = [file.removeprefix(final_path+os.path.sep) for file in files]
-        dirs = [dir.removeprefix(final_path+os.path.sep) for dir in dirs]
+        cache_key = (os.path.abspath(build_dir), final_path, max_depth)
+        cached = SrpmExploreFiles.srpm_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        # Trees are listed from their manifest, anything outside one (or reached through a symlink) is walked directly
+        tree = manifest.get_manifest(build_dir)
+        relative = os.path.relpath(final_path, tree.build_dir)
+        relative = "" if relative == "." else relative
+        if relative == ".." or relative.startswith(".." + os.path.sep) or not tree.is_dir(relative):
+            files, dirs = walk_listing(final_path, max_depth)
+        else:
+            files, dirs = tree.walk(relative, max_depth)
+            if relative:
+                files = [os.path.relpath(file, relative) for file in files]
+                dirs = [os.path.relpath(dir, relative) for dir in dirs]
 
         # Format the paths
         files = [f"{self.file_prefix}{file}" for file in files]
@@ -134,6 +170,7 @@ class SrpmExploreFiles(assistant_funcs.OpenAIAssistantFunc):
         all_files = list(set(files + dirs))
         all_files.sort(key=lambda x: x.split(":", 1)[1])
 
+        SrpmExploreFiles.srpm_cache[cache_key] = tuple(all_files)
         return all_files
 
 class SrpmReadFile(assistant_funcs.OpenAIAssistantFunc):
@@ -153,13 +190,16 @@ class SrpmReadFile(assistant_funcs.OpenAIAssistantFunc):
             "max_lines": {
                 "type": "integer",
                 "description": "OPTIONAL (default '10'): The maximum number of lines to read from the file."
-            }
+            },
+            **lineindex.range_parameters,
         }
 
+    remote_path_args = ["srpm_file"]
+
     def __init__(self) -> None:
         super().__init__(self.__srpm_read_file_name, self.__rpmDependencyInfoDescription, self.__rpmDependencyInfoParameters)
 
-    def call(self, srpm_file:str, file_path:str, max_lines:int=10) -> str:
+    def call(self, srpm_file:str, file_path:str, max_lines:int=10, start_line:int=None, end_line:int=None, byte_offset:int=None, byte_count:int=None) -> str:
         # Check if file exists!
         abs_path = os.path.abspath(srpm_file)
         if not os.path.exists(abs_path):
@@ -168,9 +208,12 @@ class SrpmReadFile(assistant_funcs.OpenAIAssistantFunc):
         if max_lines <= 0:
             err = ValueError(f"max_lines must be greater than 0")
             return f"{err}"
-        return self.srpm_read_file(srpm_file, file_path, max_lines)
+        return self.srpm_read_file(srpm_file, file_path, max_lines, start_line, end_line, byte_offset, byte_count)
 
-    def srpm_read_file(self, rpm_file:str, file_path:str, max_lines:int=10) -> str:
+    def remote_request(self, args:dict) -> dict:
+        return remote_srpm_request(super().remote_request(args), args["srpm_file"])
+
+    def srpm_read_file(self, rpm_file:str, file_path:str, max_lines:int=10, start_line:int=None, end_line:int=None, byte_offset:int=None, byte_count:int=None) -> str:
         build_dir = srpm_cache.get_from_cache(rpm_file)
         try:
             final_path = sanitize_path(build_dir, file_path)
@@ -182,16 +225,12 @@ class SrpmReadFile(assistant_funcs.OpenAIAssistantFunc):
 
          # Try to read the file if we can
         try:
-            with open(final_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                if len(lines) > max_lines:
-                    lines = lines[:max_lines]
-                # Join the lines into a single string with '\n' between each line
-                lines = "".join(lines)
-                return lines
+            return lineindex.read_slice(final_path, max_lines, start_line, end_line, byte_offset, byte_count)
         except UnicodeDecodeError:
             err = ValueError(f"File '{rpm_file}' does not appear to be a text file, refusing to print.")
             return f"{err}"
+        except ValueError as e:
+            return f"{e}"
 
 # Only run tests when this file is run directly
 if __name__ == "__main__":
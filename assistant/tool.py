@@ -0,0 +1,76 @@
+#!/bin/python3
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Runs the assistant's tools directly, without a model. Useful for scripted triage, and for priming the caches before
+# a review. Nothing here imports the OpenAI or Azure SDKs, so startup is fast.
+#
+# Usage:
+#   tool.py --list                                    Print the schema of every registered tool
+#   tool.py <tool> [name=value ...] [--build-dir=DIR] Run one tool, ie 'tool.py rpm_file_list rpm_file=nano.rpm max_depth=2'
+#   tool.py - [--build-dir=DIR]                       Run many calls, one JSON object per line on stdin:
+#                                                       {"tool": "rpm_name", "args": {"rpm_file": "nano.rpm"}}
+#
+# Values are parsed as JSON where possible, so max_depth=2 is an int and force=true is a bool. --build-dir registers
+# the prepped BUILD directory for every .src.rpm the calls refer to.
+#
+# Each call prints one JSON object: {"tool", "args", "result", "seconds"}, or {"tool", "args", "error"} if it failed.
+
+import json
+import sys
+import time
+
+import assistant
+import srpm.srpm
+
+def parse_value(value:str):
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+def run_tool(tools, name:str, args:dict, build_dir:str=None) -> dict:
+    if build_dir and "srpm_file" in args:
+        srpm.srpm.srpm_cache.register(args["srpm_file"], build_dir)
+    start = time.perf_counter()
+    try:
+        result = tools.getFunction(name).call(**args)
+    except Exception as e:
+        return {"tool": name, "args": args, "error": f"{e}"}
+    return {"tool": name, "args": args, "result": result, "seconds": round(time.perf_counter() - start, 6)}
+
+if __name__ == "__main__":
+    build_dir = None
+    for a in sys.argv:
+        if a.startswith("--build-dir="):
+            build_dir = a.split("=", 1)[1]
+    args = [a for a in sys.argv[1:] if not a.startswith("--build-dir=")]
+    if not args:
+        raise ValueError("Usage: python3 tool.py --list | <tool> [name=value ...] | - [--build-dir=DIR]")
+
+    tools = assistant.get_all_tools()
+    if args[0] == "--list":
+        print(json.dumps(tools.getFunctions(), indent=2))
+        exit(0)
+
+    if args[0] == "-":
+        failed = False
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output = run_tool(tools, request["tool"], request.get("args", {}), build_dir)
+            failed = failed or "error" in output
+            print(json.dumps(output, default=str), flush=True)
+        exit(1 if failed else 0)
+
+    call_args = {}
+    for a in args[1:]:
+        if "=" not in a:
+            raise ValueError(f"Expected name=value, got '{a}'")
+        key, value = a.split("=", 1)
+        call_args[key] = parse_value(value)
+    output = run_tool(tools, args[0], call_args, build_dir)
+    print(json.dumps(output, default=str, indent=2))
+    exit(1 if "error" in output else 0)
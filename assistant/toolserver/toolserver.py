@@ -0,0 +1,194 @@
+#!/bin/python3
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# A long lived process that runs the stateless rpm/srpm tools on behalf of any number of assistant processes, so the
+# file list caches stay warm between runs instead of being rebuilt by every process.
+#
+# The protocol is one JSON object per line over a Unix socket. Requests are either a tool call:
+#   {"tool": "rpm_file_list", "args": {"rpm_file": "/abs/nano.rpm", "max_depth": 2}, "build_dir": "/abs/BUILD"}
+# ("build_dir" is only sent for srpm tools) or an operation: {"op": "ping"} / {"op": "stats"}. Each request gets one
+# reply line, {"result": ...} or {"error": ...}.
+#
+# Clients forward calls here when LICENSE_ASSISTANT_TOOL_SOCKET is set (see OpenAiAssistantFuncManager.callFunction),
+# and fall back to running the tool in-process if the server can't be reached.
+#
+# Usage: toolserver.py [--socket=PATH]
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from assistant_funcs import assistant_funcs
+from cache import cache
+from rpm import rpm
+from srpm import srpm
+from provenance import provenance
+from headers import headers
+
+class ToolServerUnavailable(Exception):
+    """The server could not be reached, the caller should run the tool itself."""
+    pass
+
+class RemoteToolError(Exception):
+    """The tool ran on the server and failed."""
+    pass
+
+class ToolClient:
+    # After a connection failure, don't try the server again for this long
+    retry_after = 30
+
+    def __init__(self, socket_path:str) -> None:
+        self.socket_path = socket_path
+        # One connection per thread, so concurrent tool calls don't interleave
+        self.local = threading.local()
+        self.down_until = 0
+
+    def __connection(self):
+        if getattr(self.local, "sock", None) is None:
+            self.local.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.local.sock.connect(self.socket_path)
+            self.local.reader = self.local.sock.makefile('rb')
+        return self.local.sock, self.local.reader
+
+    def __close(self) -> None:
+        if getattr(self.local, "sock", None) is not None:
+            self.local.sock.close()
+        self.local.sock = None
+
+    def send(self, request:dict) -> dict:
+        if time.monotonic() < self.down_until:
+            raise ToolServerUnavailable(f"{self.socket_path} failed recently")
+        try:
+            sock, reader = self.__connection()
+            sock.sendall(json.dumps(request).encode('utf-8') + b"\n")
+            line = reader.readline()
+            if not line:
+                raise ConnectionError("server closed the connection")
+        except OSError as e:
+            self.__close()
+            self.down_until = time.monotonic() + self.retry_after
+            raise ToolServerUnavailable(f"{self.socket_path}: {e}")
+        return json.loads(line)
+
+    def call(self, request:dict) -> str:
+        reply = self.send(request)
+        if "error" in reply:
+            raise RemoteToolError(reply["error"])
+        return reply["result"]
+
+clients = {}
+clients_lock = threading.Lock()
+
+def get_client(socket_path:str) -> ToolClient:
+    with clients_lock:
+        if socket_path not in clients:
+            clients[socket_path] = ToolClient(socket_path)
+        return clients[socket_path]
+
+def default_socket_path() -> str:
+    return os.environ.get("LICENSE_ASSISTANT_TOOL_SOCKET", os.path.join(assistant_funcs.get_cache_dir("toolserver"), "tools.sock"))
+
+class ToolServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path:str) -> None:
+        self.tools = {}
+        for func in [rpm.RpmName(), rpm.RpmFileList(), rpm.RpmDependencyInfo(), rpm.RpmReadFile(), srpm.SrpmExploreFiles(), srpm.SrpmReadFile(),
+                     provenance.SourceProvenance(), headers.SrpmHeaderClusters()]:
+            self.tools[func.name()] = func
+        self.started = time.time()
+        self.stats_lock = threading.Lock()
+        self.calls = {}
+        self.errors = 0
+        self.connections = 0
+        self.__remove_stale_socket(socket_path)
+        super().__init__(socket_path, ToolServer.Handler)
+        os.chmod(socket_path, 0o600)
+
+    def __remove_stale_socket(self, socket_path:str) -> None:
+        if not os.path.exists(socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.remove(socket_path)
+            return
+        finally:
+            probe.close()
+        raise ValueError(f"A tool server is already listening on {socket_path}")
+
+    def handle_request_line(self, request:dict) -> dict:
+        op = request.get("op", "call")
+        if op == "ping":
+            return {"result": "pong"}
+        if op == "stats":
+            return {"result": self.stats()}
+        if op != "call":
+            return {"error": f"Unknown op '{op}'"}
+
+        name = request.get("tool")
+        if name not in self.tools:
+            return {"error": f"Function not found: {name}"}
+        with self.stats_lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        try:
+            if "build_dir" in request:
+                srpm.srpm_cache.register(request["args"]["srpm_file"], request["build_dir"])
+            return {"result": f"{self.tools[name].call(**request['args'])}"}
+        except Exception as e:
+            with self.stats_lock:
+                self.errors += 1
+            return {"error": f"{e}"}
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "connections": self.connections,
+                "calls": dict(self.calls),
+                "errors": self.errors,
+                "caches": cache.registry.stats(),
+            }
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            with self.server.stats_lock:
+                self.server.connections += 1
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    reply = self.server.handle_request_line(json.loads(line))
+                except json.JSONDecodeError as e:
+                    reply = {"error": f"Bad request: {e}"}
+                self.wfile.write(json.dumps(reply, default=str).encode('utf-8') + b"\n")
+                self.wfile.flush()
+
+if __name__ == "__main__":
+    socket_path = default_socket_path()
+    for a in sys.argv[1:]:
+        if a.startswith("--socket="):
+            socket_path = a.split("=", 1)[1]
+    server = ToolServer(socket_path)
+    print(f"Serving {len(server.tools)} tools on {socket_path}")
+    print(f"export LICENSE_ASSISTANT_TOOL_SOCKET={socket_path}")
+    # Shut down cleanly, removing the socket, when stopped by a service manager too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
@@ -0,0 +1,119 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Span based tracing, written in the Chrome trace event format.
+# Set LICENSE_ASSISTANT_TRACE=<path.json> (or pass --trace=<path.json>) and every model run, status poll, tool call and
+# rpm subprocess is recorded as a span on the thread it ran on. The file opens in chrome://tracing or
+# https://ui.perfetto.dev as a timeline, which shows where the critical path of a run actually is.
+#
+# When tracing is off, span() hands back a shared object that does nothing, so call sites cost next to nothing.
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+class Tracer:
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self.pid = os.getpid()
+        self.started = time.perf_counter_ns()
+        self.lock = threading.Lock()
+        self.events = []
+        self.named_threads = set()
+
+    def add(self, name:str, category:str, start_ns:int, end_ns:int, args:dict) -> None:
+        tid = threading.get_native_id()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start_ns - self.started) / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": self.pid,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = {key: value if isinstance(value, (int, float, bool, str)) or value is None else str(value)
+                             for key, value in args.items()}
+        with self.lock:
+            if tid not in self.named_threads:
+                self.named_threads.add(tid)
+                self.events.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                                    "args": {"name": threading.current_thread().name}})
+            self.events.append(event)
+
+    def save(self) -> None:
+        """Writes every span recorded so far, replacing the file atomically."""
+        with self.lock:
+            document = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".trace-")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(document, f)
+        os.replace(tmp_path, self.path)
+
+class Span:
+    __slots__ = ["tracer", "name", "category", "args", "start_ns"]
+
+    def __init__(self, tracer:Tracer, name:str, category:str, args:dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self) -> "Span":
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer.add(self.name, self.category, self.start_ns, time.perf_counter_ns(), self.args)
+
+    def set(self, **args) -> None:
+        """Adds arguments that are only known once the span is under way, ie a run's final status."""
+        self.args.update(args)
+
+class NullSpan:
+    __slots__ = []
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        pass
+
+    def set(self, **args) -> None:
+        pass
+
+null_span = NullSpan()
+tracer = None
+
+def span(name:str, category:str="", **args):
+    """Returns a context manager timing the enclosed block, or a no-op when tracing is off."""
+    if tracer is None:
+        return null_span
+    return Span(tracer, name, category, args)
+
+def start(path:str) -> Tracer:
+    """Starts recording spans, they are saved to path when the process exits or stop() is called.
+    :rtype: Tracer
+    """
+    global tracer
+    if tracer is None:
+        tracer = Tracer(path)
+        atexit.register(stop)
+    return tracer
+
+def stop() -> None:
+    global tracer
+    if tracer is not None:
+        tracer.save()
+        print(f"Trace with {len(tracer.events)} events written to {tracer.path}")
+        tracer = None
+
+if os.environ.get("LICENSE_ASSISTANT_TRACE"):
+    start(os.environ["LICENSE_ASSISTANT_TRACE"])
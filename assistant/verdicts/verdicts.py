@@ -0,0 +1,127 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Persistent cache of per-package review results.
+# A verdict is the assessment text the model produced for an .rpm, plus any issues it recorded for that .rpm via
+# the provide_assessment function. Verdicts are keyed by everything that could change the answer: the content of the
+# .rpm, the .spec and the .src.rpm, the model deployment, and a version string covering the prompts and tool schemas.
+# If none of those changed, the previous verdict is still valid and the model does not need to be asked again.
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+# Importers already have the package root on the path, only a direct run needs it added
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from assistant_funcs import assistant_funcs
+from cache import cache
+
+def hash_file(path:str) -> str:
+    """Returns the sha256 of a file's contents. Results are memoized on (path, size, mtime).
+    :rtype: str
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    memoized = hash_file.memo.get(memo_key)
+    if memoized is not None:
+        return memoized
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    # The memo is bounded and shared, the entry may already be evicted by the time it would be read back
+    hexdigest = digest.hexdigest()
+    hash_file.memo[memo_key] = hexdigest
+    return hexdigest
+hash_file.memo = cache.registry.create("file_hashes", max_entries=100000)
+
+def hash_text(*parts) -> str:
+    """Returns a sha256 over a sequence of strings.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def issues_for_package(issues:list[dict], rpm_file:str) -> list[dict]:
+    """Picks the issues that were recorded against a given .rpm, by the package they name. Issues recorded before
+    assessments named their package fall back to the file, which may be the package by path or basename, with or
+    without the .rpm suffix. Matches are exact, so issues for 'libfoo-1.0' never land on 'foo-1.0'.
+    :rtype: list[dict]
+    """
+    stem = os.path.basename(rpm_file).removesuffix(".rpm")
+    def matches(issue):
+        if issue.get("package"):
+            return issue["package"] == rpm_file
+        return issue["file"] and os.path.basename(issue["file"]).removesuffix(".rpm") == stem
+    return [issue for issue in issues if matches(issue)]
+
+def reassign_issues(issues:list[dict], from_rpm_file:str, to_rpm_file:str) -> list[dict]:
+    """Copies one package's issues over to another, ie to a new release or a build for another architecture. Files
+    inside the package keep their path, the package itself is renamed.
+    :rtype: list[dict]
+    """
+    renamed = {from_rpm_file, os.path.basename(from_rpm_file), os.path.basename(from_rpm_file).removesuffix(".rpm")}
+    return [dict(issue, package=to_rpm_file, file=to_rpm_file if issue["file"] in renamed else issue["file"]) for issue in issues]
+
+class VerdictCache:
+    def __init__(self, cache_dir:str=None) -> None:
+        self.cache_dir = cache_dir if cache_dir else assistant_funcs.get_cache_dir("verdicts")
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, rpm_file:str, spec_file:str, srpm_file:str, deployment:str, schema_version:str) -> str:
+        """Builds the cache key for a single .rpm.
+        :rtype: str
+        """
+        return hash_text(hash_file(rpm_file), hash_file(spec_file), hash_file(srpm_file), deployment, schema_version)
+
+    def job_key(self, package_keys:list[str]) -> str:
+        """Builds the cache key for the results that span every package in a job (summary, suggestions).
+        :rtype: str
+        """
+        return hash_text("job", *sorted(package_keys))
+
+    def __path(self, key:str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key:str) -> dict:
+        """Returns the cached entry for a key, or None.
+        :rtype: dict
+        """
+        try:
+            with open(self.__path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key:str, entry:dict) -> None:
+        # Write to a temporary file first so a crash never leaves a truncated entry behind.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, self.__path(key))
+
+    def get_verdict(self, key:str) -> tuple:
+        """Returns the cached (result_text, issues) for a package, or None.
+        :rtype: tuple
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        return entry["result_text"], entry["issues"]
+
+    def put_verdict(self, key:str, rpm_file:str, result_text:str, issues:list[dict]) -> None:
+        self.put(key, {
+            "rpm_file": os.path.basename(rpm_file),
+            "result_text": result_text,
+            "issues": issues,
+        })